@@ -0,0 +1,64 @@
+import base64
+import json
+
+from archive import ARCHIVE_TABLE, rehydrate
+from config import EXPORT_PAGE_SIZE
+from pagination import user_rows
+
+# (record type, table, keyset columns, descending), exported in this order.
+# Keyset columns must identify a row, since they double as the resume cursor.
+EXPORT_SECTIONS = (
+    ('settings', 'user_settings', ('user_id',), False),
+    ('subscription', 'subscriptions', ('id',), False),
+    ('usage', 'daily_usage', ('date',), False),
+    ('summary', 'summaries', ('created_at', 'id'), True),
+    ('archived_summary', ARCHIVE_TABLE, ('created_at', 'id'), True)
+)
+SECTION_NAMES = [section[0] for section in EXPORT_SECTIONS]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(section, after):
+    data = json.dumps({'s': section, 'a': list(after)}, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(section name, keyset values) from a cursor emitted by export_records."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        section, after = data['s'], tuple(data['a'])
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor('Invalid export cursor') from e
+    if section not in SECTION_NAMES:
+        raise InvalidCursor('Invalid export cursor')
+    return section, after
+
+
+def export_records(client, user_id, cursor=None, page_size=EXPORT_PAGE_SIZE):
+    """
+    Yield {'type', 'cursor', 'data'} for every record the user owns.
+
+    Each table is read one keyset page at a time, so memory use doesn't
+    grow with history. Every record carries the cursor that resumes the
+    export right after it; pass it back to continue an interrupted
+    download. Raises InvalidCursor for a cursor this function didn't make.
+    """
+    start_section, start_after = decode_cursor(cursor) if cursor else (None, None)
+    started = start_section is None
+
+    for name, table, keys, desc in EXPORT_SECTIONS:
+        after = None
+        if not started:
+            if name != start_section:
+                continue
+            started = True
+            after = start_after
+
+        for row in user_rows(client, table, user_id, page_size, after=after, keys=keys, desc=desc):
+            position = tuple(row[key] for key in keys)
+            data = rehydrate(row) if table == ARCHIVE_TABLE else row
+            yield {'type': name, 'cursor': encode_cursor(name, position), 'data': data}
@@ -0,0 +1,147 @@
+import atexit
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from datetime import datetime
+
+from config import API_KEY_REFRESH_SECONDS
+from usage_buffer import UsageBuffer
+
+API_KEYS_TABLE = 'api_keys'
+API_KEY_USAGE_TABLE = 'api_key_usage'
+
+# Keys look like lr_<prefix>_<secret>; the prefix is stored in clear to find the row
+KEY_SCHEME = 'lr'
+# Unknown prefixes trigger an early reload at most this often, so random keys can't hammer the table
+MISS_REFRESH_SECONDS = 5.0
+
+# Columns returned to key owners (never the hash)
+PUBLIC_COLUMNS = 'id,name,key_prefix,daily_quota,requests_per_minute,revoked_at,created_at'
+
+
+def hash_api_key(key):
+    # Keys carry 256 bits of randomness, so a plain digest is enough (no need for a slow KDF)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def generate_api_key():
+    """Returns (key, prefix, hash). The key itself is only ever shown once."""
+    prefix = secrets.token_hex(4)
+    key = f"{KEY_SCHEME}_{prefix}_{secrets.token_urlsafe(32)}"
+    return key, prefix, hash_api_key(key)
+
+
+def parse_prefix(key):
+    parts = key.split('_', 2)
+    if len(parts) != 3 or parts[0] != KEY_SCHEME or not parts[1] or not parts[2]:
+        return None
+    return parts[1]
+
+
+def looks_like_api_key(value):
+    return bool(value) and value.startswith(KEY_SCHEME + '_')
+
+
+class ApiKeyStore:
+    """
+    In-memory view of the active rows in api_keys, keyed by prefix.
+
+    Verifying a key is a dict lookup plus a constant-time hash compare; the
+    table is re-read every `refresh_seconds`, or sooner when an unknown
+    prefix shows up (a key created on another worker). Revocations made by
+    this worker apply immediately.
+    """
+
+    def __init__(self, refresh_seconds=API_KEY_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._keys = {}
+        self._last_refresh = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def maybe_refresh(self, client, min_interval=None):
+        now = time.monotonic()
+        interval = self.refresh_seconds if min_interval is None else min_interval
+        with self._lock:
+            if self._refreshing or now - self._last_refresh < interval:
+                return
+            self._refreshing = True
+        try:
+            self.refresh(client)
+        finally:
+            with self._lock:
+                self._refreshing = False
+                self._last_refresh = time.monotonic()
+
+    def refresh(self, client):
+        try:
+            result = client.table(API_KEYS_TABLE).select(
+                'id,user_id,key_prefix,key_hash,daily_quota,requests_per_minute'
+            ).is_('revoked_at', 'null').execute()
+        except Exception as e:
+            print(f"Error refreshing API keys: {e}")
+            return
+        keys = {row['key_prefix']: row for row in result.data or []}
+        with self._lock:
+            self._keys = keys
+
+    def verify(self, client, key):
+        """The api_keys row for `key`, or None if it is unknown, malformed or revoked."""
+        prefix = parse_prefix(key)
+        if prefix is None:
+            return None
+
+        self.maybe_refresh(client)
+        record = self._keys.get(prefix)
+        if record is None:
+            self.maybe_refresh(client, min_interval=MISS_REFRESH_SECONDS)
+            record = self._keys.get(prefix)
+        if record is None or not hmac.compare_digest(record['key_hash'], hash_api_key(key)):
+            return None
+        return record
+
+    def forget(self, prefix):
+        with self._lock:
+            self._keys = {p: row for p, row in self._keys.items() if p != prefix}
+
+
+api_key_store = ApiKeyStore()
+
+# Per-key daily counters, flushed to api_key_usage alongside daily_usage
+api_key_usage = UsageBuffer(table=API_KEY_USAGE_TABLE, owner_column='api_key_id', increment_rpc='increment_api_key_usage')
+atexit.register(api_key_usage.close)
+
+
+def create_api_key(client, user_id, name, daily_quota=None, requests_per_minute=None):
+    """Store a new key for `user_id`. Returns (row, key); `key` is not recoverable later."""
+    key, prefix, key_hash = generate_api_key()
+    result = client.table(API_KEYS_TABLE).insert({
+        'user_id': user_id,
+        'name': name,
+        'key_prefix': prefix,
+        'key_hash': key_hash,
+        'daily_quota': daily_quota,
+        'requests_per_minute': requests_per_minute
+    }).execute()
+    if not result.data:
+        raise Exception("Failed to create API key")
+    row = {column: result.data[0].get(column) for column in PUBLIC_COLUMNS.split(',')}
+    return row, key
+
+
+def list_api_keys(client, user_id):
+    result = client.table(API_KEYS_TABLE).select(PUBLIC_COLUMNS).eq('user_id', user_id) \
+        .order('created_at', desc=True).execute()
+    return result.data or []
+
+
+def revoke_api_key(client, user_id, key_id):
+    """Revoke one of `user_id`'s keys. Returns False if it doesn't exist."""
+    result = client.table(API_KEYS_TABLE).update({'revoked_at': datetime.utcnow().isoformat()}) \
+        .eq('user_id', user_id).eq('id', key_id).is_('revoked_at', 'null').execute()
+    if not result.data:
+        return False
+    api_key_store.forget(result.data[0]['key_prefix'])
+    return True
@@ -0,0 +1,159 @@
+import base64
+import gzip
+import json
+import threading
+from datetime import datetime, timedelta
+
+from config import (
+    ARCHIVE_AFTER_DAYS,
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_INTERVAL_SECONDS,
+    ARCHIVE_SEARCH_SCAN_LIMIT
+)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SUMMARIES_TABLE = 'summaries'
+ARCHIVE_TABLE = 'summaries_archive'
+
+# Columns kept uncompressed on the archive row so it can be listed and filtered
+INDEX_COLUMNS = ('id', 'user_id', 'source_url', 'character_count', 'content_hash', 'created_at')
+
+
+def compress_row(row):
+    data = json.dumps(row, separators=(',', ':'), default=str).encode('utf-8')
+    if zstandard is not None:
+        return 'zstd', base64.b64encode(zstandard.ZstdCompressor(level=10).compress(data)).decode('ascii')
+    return 'gzip', base64.b64encode(gzip.compress(data, compresslevel=9)).decode('ascii')
+
+
+def decompress_row(codec, payload):
+    data = base64.b64decode(payload)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read this archived summary")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        data = gzip.decompress(data)
+    return json.loads(data)
+
+
+def rehydrate(archive_row):
+    """Full summary row from an archive row, marked as archived."""
+    row = decompress_row(archive_row['codec'], archive_row['payload'])
+    row['archived'] = True
+    return row
+
+
+def archive_old_summaries(client, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Move summaries older than `older_than_days` into summaries_archive.
+
+    Works in batches: each batch is written to the archive (upsert, so a
+    crash between the two steps only repeats work) and then deleted from
+    the hot table. Returns the number of summaries archived.
+    """
+    cutoff = (datetime.utcnow() - timedelta(days=older_than_days)).isoformat()
+    archived = 0
+    while True:
+        result = client.from_(SUMMARIES_TABLE).select('*').lt('created_at', cutoff) \
+            .order('created_at').limit(batch_size).execute()
+        rows = result.data or []
+        if not rows:
+            break
+
+        now = datetime.utcnow().isoformat()
+        archive_rows = []
+        for row in rows:
+            codec, payload = compress_row(row)
+            archive_rows.append({
+                **{column: row.get(column) for column in INDEX_COLUMNS},
+                'archived_at': now,
+                'codec': codec,
+                'payload': payload
+            })
+
+        client.from_(ARCHIVE_TABLE).upsert(archive_rows, on_conflict='id').execute()
+        client.from_(SUMMARIES_TABLE).delete().in_('id', [row['id'] for row in rows]).execute()
+        archived += len(rows)
+        print(f"Archived {len(rows)} summaries older than {cutoff}")
+
+        if len(rows) < batch_size:
+            break
+    return archived
+
+
+def get_archived_summary(client, user_id, summary_id):
+    result = client.from_(ARCHIVE_TABLE).select('*').eq('user_id', user_id).eq('id', summary_id).execute()
+    if not result.data:
+        return None
+    return rehydrate(result.data[0])
+
+
+def search_archived(client, user_id, query, limit):
+    """
+    Archived summaries whose source URL or text contains `query`.
+
+    Only index columns are stored uncompressed, so the text match
+    decompresses the newest ARCHIVE_SEARCH_SCAN_LIMIT archived rows.
+    """
+    needle = query.lower()
+    result = client.from_(ARCHIVE_TABLE).select('*').eq('user_id', user_id) \
+        .order('created_at', desc=True).limit(ARCHIVE_SEARCH_SCAN_LIMIT).execute()
+
+    matches = []
+    for archive_row in result.data or []:
+        if needle in (archive_row.get('source_url') or '').lower():
+            matches.append(rehydrate(archive_row))
+        else:
+            row = rehydrate(archive_row)
+            if needle in (row.get('summary') or '').lower():
+                matches.append(row)
+        if len(matches) >= limit:
+            break
+    return matches
+
+
+def delete_archived(client, user_id, ids):
+    """Delete archived summaries by id. Returns the ids that were removed."""
+    if not ids:
+        return []
+    result = client.from_(ARCHIVE_TABLE).delete().eq('user_id', user_id).in_('id', ids).execute()
+    return [row['id'] for row in result.data or []]
+
+
+def start_archiver(get_client, interval=ARCHIVE_INTERVAL_SECONDS):
+    """
+    Run the archiver every `interval` seconds in a daemon thread (0 disables it).
+    `get_client()` returns the Supabase client, so nothing is built unless it runs.
+    """
+    if interval <= 0:
+        return None
+
+    stopped = threading.Event()
+
+    def run():
+        while not stopped.wait(interval):
+            try:
+                archive_old_summaries(get_client())
+            except Exception as e:
+                print(f"Error archiving summaries: {e}")
+
+    thread = threading.Thread(target=run, name='summary-archiver', daemon=True)
+    thread.stopped = stopped
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    # One-off run, e.g. from a scheduled job: python archive.py
+    from dotenv import load_dotenv
+    from supabase import create_client
+    import os
+
+    load_dotenv()
+    supabase = create_client(os.environ.get('SUPABASE_URL'), os.environ.get('SUPABASE_KEY'))
+    print(f"Archived {archive_old_summaries(supabase)} summaries")
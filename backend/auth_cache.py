@@ -0,0 +1,205 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import jwt
+
+from config import (
+    JWT_SECRET,
+    TOKEN_CACHE_SIZE,
+    TOKEN_REVOCATION_REFRESH_SECONDS
+)
+
+JWT_ALGORITHM = "HS256"
+
+# Table holding revoked token IDs (jti) and per-user "revoke everything issued
+# before" cutoffs. See migrations/001_token_revocations.sql.
+REVOCATIONS_TABLE = 'token_revocations'
+
+
+class TokenRevokedError(jwt.InvalidTokenError):
+    """Raised when a structurally valid token has been revoked."""
+
+
+def token_digest(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class TokenCache:
+    """
+    Small LRU of verified token digests -> decoded claims.
+
+    Entries are only served until the token's own `exp`, so a cached token
+    never outlives what `jwt.decode` would have accepted.
+    """
+
+    def __init__(self, max_size=TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            claims, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return claims
+
+    def put(self, digest, claims):
+        expires_at = claims.get('exp')
+        if not expires_at:
+            return
+        with self._lock:
+            self._entries[digest] = (claims, expires_at)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard_user(self, user_id):
+        with self._lock:
+            for digest in [d for d, (claims, _) in self._entries.items() if claims.get('sub') == user_id]:
+                del self._entries[digest]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RevocationList:
+    """
+    In-memory view of the token_revocations table.
+
+    Lookups never hit the database; the table is re-read at most once every
+    `refresh_seconds` from whichever request notices the list is stale.
+    Revocations made by this worker are applied locally right away; ones
+    made by other workers take effect here within `refresh_seconds`. The
+    check runs on every request, cached tokens included, so that is the
+    whole window.
+    """
+
+    def __init__(self, refresh_seconds=TOKEN_REVOCATION_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._revoked_jtis = {}       # jti -> expiry timestamp
+        self._revoked_before = {}     # user_id -> issued-at cutoff timestamp
+        self._last_refresh = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def is_revoked(self, claims):
+        jti = claims.get('jti')
+        if jti and jti in self._revoked_jtis:
+            return True
+        cutoff = self._revoked_before.get(claims.get('sub'))
+        # iat has whole-second precision: a token issued in the second of the
+        # cutoff was issued after it (e.g. the login right after a revocation)
+        return cutoff is not None and claims.get('iat', 0) < cutoff
+
+    def maybe_refresh(self, client):
+        now = time.monotonic()
+        with self._lock:
+            if self._refreshing or now - self._last_refresh < self.refresh_seconds:
+                return
+            self._refreshing = True
+        try:
+            self.refresh(client)
+        finally:
+            with self._lock:
+                self._refreshing = False
+                self._last_refresh = time.monotonic()
+
+    def refresh(self, client):
+        try:
+            now_iso = datetime_from_timestamp(time.time())
+            result = client.table(REVOCATIONS_TABLE).select('jti,user_id,revoked_before,expires_at').gt('expires_at', now_iso).execute()
+        except Exception as e:
+            print(f"Error refreshing token revocations: {e}")
+            return
+
+        revoked_jtis = {}
+        revoked_before = {}
+        for row in result.data or []:
+            if row.get('jti'):
+                revoked_jtis[row['jti']] = timestamp_from_iso(row.get('expires_at'))
+            elif row.get('user_id') and row.get('revoked_before'):
+                cutoff = timestamp_from_iso(row['revoked_before'])
+                revoked_before[row['user_id']] = max(cutoff, revoked_before.get(row['user_id'], 0))
+
+        with self._lock:
+            self._revoked_jtis = revoked_jtis
+            self._revoked_before = revoked_before
+
+    def revoke_token(self, client, claims):
+        """Revoke a single token (logout)."""
+        jti = claims.get('jti')
+        if not jti:
+            # Tokens issued before jti was added can only be revoked per user
+            return self.revoke_user(client, claims['sub'])
+        with self._lock:
+            self._revoked_jtis = {**self._revoked_jtis, jti: claims.get('exp', 0)}
+        client.table(REVOCATIONS_TABLE).insert({
+            'jti': jti,
+            'user_id': claims.get('sub'),
+            'expires_at': datetime_from_timestamp(claims.get('exp', time.time()))
+        }).execute()
+
+    def revoke_user(self, client, user_id, max_token_age_days=7):
+        """Revoke every token issued to `user_id` before the current second (plan change, password reset)."""
+        now = int(time.time())
+        with self._lock:
+            self._revoked_before = {**self._revoked_before, user_id: now}
+        client.table(REVOCATIONS_TABLE).insert({
+            'user_id': user_id,
+            'revoked_before': datetime_from_timestamp(now),
+            # Nothing issued before the cutoff can still be valid after this
+            'expires_at': datetime_from_timestamp(now + max_token_age_days * 86400)
+        }).execute()
+
+
+def datetime_from_timestamp(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
+
+
+def timestamp_from_iso(value):
+    if not value:
+        return 0
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+token_cache = TokenCache()
+revocation_list = RevocationList()
+
+
+def verify_token(token, client=None):
+    """
+    Return the claims for `token`, serving from the LRU when possible.
+
+    Raises the same jwt exceptions as `jwt.decode`, plus TokenRevokedError.
+    """
+    if client is not None:
+        revocation_list.maybe_refresh(client)
+
+    digest = token_digest(token)
+    claims = token_cache.get(digest)
+    if claims is None:
+        claims = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        token_cache.put(digest, claims)
+
+    if revocation_list.is_revoked(claims):
+        raise TokenRevokedError('Token has been revoked')
+    return claims
+
+
+def revoke_user_tokens(client, user_id):
+    """Invalidate all outstanding tokens for a user, e.g. after a plan change."""
+    try:
+        revocation_list.revoke_user(client, user_id)
+        token_cache.discard_user(user_id)
+    except Exception as e:
+        print(f"Error revoking tokens for user {user_id}: {e}")
@@ -0,0 +1,70 @@
+import os
+import threading
+
+import deadlines
+from config import STRIPE_SECRET_KEY, SUPABASE_TIMEOUT_SECONDS
+
+# Heavy SDKs (supabase, google-genai, stripe) are imported and their clients
+# built on first use rather than when a worker boots, so workers start and
+# recycle quickly and routes that never touch an SDK never pay for it.
+
+_lock = threading.Lock()
+_supabase = None
+_gemini = None
+_gemini_failed = False
+_stripe = None
+
+
+def get_supabase():
+    """
+    Shared service-role Supabase client.
+
+    Every query starts here, so a request whose deadline has passed (or
+    whose client has gone away) raises DeadlineExceeded instead of issuing
+    another one; each query is also bounded by SUPABASE_TIMEOUT_SECONDS.
+    """
+    global _supabase
+    deadlines.check()
+    if _supabase is None:
+        with _lock:
+            if _supabase is None:
+                from supabase import ClientOptions, create_client
+                _supabase = create_client(
+                    supabase_url=os.environ.get('SUPABASE_URL'),
+                    supabase_key=os.environ.get('SUPABASE_KEY'),
+                    options=ClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT_SECONDS)
+                )
+    return _supabase
+
+
+def get_gemini():
+    """Shared Gemini client, or None if it isn't configured or couldn't be created."""
+    global _gemini, _gemini_failed
+    if _gemini is None and not _gemini_failed:
+        with _lock:
+            if _gemini is None and not _gemini_failed:
+                api_key = os.getenv("GEMINI_API_KEY")
+                if not api_key:
+                    print("Warning: GEMINI_API_KEY not found in environment variables")
+                    _gemini_failed = True
+                    return None
+                try:
+                    from google import genai
+                    _gemini = genai.Client(api_key=api_key)
+                    print("Successfully initialized Gemini API client")
+                except Exception as e:
+                    print(f"Error configuring Gemini API: {e}")
+                    _gemini_failed = True
+    return _gemini
+
+
+def get_stripe():
+    """The stripe module, configured with our secret key."""
+    global _stripe
+    if _stripe is None:
+        with _lock:
+            if _stripe is None:
+                import stripe
+                stripe.api_key = STRIPE_SECRET_KEY
+                _stripe = stripe
+    return _stripe
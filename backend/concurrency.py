@@ -0,0 +1,154 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from config import (
+    LLM_CONCURRENCY_INITIAL,
+    LLM_CONCURRENCY_MIN,
+    LLM_CONCURRENCY_MAX,
+    LLM_QUEUE_MAX,
+    LLM_QUEUE_TIMEOUT_SECONDS,
+    LLM_LATENCY_TOLERANCE
+)
+
+# Weight of each new sample in the latency baseline (slow-moving EWMA)
+BASELINE_SMOOTHING = 0.05
+# Multiplicative decrease applied when upstream is slow or failing
+DECREASE_FACTOR = 0.75
+
+
+class UpstreamOverloaded(Exception):
+    """Raised when a call is shed instead of queued; carries a Retry-After hint."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Upstream overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on concurrent upstream (Gemini) calls.
+
+    Each call that finishes within `tolerance` x the latency baseline grows
+    the limit by 1/limit (about +1 per round trip of the whole window); a
+    slow or failed call cuts it by DECREASE_FACTOR, at most once per
+    baseline interval so one burst of slow replies isn't punished
+    repeatedly. Callers beyond the limit wait in a bounded queue and are
+    shed with UpstreamOverloaded when it is full or they wait too long.
+    """
+
+    def __init__(self, initial=LLM_CONCURRENCY_INITIAL, min_limit=LLM_CONCURRENCY_MIN,
+                 max_limit=LLM_CONCURRENCY_MAX, max_queue=LLM_QUEUE_MAX,
+                 queue_timeout=LLM_QUEUE_TIMEOUT_SECONDS, tolerance=LLM_LATENCY_TOLERANCE):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.tolerance = tolerance
+        self.baseline = None
+        self.inflight = 0
+        self.queued = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        self._stats = {'admitted': 0, 'shed': 0, 'succeeded': 0, 'failed': 0, 'slow': 0, 'abandoned': 0}
+        self._last_latency = None
+
+    def _retry_after(self):
+        # Roughly one baseline round trip per queued caller ahead of us
+        per_call = self.baseline or 5.0
+        return max(1, math.ceil(per_call * (self.queued + 1) / max(1, int(self.limit))))
+
+    def acquire(self, block=True, timeout=None):
+        """Take a slot, queueing for at most `timeout` (default: the queue timeout)."""
+        with self._condition:
+            if self.inflight < int(self.limit):
+                self.inflight += 1
+                self._stats['admitted'] += 1
+                return
+            if not block or self.queued >= self.max_queue:
+                self._stats['shed'] += 1
+                raise UpstreamOverloaded(self._retry_after())
+
+            self.queued += 1
+            wait = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+            deadline = time.monotonic() + wait
+            try:
+                while self.inflight >= int(self.limit):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['shed'] += 1
+                        raise UpstreamOverloaded(self._retry_after())
+                    self._condition.wait(remaining)
+            finally:
+                self.queued -= 1
+            self.inflight += 1
+            self._stats['admitted'] += 1
+
+    def release(self, latency, success):
+        with self._condition:
+            self.inflight -= 1
+            self._last_latency = latency
+            now = time.monotonic()
+            slow = self.baseline is not None and latency > self.baseline * self.tolerance
+
+            if success and not slow:
+                self._stats['succeeded'] += 1
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            else:
+                self._stats['failed' if not success else 'slow'] += 1
+                if now - self._last_decrease > (self.baseline or 0):
+                    self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+                    self._last_decrease = now
+
+            if success:
+                if self.baseline is None:
+                    self.baseline = latency
+                else:
+                    self.baseline += BASELINE_SMOOTHING * (latency - self.baseline)
+
+            self._condition.notify_all()
+
+    def abandon(self):
+        """Give a slot back without a latency sample: the caller stopped waiting, upstream did nothing wrong."""
+        with self._condition:
+            self.inflight -= 1
+            self._stats['abandoned'] += 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, block=True, timeout=None, neutral=()):
+        """
+        Hold one upstream slot for the duration of the block. Exceptions in
+        `neutral` (the caller giving up) neither grow nor cut the limit.
+        """
+        self.acquire(block=block, timeout=timeout)
+        started = time.monotonic()
+        success = False
+        try:
+            yield
+            success = True
+        except neutral:
+            success = None
+            raise
+        finally:
+            if success is None:
+                self.abandon()
+            else:
+                self.release(time.monotonic() - started, success)
+
+    def state(self):
+        with self._condition:
+            return {
+                'limit': round(self.limit, 2),
+                'inflight': self.inflight,
+                'queued': self.queued,
+                'max_queue': self.max_queue,
+                'baseline_latency_seconds': round(self.baseline, 3) if self.baseline is not None else None,
+                'last_latency_seconds': round(self._last_latency, 3) if self._last_latency is not None else None,
+                **self._stats
+            }
+
+
+llm_limiter = AdaptiveLimiter()
@@ -21,4 +21,155 @@ STRIPE_PRICE_ID = os.environ.get('STRIPE_PRICE_ID')
 
 # Application configuration
 DEBUG = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
-SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-here') 
\ No newline at end of file
+SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-here') 
+
+# Auth cache configuration
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '10000'))
+TOKEN_REVOCATION_REFRESH_SECONDS = float(os.environ.get('TOKEN_REVOCATION_REFRESH_SECONDS', '30'))
+
+# Optional shared Redis for cross-worker state (requires the `redis` package)
+REDIS_URL = os.environ.get('REDIS_URL')
+
+# Reverse proxies in front of the app that append to X-Forwarded-For (1 for the
+# platform router); 0 when clients connect directly, so the header is ignored
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '1'))
+
+# Rate limiting for expensive endpoints (/summarize)
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+RATE_LIMIT_USER_PER_MINUTE = float(os.environ.get('RATE_LIMIT_USER_PER_MINUTE', '10'))
+RATE_LIMIT_USER_BURST = float(os.environ.get('RATE_LIMIT_USER_BURST', '5'))
+RATE_LIMIT_IP_PER_MINUTE = float(os.environ.get('RATE_LIMIT_IP_PER_MINUTE', '30'))
+RATE_LIMIT_IP_BURST = float(os.environ.get('RATE_LIMIT_IP_BURST', '10'))
+RATE_LIMIT_GLOBAL_PER_MINUTE = float(os.environ.get('RATE_LIMIT_GLOBAL_PER_MINUTE', '600'))
+RATE_LIMIT_GLOBAL_BURST = float(os.environ.get('RATE_LIMIT_GLOBAL_BURST', '100'))
+
+# Write-behind buffering for daily_usage
+USAGE_FLUSH_INTERVAL_SECONDS = float(os.environ.get('USAGE_FLUSH_INTERVAL_SECONDS', '5'))
+USAGE_CACHE_TTL_SECONDS = float(os.environ.get('USAGE_CACHE_TTL_SECONDS', '5'))
+# Directory for the crash-safety journal; leave unset to keep increments in memory only
+USAGE_JOURNAL_DIR = os.environ.get('USAGE_JOURNAL_DIR')
+
+# Maximum number of items accepted by the /summaries/bulk endpoints
+SUMMARIES_BULK_MAX_ITEMS = int(os.environ.get('SUMMARIES_BULK_MAX_ITEMS', '500'))
+
+# Response compression for JSON endpoints
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', '6'))
+
+# Speculative generation of regeneration variants for pro users (opt-in per
+# user through the prefetch_variants setting)
+VARIANT_PREFETCH_ENABLED = os.environ.get('VARIANT_PREFETCH_ENABLED', 'True').lower() == 'true'
+VARIANT_PREFETCH_COUNT = int(os.environ.get('VARIANT_PREFETCH_COUNT', '2'))
+VARIANT_PREFETCH_WORKERS = int(os.environ.get('VARIANT_PREFETCH_WORKERS', '4'))
+VARIANT_PREFETCH_WAIT_SECONDS = float(os.environ.get('VARIANT_PREFETCH_WAIT_SECONDS', '30'))
+VARIANT_CACHE_SIZE = int(os.environ.get('VARIANT_CACHE_SIZE', '5000'))
+VARIANT_CACHE_TTL_SECONDS = float(os.environ.get('VARIANT_CACHE_TTL_SECONDS', '1800'))
+# Maximum variants returned by one multi-variant /summarize request
+VARIANT_BATCH_MAX = int(os.environ.get('VARIANT_BATCH_MAX', '4'))
+
+# Graceful shutdown: how long to wait for in-flight requests before exiting
+SHUTDOWN_DRAIN_SECONDS = float(os.environ.get('SHUTDOWN_DRAIN_SECONDS', '60'))
+
+# Key for operational endpoints under /admin (sent as X-Admin-Key); unset disables them
+ADMIN_API_KEY = os.environ.get('ADMIN_API_KEY')
+
+# Adaptive (AIMD) limit on concurrent Gemini calls per worker
+LLM_CONCURRENCY_INITIAL = int(os.environ.get('LLM_CONCURRENCY_INITIAL', '4'))
+LLM_CONCURRENCY_MIN = int(os.environ.get('LLM_CONCURRENCY_MIN', '1'))
+LLM_CONCURRENCY_MAX = int(os.environ.get('LLM_CONCURRENCY_MAX', '32'))
+LLM_QUEUE_MAX = int(os.environ.get('LLM_QUEUE_MAX', '16'))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.environ.get('LLM_QUEUE_TIMEOUT_SECONDS', '10'))
+# A call slower than this multiple of the latency baseline counts as congestion
+LLM_LATENCY_TOLERANCE = float(os.environ.get('LLM_LATENCY_TOLERANCE', '2.0'))
+
+# Archival of old summaries to compressed cold storage
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '180'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '500'))
+# Seconds between background archiver runs in each worker; 0 disables it (use `python archive.py` from a scheduler instead)
+ARCHIVE_INTERVAL_SECONDS = float(os.environ.get('ARCHIVE_INTERVAL_SECONDS', '0'))
+# Newest archived rows decompressed per search
+ARCHIVE_SEARCH_SCAN_LIMIT = int(os.environ.get('ARCHIVE_SEARCH_SCAN_LIMIT', '1000'))
+
+# Enterprise API keys and the NDJSON ingestion endpoint
+# Seconds between re-reads of the api_keys table in each worker
+API_KEY_REFRESH_SECONDS = float(os.environ.get('API_KEY_REFRESH_SECONDS', '60'))
+# Default per-key request rate for /v1/ingest documents (per-key rows can override it)
+API_KEY_PER_MINUTE = float(os.environ.get('API_KEY_PER_MINUTE', '600'))
+# Documents summarized concurrently per ingest request, and documents accepted per request
+INGEST_CONCURRENCY = int(os.environ.get('INGEST_CONCURRENCY', '8'))
+INGEST_MAX_DOCUMENTS = int(os.environ.get('INGEST_MAX_DOCUMENTS', '5000'))
+# Largest ingest body in bytes; the whole body is read before results stream back
+INGEST_MAX_BYTES = int(os.environ.get('INGEST_MAX_BYTES', str(32 * 1024 * 1024)))
+
+# Short-lived cache of Stripe customers/subscriptions shared by the webhook handlers
+STRIPE_CACHE_TTL_SECONDS = float(os.environ.get('STRIPE_CACHE_TTL_SECONDS', '120'))
+STRIPE_CACHE_SIZE = int(os.environ.get('STRIPE_CACHE_SIZE', '2000'))
+
+# Near-duplicate summary cache (MinHash LSH over the input text)
+NEAR_DUPLICATE_ENABLED = os.environ.get('NEAR_DUPLICATE_ENABLED', 'True').lower() == 'true'
+# Estimated Jaccard similarity of word shingles needed to reuse a cached summary
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get('NEAR_DUPLICATE_THRESHOLD', '0.9'))
+NEAR_DUPLICATE_CACHE_SIZE = int(os.environ.get('NEAR_DUPLICATE_CACHE_SIZE', '5000'))
+# Shorter texts have too few shingles for a reliable estimate and are only cached exactly
+NEAR_DUPLICATE_MIN_WORDS = int(os.environ.get('NEAR_DUPLICATE_MIN_WORDS', '40'))
+
+# Stripe -> Supabase subscription reconciliation
+# Seconds between background runs in each worker; 0 disables it (use `python subscription_sync.py` from a scheduler instead)
+STRIPE_SYNC_INTERVAL_SECONDS = float(os.environ.get('STRIPE_SYNC_INTERVAL_SECONDS', '0'))
+# Rows read and written per Supabase call
+STRIPE_SYNC_BATCH_SIZE = int(os.environ.get('STRIPE_SYNC_BATCH_SIZE', '200'))
+
+# Per-request sampling profiler (collapsed-stack files, listed under /admin/profiles)
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/lightread-profiles')
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '200'))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_SECONDS', '0.005'))
+# Fraction of requests profiled at random
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+# Keep a profile of any request slower than this; 0 disables it (when set, every request is sampled)
+PROFILE_SLOW_THRESHOLD_SECONDS = float(os.environ.get('PROFILE_SLOW_THRESHOLD_SECONDS', '0'))
+
+# Local replica of reference tables (usage_limits, enum catalogs)
+REFERENCE_REFRESH_SECONDS = float(os.environ.get('REFERENCE_REFRESH_SECONDS', '300'))
+
+# Summary lists longer than this are fetched page by page and streamed instead of built in memory
+SUMMARIES_PAGE_SIZE = int(os.environ.get('SUMMARIES_PAGE_SIZE', '500'))
+
+# Rows fetched per query by the /user/export stream
+EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', '500'))
+
+# Request deadlines (clients can send X-Request-Timeout in seconds)
+REQUEST_DEADLINE_SECONDS = float(os.environ.get('REQUEST_DEADLINE_SECONDS', '30'))
+# /summarize can spend longer: it may wait for an upstream slot and retry
+SUMMARIZE_DEADLINE_SECONDS = float(os.environ.get('SUMMARIZE_DEADLINE_SECONDS', '60'))
+# Upper bound for any budget a client asks for; stays below gunicorn's --timeout
+REQUEST_DEADLINE_MAX_SECONDS = float(os.environ.get('REQUEST_DEADLINE_MAX_SECONDS', '110'))
+# Gemini attempts (including retries) aren't started with less than this much budget left
+LLM_MIN_ATTEMPT_SECONDS = float(os.environ.get('LLM_MIN_ATTEMPT_SECONDS', '2'))
+# Per-call HTTP timeout of the shared Supabase client
+SUPABASE_TIMEOUT_SECONDS = float(os.environ.get('SUPABASE_TIMEOUT_SECONDS', '10'))
+
+# Hedged Gemini requests: a duplicate call when the first is slower than usual
+HEDGE_ENABLED = os.environ.get('HEDGE_ENABLED', 'False').lower() == 'true'
+# Model for the duplicate call; empty uses the primary model
+HEDGE_MODEL = os.environ.get('HEDGE_MODEL', '')
+# Hedge once the primary has taken longer than this latency percentile of recent calls
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', '0.95'))
+HEDGE_MIN_SAMPLES = int(os.environ.get('HEDGE_MIN_SAMPLES', '50'))
+HEDGE_WINDOW = int(os.environ.get('HEDGE_WINDOW', '500'))
+# Duplicates allowed per primary call over time, plus a small burst allowance
+HEDGE_MAX_RATIO = float(os.environ.get('HEDGE_MAX_RATIO', '0.05'))
+HEDGE_BURST = float(os.environ.get('HEDGE_BURST', '5'))
+HEDGE_WORKERS = int(os.environ.get('HEDGE_WORKERS', '32'))
+
+# Server-sent event streams of usage, subscription and settings changes (/user/events)
+# Each open stream holds a worker thread, so keep this well under gunicorn's --threads
+EVENTS_MAX_STREAMS = int(os.environ.get('EVENTS_MAX_STREAMS', '8'))
+# Cap under an async (gevent) worker, where a stream costs a greenlet rather than a thread
+EVENTS_MAX_STREAMS_ASYNC = int(os.environ.get('EVENTS_MAX_STREAMS_ASYNC', '2000'))
+EVENTS_MAX_STREAMS_PER_USER = int(os.environ.get('EVENTS_MAX_STREAMS_PER_USER', '2'))
+EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', '32'))
+# Streams end after this long and the client reconnects (re-checking its token)
+EVENTS_STREAM_SECONDS = float(os.environ.get('EVENTS_STREAM_SECONDS', '300'))
+EVENTS_HEARTBEAT_SECONDS = float(os.environ.get('EVENTS_HEARTBEAT_SECONDS', '15'))
+# Lifetime of the ?ticket= used by EventSource clients, which can't send an Authorization header
+EVENTS_TICKET_SECONDS = int(os.environ.get('EVENTS_TICKET_SECONDS', '60'))
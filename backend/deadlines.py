@@ -0,0 +1,110 @@
+import socket
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from config import REQUEST_DEADLINE_MAX_SECONDS
+
+# Clients can ask for a shorter (or, up to the maximum, longer) budget in seconds
+DEADLINE_HEADER = 'X-Request-Timeout'
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before its work finished."""
+
+
+class ClientDisconnected(DeadlineExceeded):
+    """The client closed the connection, so nobody will read the result."""
+
+
+def client_socket(environ):
+    # gunicorn exposes the client connection; the Flask dev server doesn't,
+    # so there only the time budget applies
+    return environ.get('gunicorn.socket')
+
+
+def socket_closed(sock):
+    """
+    True once the peer has closed the connection. Peeks without consuming,
+    so pipelined request bytes are left for the server to read.
+    """
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except BlockingIOError:
+        return False
+    except ConnectionError:
+        return True
+    except (OSError, ValueError):
+        # Closed by us, or a TLS socket that can't peek
+        return False
+
+
+class Deadline:
+    """A time budget for one request, optionally tied to its client connection."""
+
+    def __init__(self, seconds, sock=None):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.sock = sock
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def check(self):
+        """Raise if nobody is waiting for this request's result any more."""
+        if self.sock is not None and socket_closed(self.sock):
+            raise ClientDisconnected("Client disconnected")
+        if time.monotonic() >= self.expires_at:
+            raise DeadlineExceeded(f"Request deadline of {self.seconds:g}s exceeded")
+
+
+_current = ContextVar('request_deadline', default=None)
+
+
+def request_budget(header_value, default):
+    """
+    Seconds allowed for a request: the header value when it parses, else the
+    route default, capped at REQUEST_DEADLINE_MAX_SECONDS. None means no deadline.
+    """
+    if default is None:
+        return None
+    budget = default
+    if header_value:
+        try:
+            requested = float(header_value)
+            if requested > 0:
+                budget = requested
+        except ValueError:
+            pass
+    return min(budget, REQUEST_DEADLINE_MAX_SECONDS)
+
+
+def set_current(deadline):
+    """Make `deadline` (or None) the one seen by calls on this thread."""
+    _current.set(deadline)
+
+
+def current():
+    return _current.get()
+
+
+def remaining():
+    """Seconds left in the current deadline, or None when there isn't one."""
+    deadline = _current.get()
+    return None if deadline is None else deadline.remaining()
+
+
+def check():
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check()
+
+
+@contextmanager
+def deadline_scope(deadline):
+    """Run the block under `deadline`, e.g. in a worker thread that doesn't inherit it."""
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
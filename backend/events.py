@@ -0,0 +1,184 @@
+import queue
+import threading
+import time
+
+from config import (
+    REDIS_URL,
+    EVENTS_MAX_STREAMS,
+    EVENTS_MAX_STREAMS_ASYNC,
+    EVENTS_MAX_STREAMS_PER_USER,
+    EVENTS_QUEUE_SIZE
+)
+from json_encoding import dumps, loads
+
+# Redis pub/sub channel carrying every user's events between workers
+CHANNEL = 'lightread:user-events'
+
+
+def async_worker():
+    """True under a gevent worker (gunicorn patches the stdlib before loading the app)."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+
+def format_sse(event):
+    """One server-sent event: `event:` line with the type, JSON `data:` line."""
+    return f"event: {event['type']}\ndata: {dumps(event['data'])}\n\n"
+
+
+class Subscription:
+    """Events for one open stream. Keeps the newest EVENTS_QUEUE_SIZE if the reader falls behind."""
+
+    def __init__(self, user_id, max_size=EVENTS_QUEUE_SIZE):
+        self.user_id = user_id
+        self._queue = queue.Queue(maxsize=max_size)
+
+    def put(self, event):
+        while True:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                # Events are state snapshots, so a newer one supersedes the oldest
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroker:
+    """
+    Fans per-user events (usage, subscription, settings) out to open streams.
+
+    Without REDIS_URL events only reach streams held by the worker that
+    published them. With it, events go through a Redis channel and a
+    listener thread in every worker delivers them to its own streams; if
+    Redis is unreachable the broker falls back to local delivery. On a
+    threaded worker every stream holds a thread, so the cap is small; the
+    gevent `events` process (see the Procfile) can hold many more.
+    """
+
+    def __init__(self, redis_url=REDIS_URL, max_streams=None,
+                 max_streams_per_user=EVENTS_MAX_STREAMS_PER_USER):
+        self.redis_url = redis_url
+        if max_streams is None:
+            max_streams = EVENTS_MAX_STREAMS_ASYNC if async_worker() else EVENTS_MAX_STREAMS
+        self.max_streams = max_streams
+        self.max_streams_per_user = max_streams_per_user
+        self._subscribers = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._redis = None
+        self._listener = None
+        self._stats = {'published': 0, 'delivered': 0, 'rejected': 0}
+
+    def _redis_client(self):
+        # Created on first use so workers that never publish don't connect
+        if self._redis is None and self.redis_url:
+            with self._lock:
+                if self._redis is None:
+                    try:
+                        import redis
+                        self._redis = redis.Redis.from_url(self.redis_url)
+                        print("Event broker using shared Redis channel")
+                    except Exception as e:
+                        print(f"Error connecting event broker to Redis, delivering locally: {e}")
+                        self.redis_url = None
+        return self._redis
+
+    def _ensure_listener(self):
+        client = self._redis_client()
+        if client is None:
+            return
+        with self._lock:
+            if self._listener is not None:
+                return
+            self._listener = threading.Thread(target=self._listen, args=(client,), name='event-listener', daemon=True)
+            self._listener.start()
+
+    def _listen(self, client):
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                for message in pubsub.listen():
+                    event = loads(message['data'])
+                    self._deliver(event.pop('user_id'), event)
+            except Exception as e:
+                print(f"Event listener lost its Redis subscription, reconnecting: {e}")
+                time.sleep(1)
+
+    def subscribe(self, user_id):
+        """A new Subscription, or None when the worker or user is at its stream limit."""
+        self._ensure_listener()
+        with self._lock:
+            subscriptions = self._subscribers.setdefault(user_id, set())
+            if self._count >= self.max_streams or len(subscriptions) >= self.max_streams_per_user:
+                self._stats['rejected'] += 1
+                if not subscriptions:
+                    del self._subscribers[user_id]
+                return None
+            subscription = Subscription(user_id)
+            subscriptions.add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id)
+            if subscriptions is None or subscription not in subscriptions:
+                return
+            subscriptions.discard(subscription)
+            self._count -= 1
+            if not subscriptions:
+                del self._subscribers[subscription.user_id]
+
+    def publish(self, user_id, event_type, data):
+        """Send an event to every stream the user has open. Never raises."""
+        event = {'type': event_type, 'data': data}
+        with self._lock:
+            self._stats['published'] += 1
+        client = self._redis_client()
+        if client is not None:
+            try:
+                client.publish(CHANNEL, dumps({'user_id': user_id, **event}))
+                return
+            except Exception as e:
+                print(f"Error publishing event to Redis, delivering locally: {e}")
+        self._deliver(user_id, event)
+
+    def _deliver(self, user_id, event):
+        with self._lock:
+            subscriptions = list(self._subscribers.get(user_id, ()))
+            self._stats['delivered'] += len(subscriptions)
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'streams': self._count,
+                'max_streams': self.max_streams,
+                'users': len(self._subscribers),
+                'shared': self._redis is not None,
+                **self._stats
+            }
+
+
+event_broker = EventBroker()
+
+
+def publish_event(user_id, event_type, data):
+    try:
+        event_broker.publish(user_id, event_type, data)
+    except Exception as e:
+        print(f"Error publishing {event_type} event for user {user_id}: {e}")
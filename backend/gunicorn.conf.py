@@ -0,0 +1,21 @@
+import os
+import threading
+
+# Loaded automatically by gunicorn from the working directory; everything
+# else is configured through GUNICORN_CMD_ARGS.
+
+# Give in-flight summaries time to finish when a worker is told to stop
+graceful_timeout = int(float(os.environ.get('SHUTDOWN_DRAIN_SECONDS', '60')))
+
+
+def worker_exit(server, worker):
+    # Runs in the worker after it has stopped serving: flush buffered state
+    from lifecycle import lifecycle
+    lifecycle.drain()
+
+
+def post_worker_init(worker):
+    # Load reference data and precompile prompt templates without holding up
+    # the worker: requests that arrive first load them on demand as before
+    from server import warm_startup_caches
+    threading.Thread(target=warm_startup_caches, name='startup-warmup', daemon=True).start()
@@ -0,0 +1,147 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+
+from config import (
+    HEDGE_PERCENTILE,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_WINDOW,
+    HEDGE_MAX_RATIO,
+    HEDGE_BURST,
+    HEDGE_WORKERS
+)
+from concurrency import UpstreamOverloaded
+from profiling import profiled
+
+
+class LatencyTracker:
+    """Latencies of the most recent successful calls, for percentile lookups."""
+
+    def __init__(self, window=HEDGE_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, q):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class Hedger:
+    """
+    Hedged requests: run the primary call, and if it hasn't answered by the
+    observed latency percentile, start one duplicate and take whichever
+    succeeds first.
+
+    Duplicates are paid for from a token bucket that gains `max_ratio`
+    tokens per primary call (up to `burst`), so they stay a bounded
+    fraction of traffic. Until `min_samples` latencies have been seen
+    nothing is hedged. The losing call can't be interrupted once its HTTP
+    request is in flight; its result is discarded.
+    """
+
+    def __init__(self, percentile=HEDGE_PERCENTILE, min_samples=HEDGE_MIN_SAMPLES,
+                 max_ratio=HEDGE_MAX_RATIO, burst=HEDGE_BURST, workers=HEDGE_WORKERS):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_ratio = max_ratio
+        self.burst = burst
+        self.latencies = LatencyTracker()
+        self._tokens = float(burst)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='llm-hedge')
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'hedged': 0, 'hedge_wins': 0, 'budget_denied': 0, 'shed': 0}
+
+    def delay(self):
+        """Seconds to wait for the primary before hedging, or None while warming up."""
+        if len(self.latencies) < self.min_samples:
+            return None
+        return self.latencies.percentile(self.percentile)
+
+    def _take_token(self):
+        with self._lock:
+            if self._tokens < 1:
+                self._stats['budget_denied'] += 1
+                return False
+            self._tokens -= 1
+            self._stats['hedged'] += 1
+            return True
+
+    def _submit(self, fn):
+        # Each call runs in a copy of the caller's context so it sees the request
+        # deadline, and is sampled as part of the request's profile
+        return self._executor.submit(copy_context().run, profiled(fn))
+
+    def call(self, primary, hedge):
+        """Result of `primary()`, or of `hedge()` if that answers first."""
+        with self._lock:
+            self._stats['calls'] += 1
+            self._tokens = min(self.burst, self._tokens + self.max_ratio)
+
+        started = time.monotonic()
+
+        def record_latency(future):
+            # Primary latencies only, including the ones that lost to a hedge
+            if not future.cancelled() and future.exception() is None:
+                self.latencies.record(time.monotonic() - started)
+
+        first = self._submit(primary)
+        first.add_done_callback(record_latency)
+
+        delay = self.delay()
+        if delay is None or wait([first], timeout=delay).done or not self._take_token():
+            return first.result()
+
+        second = self._submit(hedge)
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if future is second and isinstance(error, UpstreamOverloaded):
+                    # No free upstream slot for the duplicate; only the primary is running
+                    with self._lock:
+                        self._stats['shed'] += 1
+                        self._tokens = min(self.burst, self._tokens + 1)
+                    continue
+                if error is None:
+                    for other in pending:
+                        other.cancel()
+                    if future is second:
+                        with self._lock:
+                            self._stats['hedge_wins'] += 1
+                    return future.result()
+        # Both failed: report the primary's error
+        return first.result()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            tokens = self._tokens
+        delay = self.delay()
+        sent = stats['hedged'] - stats['shed']
+        return {
+            **stats,
+            'delay_seconds': round(delay, 3) if delay is not None else None,
+            'samples': len(self.latencies),
+            'tokens': round(tokens, 2),
+            'hedge_rate': round(sent / stats['calls'], 4) if stats['calls'] else 0.0,
+            'win_rate': round(stats['hedge_wins'] / sent, 4) if sent else 0.0
+        }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+llm_hedger = Hedger()
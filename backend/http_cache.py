@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+
+from flask import request, jsonify, make_response
+
+from config import COMPRESSION_MIN_BYTES, COMPRESSION_LEVEL
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/plain', 'text/html')
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def row_version(rows, fields=('id', 'updated_at', 'created_at')):
+    """
+    Strong validator built from the rows' identity/version columns only.
+
+    Cheaper than hashing the serialized body and lets a matching request be
+    answered before anything is encoded. Only use it for rows whose other
+    columns can't change without bumping one of `fields`.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    for row in rows:
+        for field in fields:
+            hasher.update(str(row.get(field)).encode('utf-8'))
+            hasher.update(b'\x1f')
+        hasher.update(b'\x1e')
+    return hasher.hexdigest()
+
+
+def _matching_etag(etag):
+    """The client's cached tag for `etag` in any content encoding, if it sent one."""
+    for tag in (etag, f"{etag}-gzip", f"{etag}-br"):
+        if tag in request.if_none_match:
+            return tag
+    return None
+
+
+def conditional_json(data, version=None):
+    """
+    Build a JSON response with a strong ETag, or an empty 304 when the
+    client's If-None-Match already has it.
+
+    Without `version`, the ETag is a digest of the encoded body.
+    """
+    if version is not None and _matching_etag(version):
+        return _not_modified(_matching_etag(version))
+
+    response = jsonify(data)
+    etag = version or _digest(response.get_data())
+    if version is None and _matching_etag(etag):
+        return _not_modified(_matching_etag(etag))
+
+    response.set_etag(etag)
+    # Let clients reuse their copy, but only after revalidating
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _not_modified(etag):
+    response = make_response('', 304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    """after_request hook: gzip/brotli-encode text responses above COMPRESSION_MIN_BYTES."""
+    if (response.status_code < 200 or response.status_code >= 300
+            or response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if response.content_length is not None and response.content_length < COMPRESSION_MIN_BYTES:
+        return response
+
+    encoding = _choose_encoding()
+    if not encoding:
+        return response
+
+    body = response.get_data()
+    if len(body) < COMPRESSION_MIN_BYTES:
+        return response
+
+    if encoding == 'br':
+        compressed = brotli.compress(body, quality=min(COMPRESSION_LEVEL, 11))
+    else:
+        compressed = gzip.compress(body, compresslevel=COMPRESSION_LEVEL)
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    # Keep validators distinct per representation, as required for strong ETags
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f"{etag}-{encoding}")
+    return response
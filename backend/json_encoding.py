@@ -0,0 +1,68 @@
+import json
+from datetime import date
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS
+
+
+def _default(value):
+    # ISO 8601 dates either way, matching orjson rather than Flask's HTTP dates
+    if isinstance(value, date):
+        return value.isoformat()
+    # Whatever orjson can't encode natively (Decimal, dataclasses, HTML), as Flask would
+    return DefaultJSONProvider.default(value)
+
+
+def dumps(obj):
+    """Compact JSON text. Uses orjson when installed (datetimes/UUIDs included), else the stdlib."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS).decode('utf-8')
+        except (TypeError, orjson.JSONEncodeError):
+            # e.g. integers wider than 64 bits; the stdlib encoder handles them
+            pass
+    return json.dumps(obj, default=_default, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson (falls back to the default encoder when it's missing)."""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs.get('indent') is not None:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        # Compact output in debug mode too; nobody reads these by eye
+        return self._app.response_class(f"{self.dumps(obj)}\n", mimetype=self.mimetype)
+
+
+def encode_json_array(rows):
+    """One JSON array from an iterable of rows, encoded as they arrive so only the text is kept."""
+    return '[' + ','.join(dumps(row) for row in rows) + ']\n'
+
+
+def stream_ndjson(rows):
+    for row in rows:
+        yield dumps(row) + '\n'
+
+
+def wants_ndjson(request):
+    return request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
@@ -0,0 +1,99 @@
+import signal
+import threading
+import time
+
+from config import SHUTDOWN_DRAIN_SECONDS
+
+
+class Lifecycle:
+    """
+    Tracks in-flight work so a worker can drain before it exits.
+
+    `begin_shutdown()` flips readiness to false immediately; `drain()` then
+    waits for in-flight requests (up to a deadline) and runs the registered
+    flush hooks (buffered usage, background jobs) in registration order.
+    """
+
+    def __init__(self):
+        self._inflight = 0
+        self._draining = False
+        self._drained = False
+        self._condition = threading.Condition()
+        self._hooks = []
+
+    @property
+    def draining(self):
+        return self._draining
+
+    @property
+    def inflight(self):
+        return self._inflight
+
+    def register_hook(self, name, hook):
+        """Run `hook()` during shutdown, after in-flight requests finish."""
+        self._hooks.append((name, hook))
+
+    def request_started(self):
+        with self._condition:
+            self._inflight += 1
+
+    def request_finished(self):
+        with self._condition:
+            self._inflight -= 1
+            if self._inflight <= 0:
+                self._condition.notify_all()
+
+    def begin_shutdown(self):
+        with self._condition:
+            if not self._draining:
+                print(f"Shutting down: draining {self._inflight} in-flight requests")
+            self._draining = True
+
+    def drain(self, timeout=SHUTDOWN_DRAIN_SECONDS):
+        """Wait for in-flight requests, then flush. Safe to call more than once."""
+        self.begin_shutdown()
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            if self._drained:
+                return
+            while self._inflight > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"Drain deadline reached with {self._inflight} requests still in flight")
+                    break
+                self._condition.wait(remaining)
+            self._drained = True
+
+        for name, hook in self._hooks:
+            try:
+                hook()
+                print(f"Shutdown hook '{name}' completed")
+            except Exception as e:
+                print(f"Error in shutdown hook '{name}': {e}")
+
+
+lifecycle = Lifecycle()
+
+
+def install_signal_handlers():
+    """
+    Flip readiness as soon as SIGTERM arrives, then defer to the existing
+    handler (gunicorn's, which stops accepting and waits for in-flight
+    requests). Must be called from the main thread.
+    """
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_sigterm(signum, frame):
+        lifecycle.begin_shutdown()
+        if callable(previous):
+            previous(signum, frame)
+        else:
+            # Not under gunicorn (e.g. the Flask dev server): drain here
+            lifecycle.drain()
+            raise SystemExit(0)
+
+    try:
+        signal.signal(signal.SIGTERM, handle_sigterm)
+    except ValueError:
+        # Not in the main thread (e.g. imported by a test runner thread)
+        pass
@@ -0,0 +1,18 @@
+-- Revoked JWTs. A row either names a single token (jti) or revokes every
+-- token issued to user_id before revoked_before. Rows are only needed until
+-- expires_at, after which the tokens they cover have expired anyway.
+create table if not exists token_revocations (
+    id bigint generated always as identity primary key,
+    jti text,
+    user_id uuid,
+    revoked_before timestamptz,
+    expires_at timestamptz not null,
+    created_at timestamptz not null default now()
+);
+
+create index if not exists token_revocations_expires_at_idx
+    on token_revocations (expires_at);
+
+-- Written and read only by the backend (service role, bypasses RLS). With no
+-- policies, clients holding the anon key can't remove a revocation.
+alter table token_revocations enable row level security;
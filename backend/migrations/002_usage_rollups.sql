@@ -0,0 +1,36 @@
+-- Weekly and monthly totals of daily_usage, kept up to date by the backend's
+-- usage buffer so /user/usage/history never has to fold raw daily rows.
+create table if not exists usage_rollups (
+    user_id uuid not null,
+    period text not null check (period in ('week', 'month')),
+    period_start date not null,
+    summaries_count integer not null default 0,
+    total_characters bigint not null default 0,
+    primary key (user_id, period, period_start)
+);
+
+-- Backfill from existing history
+insert into usage_rollups (user_id, period, period_start, summaries_count, total_characters)
+select user_id, 'week', date_trunc('week', date)::date, sum(summaries_count), sum(coalesce(total_characters, 0))
+from daily_usage
+group by user_id, date_trunc('week', date)
+on conflict (user_id, period, period_start) do update
+    set summaries_count = excluded.summaries_count,
+        total_characters = excluded.total_characters;
+
+insert into usage_rollups (user_id, period, period_start, summaries_count, total_characters)
+select user_id, 'month', date_trunc('month', date)::date, sum(summaries_count), sum(coalesce(total_characters, 0))
+from daily_usage
+group by user_id, date_trunc('month', date)
+on conflict (user_id, period, period_start) do update
+    set summaries_count = excluded.summaries_count,
+        total_characters = excluded.total_characters;
+
+-- Maintained only by the backend (service role, bypasses RLS); clients may
+-- read their own totals but not write them
+alter table usage_rollups enable row level security;
+
+drop policy if exists "Users can view their own usage rollups" on usage_rollups;
+create policy "Users can view their own usage rollups"
+    on usage_rollups for select
+    using (auth.uid() = user_id);
@@ -0,0 +1,3 @@
+-- Opt-in for speculative generation of alternate tone/difficulty variants
+alter table user_settings
+    add column if not exists prefetch_variants boolean not null default false;
@@ -0,0 +1,30 @@
+-- Content hash used to deduplicate repeated saves of the same summary.
+-- Must match summary_content_hash() in server.py:
+--   sha256(coalesce(source_url, '') || chr(31) || summary), hex encoded
+alter table summaries add column if not exists content_hash text;
+
+-- Backfill the hash on the oldest copy of any summary a user saved more than
+-- once. Later copies are kept with a null hash: the unique index treats nulls
+-- as distinct, so they stay listed and deletable but never match a new save.
+-- Rows whose hash is already taken are skipped, so the migration can be re-run.
+with hashed as (
+    select id, user_id, created_at,
+           encode(sha256(convert_to(coalesce(source_url, '') || chr(31) || summary, 'UTF8')), 'hex') as hash
+    from summaries
+    where content_hash is null
+), oldest as (
+    select distinct on (user_id, hash) id, user_id, hash
+    from hashed
+    order by user_id, hash, created_at, id
+)
+update summaries s
+set content_hash = o.hash
+from oldest o
+where s.id = o.id
+  and not exists (
+      select 1 from summaries e
+      where e.user_id = o.user_id and e.content_hash = o.hash
+  );
+
+create unique index if not exists summaries_user_content_hash_idx
+    on summaries (user_id, content_hash);
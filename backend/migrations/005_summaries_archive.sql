@@ -0,0 +1,34 @@
+-- Cold storage for old summaries. Index columns stay queryable; the full
+-- row is kept as a compressed (gzip or zstd), base64-encoded JSON payload.
+create table if not exists summaries_archive (
+    id uuid primary key,
+    user_id uuid not null,
+    source_url text,
+    character_count integer,
+    content_hash text,
+    created_at timestamptz,
+    archived_at timestamptz not null default now(),
+    codec text not null,
+    payload text not null
+);
+
+create index if not exists summaries_archive_user_created_idx
+    on summaries_archive (user_id, created_at desc);
+
+-- The archiver selects by age across all users
+create index if not exists summaries_created_at_idx
+    on summaries (created_at);
+
+-- Same owner rules as summaries for what clients may see and remove; rows
+-- are only written by the backend's archiver (service role, bypasses RLS)
+alter table summaries_archive enable row level security;
+
+drop policy if exists "Users can view their own archived summaries" on summaries_archive;
+create policy "Users can view their own archived summaries"
+    on summaries_archive for select
+    using (auth.uid() = user_id);
+
+drop policy if exists "Users can delete their own archived summaries" on summaries_archive;
+create policy "Users can delete their own archived summaries"
+    on summaries_archive for delete
+    using (auth.uid() = user_id);
@@ -0,0 +1,37 @@
+-- Service API keys for enterprise integrations. Only a sha256 of the key is
+-- stored; key_prefix is the public part of the key used to find the row.
+-- A null daily_quota / requests_per_minute falls back to the owner's plan
+-- limit / API_KEY_PER_MINUTE.
+create table if not exists api_keys (
+    id uuid primary key default gen_random_uuid(),
+    user_id uuid not null,
+    name text not null,
+    key_prefix text not null unique,
+    key_hash text not null,
+    daily_quota integer,
+    requests_per_minute integer,
+    revoked_at timestamptz,
+    created_at timestamptz not null default now()
+);
+
+create index if not exists api_keys_user_id_idx on api_keys (user_id);
+
+-- Per-key daily usage, written by the same write-behind buffer as daily_usage
+create table if not exists api_key_usage (
+    api_key_id uuid not null references api_keys (id) on delete cascade,
+    date date not null,
+    summaries_count integer not null default 0,
+    total_characters integer not null default 0,
+    primary key (api_key_id, date)
+);
+
+-- Clients hold the anon key, so both tables are closed to them except for
+-- reading their own keys. Keys are created, revoked and counted only by the
+-- backend, which connects with the service role and bypasses RLS.
+alter table api_keys enable row level security;
+alter table api_key_usage enable row level security;
+
+drop policy if exists "Users can view their own API keys" on api_keys;
+create policy "Users can view their own API keys"
+    on api_keys for select
+    using (auth.uid() = user_id);
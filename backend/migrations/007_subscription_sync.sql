@@ -0,0 +1,18 @@
+-- Progress markers for incremental background jobs (e.g. the Stripe
+-- subscription reconciler's last synced event time, as a unix timestamp).
+create table if not exists sync_state (
+    name text primary key,
+    high_water bigint not null,
+    updated_at timestamptz not null default now()
+);
+
+-- Lets the reconciler write changed rows in one upsert per batch
+create unique index if not exists subscriptions_stripe_subscription_id_idx
+    on subscriptions (stripe_subscription_id);
+
+-- Checkout session that created the subscription, so /api/verify-session
+-- can answer from the database once the webhook has been processed
+alter table subscriptions add column if not exists stripe_checkout_session_id text;
+
+create index if not exists subscriptions_stripe_checkout_session_id_idx
+    on subscriptions (stripe_checkout_session_id);
@@ -0,0 +1,38 @@
+-- Atomic usage increments for the backend's write-behind usage buffers.
+-- Each call adds a batch of per-(owner, date) deltas in one statement, so
+-- several workers flushing the same row at once all land. Returns the
+-- stored rows after the increment.
+--
+-- increments: [{"owner": <uuid>, "date": "YYYY-MM-DD", "summaries": n, "characters": n}, ...]
+
+create or replace function increment_daily_usage(increments jsonb)
+returns setof daily_usage
+language sql
+as $$
+    insert into daily_usage (user_id, date, summaries_count, total_characters)
+    select owner, date, summaries, characters
+    from jsonb_to_recordset(increments) as i(owner uuid, date date, summaries integer, characters bigint)
+    on conflict (user_id, date) do update
+        set summaries_count = coalesce(daily_usage.summaries_count, 0) + excluded.summaries_count,
+            total_characters = coalesce(daily_usage.total_characters, 0) + excluded.total_characters
+    returning *;
+$$;
+
+create or replace function increment_api_key_usage(increments jsonb)
+returns setof api_key_usage
+language sql
+as $$
+    insert into api_key_usage (api_key_id, date, summaries_count, total_characters)
+    select owner, date, summaries, characters
+    from jsonb_to_recordset(increments) as i(owner uuid, date date, summaries integer, characters bigint)
+    on conflict (api_key_id, date) do update
+        set summaries_count = api_key_usage.summaries_count + excluded.summaries_count,
+            total_characters = api_key_usage.total_characters + excluded.total_characters
+    returning *;
+$$;
+
+-- Both run with the caller's rights and PostgREST exposes public functions
+-- over RPC; only the backend (service role) may add to usage, or any client
+-- could raise or lower anyone's counts
+revoke execute on function increment_daily_usage(jsonb) from public, anon, authenticated;
+revoke execute on function increment_api_key_usage(jsonb) from public, anon, authenticated;
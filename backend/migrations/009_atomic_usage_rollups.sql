@@ -0,0 +1,40 @@
+-- Atomic increments for usage_rollups, called by the usage buffer after each
+-- daily_usage flush. Deltas are added in one statement so concurrent
+-- flushes from several workers all land.
+--
+-- increments: [{"user_id": <uuid>, "period": "week"|"month", "period_start": "YYYY-MM-DD",
+--               "summaries": n, "characters": n}, ...]
+create or replace function increment_usage_rollups(increments jsonb)
+returns void
+language sql
+as $$
+    insert into usage_rollups (user_id, period, period_start, summaries_count, total_characters)
+    select user_id, period, period_start, summaries, characters
+    from jsonb_to_recordset(increments) as i(user_id uuid, period text, period_start date, summaries integer, characters bigint)
+    on conflict (user_id, period, period_start) do update
+        set summaries_count = usage_rollups.summaries_count + excluded.summaries_count,
+            total_characters = usage_rollups.total_characters + excluded.total_characters;
+$$;
+
+-- Recompute the rollups of every period starting on or after `since` from
+-- daily_usage, e.g. after a worker died holding deltas it had not applied.
+-- Run with `python usage_rollups.py --since YYYY-MM-DD`.
+create or replace function rebuild_usage_rollups(since date)
+returns void
+language sql
+as $$
+    insert into usage_rollups (user_id, period, period_start, summaries_count, total_characters)
+    select user_id, p.period, date_trunc(p.period, date)::date, sum(summaries_count), sum(coalesce(total_characters, 0))
+    from daily_usage
+    cross join (values ('week'), ('month')) as p(period)
+    where date >= date_trunc(p.period, since)::date
+    group by user_id, p.period, date_trunc(p.period, date)
+    on conflict (user_id, period, period_start) do update
+        set summaries_count = excluded.summaries_count,
+            total_characters = excluded.total_characters;
+$$;
+
+-- Both run with the caller's rights and sit in public, so PostgREST would
+-- expose them over RPC; only the backend (service role) may call them
+revoke execute on function increment_usage_rollups(jsonb) from public, anon, authenticated;
+revoke execute on function rebuild_usage_rollups(date) from public, anon, authenticated;
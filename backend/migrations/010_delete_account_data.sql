@@ -0,0 +1,28 @@
+-- Removes the caller's rows from the backend-owned per-user tables, which
+-- clients can't write to directly (see the RLS in 001, 002 and 006). Called
+-- by the dashboard's deleteAccount before the auth user is removed.
+create or replace function delete_account_data()
+returns void
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    uid uuid := auth.uid();
+begin
+    if uid is null then
+        raise exception 'Not authenticated';
+    end if;
+
+    -- api_key_usage rows go with their keys (on delete cascade)
+    delete from api_keys where user_id = uid;
+    delete from usage_rollups where user_id = uid;
+    delete from token_revocations where user_id = uid;
+    -- Backend tokens issued to the account stay rejected until they expire (7 days)
+    insert into token_revocations (user_id, revoked_before, expires_at)
+    values (uid, now(), now() + interval '7 days');
+end;
+$$;
+
+revoke execute on function delete_account_data() from public, anon;
+grant execute on function delete_account_data() to authenticated;
@@ -0,0 +1,15 @@
+-- Stripe webhook events already handled. A worker claims an event by
+-- inserting its id; the primary key lets exactly one worker (on any
+-- instance) win, so redelivered events aren't applied twice. Stripe stops
+-- retrying after three days, so older rows can be deleted.
+create table if not exists stripe_events (
+    event_id text primary key,
+    event_type text not null,
+    processed_at timestamptz not null default now()
+);
+
+create index if not exists stripe_events_processed_at_idx
+    on stripe_events (processed_at);
+
+-- Backend only (service role, bypasses RLS)
+alter table stripe_events enable row level security;
@@ -0,0 +1,154 @@
+import heapq
+import random
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+
+from config import (
+    NEAR_DUPLICATE_ENABLED,
+    NEAR_DUPLICATE_THRESHOLD,
+    NEAR_DUPLICATE_CACHE_SIZE,
+    NEAR_DUPLICATE_MIN_WORDS
+)
+from prompts import PROMPT_VERSION
+
+SHINGLE_WORDS = 5
+# 8 bands of 8 rows: texts at 0.9 similarity share a band ~99% of the time,
+# texts at 0.5 only ~3%, so few candidates need a full signature compare
+BANDS = 8
+ROWS = 8
+NUM_HASHES = BANDS * ROWS
+# Signatures are computed over the shingles with the smallest hashes (a
+# bottom-k sample). The sample is consistent, so near-identical texts keep
+# near-identical samples, and a long text costs the same as a short one.
+MAX_SHINGLES = 256
+
+_PRIME = (1 << 61) - 1
+# Fixed seed so signatures are comparable across restarts and workers
+_rng = random.Random(0x5eed)
+_COEFFICIENTS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_HASHES)]
+
+
+def shingles(text):
+    """Hashes of the overlapping SHINGLE_WORDS-word windows of the normalized text."""
+    words = text.lower().split()
+    if len(words) < max(NEAR_DUPLICATE_MIN_WORDS, SHINGLE_WORDS):
+        return None
+    return {
+        zlib.crc32(' '.join(words[i:i + SHINGLE_WORDS]).encode('utf-8'))
+        for i in range(len(words) - SHINGLE_WORDS + 1)
+    }
+
+
+def minhash_signature(text):
+    """MinHash signature of `text`, or None if it is too short to compare."""
+    hashes = shingles(text)
+    if not hashes:
+        return None
+    if len(hashes) > MAX_SHINGLES:
+        hashes = heapq.nsmallest(MAX_SHINGLES, hashes)
+    return array('Q', (min((a * h + b) % _PRIME for h in hashes) for a, b in _COEFFICIENTS))
+
+
+def cache_scope(length, tone, difficulty):
+    # Only summaries generated with the same prompt are interchangeable
+    return (PROMPT_VERSION, length, tone, difficulty)
+
+
+class NearDuplicateIndex:
+    """
+    LSH index from MinHash signatures to summaries, bounded to `capacity` entries.
+
+    Signatures live in one preallocated array (NUM_HASHES slots per entry);
+    band buckets map (scope, band, band hash) to the entry slots sharing
+    that band. A lookup compares the candidates' full signatures and
+    returns the most similar summary at or above `threshold`. Entries are
+    evicted least recently used first.
+    """
+
+    def __init__(self, capacity=NEAR_DUPLICATE_CACHE_SIZE, threshold=NEAR_DUPLICATE_THRESHOLD):
+        self.capacity = capacity
+        self.threshold = threshold
+        self._signatures = array('Q', bytes(8 * NUM_HASHES * capacity))
+        self._entries = OrderedDict()   # slot -> (scope, band keys, summary), LRU order
+        self._buckets = {}              # (scope, band, band hash) -> set of slots
+        self._free = list(range(capacity - 1, -1, -1))
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0}
+
+    @staticmethod
+    def _band_keys(scope, signature):
+        return [
+            (scope, band, hash(tuple(signature[band * ROWS:(band + 1) * ROWS])))
+            for band in range(BANDS)
+        ]
+
+    def _similarity(self, slot, signature):
+        offset = slot * NUM_HASHES
+        stored = self._signatures[offset:offset + NUM_HASHES]
+        return sum(1 for x, y in zip(stored, signature) if x == y) / NUM_HASHES
+
+    def get(self, scope, signature):
+        if signature is None:
+            return None
+        band_keys = self._band_keys(scope, signature)
+        with self._lock:
+            candidates = set()
+            for key in band_keys:
+                candidates.update(self._buckets.get(key, ()))
+
+            best_slot, best_similarity = None, self.threshold
+            for slot in candidates:
+                similarity = self._similarity(slot, signature)
+                if similarity >= best_similarity:
+                    best_slot, best_similarity = slot, similarity
+
+            if best_slot is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            self._entries.move_to_end(best_slot)
+            return self._entries[best_slot][2]
+
+    def put(self, scope, signature, summary):
+        if signature is None or self.capacity <= 0:
+            return
+        band_keys = self._band_keys(scope, signature)
+        with self._lock:
+            if not self._free:
+                self._evict(*self._entries.popitem(last=False))
+            slot = self._free.pop()
+            self._signatures[slot * NUM_HASHES:(slot + 1) * NUM_HASHES] = signature
+            self._entries[slot] = (scope, band_keys, summary)
+            for key in band_keys:
+                self._buckets.setdefault(key, set()).add(slot)
+
+    def _evict(self, slot, entry):
+        for key in entry[1]:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(slot)
+                if not bucket:
+                    del self._buckets[key]
+        self._free.append(slot)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'capacity': self.capacity, 'threshold': self.threshold, **self._stats}
+
+
+near_duplicate_index = NearDuplicateIndex()
+
+
+def text_signature(text):
+    """Signature for the lookups below (None when the cache is disabled)."""
+    return minhash_signature(text) if NEAR_DUPLICATE_ENABLED else None
+
+
+def find_near_duplicate(signature, length, tone, difficulty):
+    return near_duplicate_index.get(cache_scope(length, tone, difficulty), signature)
+
+
+def remember_summary(signature, length, tone, difficulty, summary):
+    near_duplicate_index.put(cache_scope(length, tone, difficulty), signature, summary)
@@ -0,0 +1,31 @@
+def user_rows(client, table, user_id, page_size, columns='*', after=None, keys=('created_at', 'id'), desc=True):
+    """
+    Yield one user's rows ordered by `keys` (newest first by default),
+    fetching `page_size` rows per query.
+
+    Uses keyset pagination, so only one page is held in memory and rows
+    inserted while iterating don't shift later pages. `after` is a tuple of
+    `keys` values to resume from, exclusive.
+    """
+    op = 'lt' if desc else 'gt'
+    while True:
+        query = client.table(table).select(columns).eq('user_id', user_id)
+        if after is not None:
+            query = keyset_filter(query, keys, after, op)
+        for key in keys:
+            query = query.order(key, desc=desc)
+        result = query.limit(page_size).execute()
+        rows = result.data or []
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after = tuple(rows[-1][key] for key in keys)
+
+
+def keyset_filter(query, keys, values, op):
+    if len(keys) == 1:
+        return getattr(query, op)(keys[0], values[0])
+    (first, second), (first_value, second_value) = keys, values
+    return query.or_(
+        f'{first}.{op}."{first_value}",and({first}.eq."{first_value}",{second}.{op}."{second_value}")'
+    )
@@ -0,0 +1,236 @@
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from functools import wraps
+
+from config import (
+    PROFILE_DIR,
+    PROFILE_MAX_FILES,
+    PROFILE_INTERVAL_SECONDS,
+    PROFILE_SAMPLE_RATE,
+    PROFILE_SLOW_THRESHOLD_SECONDS
+)
+
+PROFILE_SUFFIX = '.collapsed'
+# <epoch ms>-<id>-<reason>-<duration ms>ms-<method>-<path>.collapsed
+PROFILE_NAME = re.compile(r'^(\d+)-([0-9a-f]+)-(requested|sampled|slow)-(\d+)ms-([A-Z]+)-([\w.-]*)\.collapsed$')
+
+# Profile of the request running in this context, for `profiled` worker calls
+_current_profile = ContextVar('request_profile', default=None)
+
+
+def frame_label(code):
+    filename = code.co_filename
+    # Keep library frames short but recognisable (tenacity/, supabase/, google/genai/, ...)
+    marker = filename.rfind('site-packages' + os.sep)
+    if marker != -1:
+        filename = filename[marker + len('site-packages') + 1:]
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(';', ',')
+
+
+def collapse(frame):
+    """One stack in collapsed format: root first, frames separated by ';'."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class ProfileHandle:
+    __slots__ = ('id', 'reason', 'thread_id', 'workers', 'started', 'stacks', 'token')
+
+    def __init__(self, reason):
+        self.id = uuid.uuid4().hex[:12]
+        self.reason = reason
+        self.thread_id = threading.get_ident()
+        self.workers = {}  # thread id -> name, for pool threads working for this request
+        self.started = time.monotonic()
+        self.stacks = Counter()
+        self.token = None
+
+
+class RequestProfiler:
+    """
+    Sampling profiler for individual requests.
+
+    One background thread samples the stacks of the request threads that
+    are being profiled (via sys._current_frames) every `interval` seconds,
+    so profiled code runs unmodified and everything on the request thread
+    shows up: Flask, tenacity waits, Supabase and Gemini SDK calls. Work
+    the request hands to a thread pool (hedged Gemini calls, ingest
+    documents) is sampled too while it runs, if submitted through
+    `profiled`; those stacks are rooted at a `thread <name>` frame.
+    Background work that outlives the request (variant prefetches) is not
+    attributed to it. The thread sleeps while nothing is being profiled.
+    Profiles are written in
+    collapsed-stack format (which speedscope and flamegraph.pl read) to
+    `directory`, keeping the newest `max_files`.
+    """
+
+    def __init__(self, directory=PROFILE_DIR, max_files=PROFILE_MAX_FILES, interval=PROFILE_INTERVAL_SECONDS,
+                 sample_rate=PROFILE_SAMPLE_RATE, slow_threshold=PROFILE_SLOW_THRESHOLD_SECONDS):
+        self.directory = directory
+        self.max_files = max_files
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self._active = {}  # thread id -> ProfileHandle
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def begin(self, requested=False):
+        """Start profiling the current thread if asked to, sampled, or watching for slow requests."""
+        if requested:
+            reason = 'requested'
+        elif self.sample_rate > 0 and random.random() < self.sample_rate:
+            reason = 'sampled'
+        elif self.slow_threshold > 0:
+            reason = 'slow'
+        else:
+            return None
+
+        handle = ProfileHandle(reason)
+        handle.token = _current_profile.set(handle)
+        with self._lock:
+            self._active[handle.thread_id] = handle
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return handle
+
+    def end(self, handle, method, path):
+        """Stop profiling. Returns the profile's file name, or None if it wasn't kept."""
+        with self._lock:
+            self._active.pop(handle.thread_id, None)
+        try:
+            _current_profile.reset(handle.token)
+        except ValueError:
+            # Ended from a different context than it began in
+            _current_profile.set(None)
+        duration = time.monotonic() - handle.started
+        if handle.reason == 'slow' and duration < self.slow_threshold:
+            return None
+        if not handle.stacks:
+            return None
+        try:
+            return self._write(handle, duration, method, path)
+        except OSError as e:
+            print(f"Error writing profile {handle.id}: {e}")
+            return None
+
+    def attach(self, handle):
+        """Sample the current (pool) thread as part of `handle`'s request until `detach`."""
+        thread = threading.current_thread()
+        with self._lock:
+            if self._active.get(handle.thread_id) is handle:
+                handle.workers[thread.ident] = thread.name
+
+    def detach(self, handle):
+        with self._lock:
+            handle.workers.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            if not self._active:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                threads = [
+                    (handle, thread_id, name)
+                    for handle in self._active.values()
+                    for thread_id, name in [(handle.thread_id, None), *handle.workers.items()]
+                ]
+            samples = [
+                (handle, collapse(frames[thread_id]) if name is None else f"thread {name};{collapse(frames[thread_id])}")
+                for handle, thread_id, name in threads if thread_id in frames
+            ]
+            with self._lock:
+                for handle, stack in samples:
+                    # Skip samples for requests that finished meanwhile
+                    if self._active.get(handle.thread_id) is handle:
+                        handle.stacks[stack] += 1
+            del frames
+            time.sleep(self.interval)
+
+    def _write(self, handle, duration, method, path):
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r'[^\w.-]+', '_', path.strip('/'))[:80]
+        name = f"{int(time.time() * 1000)}-{handle.id}-{handle.reason}-{int(duration * 1000)}ms-{method}-{slug}{PROFILE_SUFFIX}"
+        with open(os.path.join(self.directory, name), 'w', encoding='utf-8') as f:
+            for stack, count in handle.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self._prune()
+        print(f"Saved {handle.reason} profile {name} ({sum(handle.stacks.values())} samples)")
+        return name
+
+    def _prune(self):
+        names = sorted(name for name in os.listdir(self.directory) if PROFILE_NAME.match(name))
+        for name in names[:max(0, len(names) - self.max_files)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def list_profiles(self):
+        """Saved profiles, newest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            match = PROFILE_NAME.match(name)
+            if not match:
+                continue
+            created, profile_id, reason, duration, method, path = match.groups()
+            profiles.append({
+                'name': name,
+                'id': profile_id,
+                'reason': reason,
+                'duration_ms': int(duration),
+                'method': method,
+                'path_slug': path,
+                'created_at': int(created) / 1000,
+                'size': os.path.getsize(os.path.join(self.directory, name))
+            })
+        return profiles
+
+    def profile_path(self, name):
+        """Path of a saved profile, or None for anything that isn't one."""
+        if not PROFILE_NAME.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+
+request_profiler = RequestProfiler()
+
+
+def profiled(fn):
+    """
+    Wrap `fn` before handing it to a thread pool so the thread running it is
+    sampled as part of the current request's profile (a no-op otherwise).
+    """
+    handle = _current_profile.get()
+    if handle is None:
+        return fn
+
+    @wraps(fn)
+    def run(*args, **kwargs):
+        request_profiler.attach(handle)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            request_profiler.detach(handle)
+    return run
@@ -0,0 +1,119 @@
+import hashlib
+import threading
+from itertools import product
+
+# Every template keeps the instructions first and the user's text last, so
+# requests with the same settings share an identical prompt prefix (which
+# is what Gemini's implicit prefix caching keys on). Explicit context caches
+# aren't used: Gemini only creates them for at least 1,024 tokens of content,
+# and these prefixes are a few dozen; the per-request text doesn't repeat.
+TEMPLATES = {
+    'basic': (
+        "Please summarize the following text in {length}.\n"
+        "\n"
+        "Text to summarize:\n"
+        "---\n"
+    ),
+    'styled': (
+        "Please summarize the following text in {length}.\n"
+        "Use a {tone} tone and target a {difficulty} comprehension level.\n"
+        "\n"
+        "Text to summarize:\n"
+        "---\n"
+    ),
+    'variants': (
+        "Please summarize the following text in {length}, once for each of these styles:\n"
+        "{styles}\n"
+        "\n"
+        "Respond with a JSON array containing one object per style, each with \"id\" (the style number) and \"summary\".\n"
+        "\n"
+        "Text to summarize:\n"
+        "---\n"
+    )
+}
+TEXT_SUFFIX = "\n---"
+VARIANT_STYLE = "{index}: a {tone} tone targeting a {difficulty} comprehension level"
+
+# Overrides are free-form, so don't let arbitrary combinations grow the registry forever
+MAX_COMPILED_PREFIXES = 4096
+
+# Bump the base when prompt wording changes in ways the hash can't see
+# (e.g. a model switch); the digest covers edits to the templates themselves.
+PROMPT_VERSION = "v1-" + hashlib.sha256(
+    repr((sorted(TEMPLATES.items()), TEXT_SUFFIX, VARIANT_STYLE)).encode('utf-8')
+).hexdigest()[:8]
+
+
+def length_label(preferred_summary_length):
+    """'2-3 sentences (medium)' -> '2-3 sentences'."""
+    return preferred_summary_length.split(' (')[0]
+
+
+class PromptRegistry:
+    """
+    Instruction prefixes compiled once per (template, length, tone, difficulty).
+
+    Building a prompt is then a lookup plus one concatenation with the text.
+    Unknown combinations are compiled on first use and kept.
+    """
+
+    def __init__(self):
+        self._prefixes = {}
+        self._lock = threading.Lock()
+
+    def _prefix(self, key, build):
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            prefix = build()
+            with self._lock:
+                if len(self._prefixes) < MAX_COMPILED_PREFIXES:
+                    self._prefixes[key] = prefix
+        return prefix
+
+    def prefix(self, length, tone=None, difficulty=None):
+        if tone or difficulty:
+            key = ('styled', length, tone, difficulty)
+            return self._prefix(key, lambda: TEMPLATES['styled'].format(length=length, tone=tone, difficulty=difficulty))
+        key = ('basic', length)
+        return self._prefix(key, lambda: TEMPLATES['basic'].format(length=length))
+
+    def variants_prefix(self, length, variants):
+        key = ('variants', length, tuple(variants))
+        return self._prefix(key, lambda: TEMPLATES['variants'].format(
+            length=length,
+            styles="\n".join(
+                VARIANT_STYLE.format(index=index, tone=tone, difficulty=difficulty)
+                for index, (tone, difficulty) in enumerate(variants)
+            )
+        ))
+
+    def warm(self, lengths, tones, difficulties):
+        """Precompile every single-summary prefix for the known settings values."""
+        lengths = [length_label(length) for length in lengths]
+        for length in lengths:
+            self.prefix(length)
+        for length, tone, difficulty in product(lengths, tones, difficulties):
+            self.prefix(length, tone, difficulty)
+        return len(self._prefixes)
+
+    def warm_from_enum_values(self, enum_values):
+        """Warm from the get_enum_values RPC result."""
+        values = {item['enum_name']: item['enum_values'] for item in enum_values}
+        return self.warm(
+            values.get('summary_length', []),
+            values.get('summary_tone', []),
+            values.get('summary_difficulty', [])
+        )
+
+
+prompt_registry = PromptRegistry()
+
+
+def build_prompt(text, length, tone=None, difficulty=None):
+    """Prompt for one summary. Tone and difficulty are only set for pro users."""
+    return prompt_registry.prefix(length, tone, difficulty) + text + TEXT_SUFFIX
+
+
+def build_variants_prompt(text, length, variants):
+    """Prompt asking for one summary per (tone, difficulty) pair in a single JSON response."""
+    return prompt_registry.variants_prefix(length, variants) + text + TEXT_SUFFIX
@@ -0,0 +1,199 @@
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import request, jsonify
+
+from config import (
+    REDIS_URL,
+    RATE_LIMIT_ENABLED,
+    RATE_LIMIT_USER_PER_MINUTE,
+    RATE_LIMIT_USER_BURST,
+    RATE_LIMIT_IP_PER_MINUTE,
+    RATE_LIMIT_IP_BURST,
+    RATE_LIMIT_GLOBAL_PER_MINUTE,
+    RATE_LIMIT_GLOBAL_BURST
+)
+
+# Buckets that have been full for this long are dropped from memory
+IDLE_BUCKET_SECONDS = 600
+
+
+class TokenBucket:
+    """Classic token bucket: `capacity` tokens, refilled at `rate` tokens/second."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, now, cost=1):
+        """Take `cost` tokens. Returns 0 on success, else seconds until they are available."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0
+        return (cost - self.tokens) / self.rate
+
+    def give_back(self, cost=1):
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+
+class LocalBackend:
+    """Per-process buckets. Each gunicorn worker enforces its own share."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def acquire(self, checks):
+        """
+        Take one token from every (key, rate, capacity) bucket in `checks`.
+
+        All-or-nothing: if any bucket is empty, tokens already taken are
+        returned and the longest wait is reported.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            taken = []
+            for key, rate, capacity in checks:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = TokenBucket(rate, capacity)
+                wait = bucket.take(now)
+                if wait:
+                    for other in taken:
+                        other.give_back()
+                    return wait
+                taken.append(bucket)
+            return 0
+
+    def _sweep(self, now):
+        if now - self._last_sweep < IDLE_BUCKET_SECONDS:
+            return
+        self._last_sweep = now
+        for key in [k for k, b in self._buckets.items() if now - b.updated > IDLE_BUCKET_SECONDS]:
+            del self._buckets[key]
+
+
+# Atomically refill and take from every bucket passed in KEYS, or take from
+# none of them. ARGV holds now followed by (rate, capacity) pairs per key.
+_REDIS_TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local state = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local capacity = tonumber(ARGV[i * 2 + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+    if tokens < 1 then
+        wait = math.max(wait, (1 - tokens) / rate)
+    end
+    state[i] = {tokens, rate, capacity}
+end
+for i, key in ipairs(KEYS) do
+    local tokens = state[i][1]
+    if wait == 0 then
+        tokens = tokens - 1
+    end
+    redis.call('HSET', key, 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', key, math.ceil(state[i][3] / state[i][2]) + 60)
+end
+return tostring(wait)
+"""
+
+
+class RedisBackend:
+    """Buckets shared by every worker and instance through Redis."""
+
+    def __init__(self, url):
+        # Only needed when a shared backend is configured
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(_REDIS_TAKE_SCRIPT)
+
+    def acquire(self, checks):
+        keys = [f"ratelimit:{key}" for key, _, _ in checks]
+        args = [time.time()]
+        for _, rate, capacity in checks:
+            args.extend([rate, capacity])
+        return float(self._take(keys=keys, args=args))
+
+
+class RateLimiter:
+    def __init__(self):
+        self._local = LocalBackend()
+        self._shared = None
+        if REDIS_URL:
+            try:
+                self._shared = RedisBackend(REDIS_URL)
+                print("Rate limiter using shared Redis backend")
+            except Exception as e:
+                print(f"Error connecting rate limiter to Redis, using local buckets: {e}")
+
+    def acquire(self, checks):
+        if self._shared is not None:
+            try:
+                return self._shared.acquire(checks)
+            except Exception as e:
+                # Never fail requests because the shared store is down
+                print(f"Shared rate limiter unavailable, using local buckets: {e}")
+        return self._local.acquire(checks)
+
+
+rate_limiter = RateLimiter()
+
+
+def client_ip():
+    # ProxyFix (see server.py) has already resolved X-Forwarded-For through the
+    # TRUSTED_PROXY_HOPS proxies; the leftmost entry is whatever the client sent
+    return request.remote_addr or 'unknown'
+
+
+def _per_second(per_minute):
+    return per_minute / 60.0
+
+
+def rate_limited(scope):
+    """
+    Throttle a `token_required` route per user, per client IP and globally.
+
+    Must be applied below `token_required` so the wrapped view receives
+    `current_user`. Rejected requests get a 429 with a Retry-After header
+    before the view does any database or LLM work.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(current_user, *args, **kwargs):
+            if not RATE_LIMIT_ENABLED:
+                return f(current_user, *args, **kwargs)
+
+            checks = [
+                (f"{scope}:global", _per_second(RATE_LIMIT_GLOBAL_PER_MINUTE), RATE_LIMIT_GLOBAL_BURST),
+                (f"{scope}:ip:{client_ip()}", _per_second(RATE_LIMIT_IP_PER_MINUTE), RATE_LIMIT_IP_BURST),
+                (f"{scope}:user:{current_user}", _per_second(RATE_LIMIT_USER_PER_MINUTE), RATE_LIMIT_USER_BURST)
+            ]
+            wait = rate_limiter.acquire(checks)
+            if wait:
+                retry_after = max(1, math.ceil(wait))
+                response = jsonify({
+                    'error': 'Too many requests. Please slow down.',
+                    'code': 'RATE_LIMITED',
+                    'retry_after': retry_after
+                })
+                response.headers['Retry-After'] = str(retry_after)
+                return response, 429
+
+            return f(current_user, *args, **kwargs)
+        return decorated
+    return decorator
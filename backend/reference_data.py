@@ -0,0 +1,121 @@
+import hashlib
+import json
+import threading
+import time
+
+from config import REFERENCE_REFRESH_SECONDS
+
+LIMITS_TABLE = 'usage_limits'
+UNLOADED_RETRY_SECONDS = 5.0
+
+# Used for plans missing from usage_limits, and until the first successful sync
+DEFAULT_LIMITS = {
+    'free': {
+        'max_text_length': 10000,  # 10k characters
+        'daily_summaries': 5       # 5 summaries per day
+    },
+    'pro': {
+        'max_text_length': 50000,  # 50k characters
+        'daily_summaries': 30      # 30 summaries per day
+    },
+    'enterprise': {
+        'max_text_length': 100000, # 100k characters
+        'daily_summaries': 1000    # 1000 summaries per day
+    }
+}
+
+
+class ReferenceData:
+    """
+    In-memory replica of rarely changing reference data: usage_limits rows
+    by plan and the get_enum_values catalog.
+
+    Lookups never hit the database. The replica is loaded at startup and
+    re-read at most once every `refresh_seconds` from whichever request
+    notices it is stale; a failed refresh keeps serving the last good copy,
+    so limit checks and settings validation ride out Supabase blips.
+    """
+
+    def __init__(self, refresh_seconds=REFERENCE_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._limits = {}
+        self._enum_values = []
+        self._version = None
+        self._last_refresh = 0.0
+        self._refreshing = False
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        """Digest of the replicated data; changes whenever a sync picks up an edit."""
+        return self._version
+
+    def on_change(self, listener):
+        """Call `listener()` after every sync that picks up different data."""
+        self._listeners.append(listener)
+
+    def maybe_refresh(self, client):
+        now = time.monotonic()
+        # Until a first sync succeeds, retry every few seconds rather than every interval
+        interval = self.refresh_seconds if self._version is not None else min(self.refresh_seconds, UNLOADED_RETRY_SECONDS)
+        with self._lock:
+            if self._refreshing or now - self._last_refresh < interval:
+                return
+            self._refreshing = True
+        try:
+            self.sync(client)
+        finally:
+            with self._lock:
+                self._refreshing = False
+                self._last_refresh = time.monotonic()
+
+    def sync(self, client):
+        """Reload both tables. Returns True if the data changed."""
+        try:
+            limits_result = client.from_(LIMITS_TABLE).select('*').execute()
+            enum_result = client.rpc('get_enum_values').execute()
+        except Exception as e:
+            print(f"Error syncing reference data: {e}")
+            return False
+
+        limits = {
+            row['plan_type']: {
+                'max_text_length': row.get('max_text_length', DEFAULT_LIMITS['free']['max_text_length']),
+                'daily_summaries': row.get('daily_summaries_limit', DEFAULT_LIMITS['free']['daily_summaries'])
+            }
+            for row in limits_result.data or []
+        }
+        enum_values = enum_result.data or self._enum_values
+        version = hashlib.sha256(
+            json.dumps([limits, enum_values], sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()[:16]
+
+        with self._lock:
+            changed = version != self._version
+            self._limits = limits
+            self._enum_values = enum_values
+            self._version = version
+        if changed:
+            print(f"Loaded reference data version {version} ({len(limits)} plans, {len(enum_values)} enums)")
+            for listener in self._listeners:
+                try:
+                    listener()
+                except Exception as e:
+                    print(f"Error in reference data listener: {e}")
+        return changed
+
+    def plan_limits(self, plan):
+        """{'max_text_length', 'daily_summaries', 'plan_type'} for a plan."""
+        limits = self._limits.get(plan) or DEFAULT_LIMITS.get(plan) or DEFAULT_LIMITS['free']
+        return {**limits, 'plan_type': plan}
+
+    def enum_values(self):
+        """The get_enum_values RPC result: [{'enum_name', 'enum_values'}, ...]."""
+        return self._enum_values
+
+    def enum_choices(self, enum_name):
+        return [value for item in self._enum_values if item['enum_name'] == enum_name for value in item['enum_values']]
+
+
+reference_data = ReferenceData()
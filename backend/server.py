@@ -1,65 +1,125 @@
 import os
-from google import genai
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g, send_file, stream_with_context
 from dotenv import load_dotenv
 from flask_cors import CORS
-from supabase import create_client, Client
+from werkzeug.middleware.proxy_fix import ProxyFix
 from functools import wraps
 import jwt
-from datetime import datetime, timedelta
+import hashlib
+import hmac
+import uuid
+from collections import deque
+from itertools import chain, islice
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 from stripe_api import stripe_api
+from clients import get_supabase, get_gemini
+from auth_cache import JWT_ALGORITHM, TokenRevokedError, verify_token, revocation_list, revoke_user_tokens
+from rate_limit import rate_limited, rate_limiter
+from usage_buffer import usage_buffer
+from usage_rollups import usage_history
+from variants import (
+    text_digest,
+    variant_key,
+    variant_prefetcher,
+    regeneration_history,
+    prefetch_enabled,
+    prefetch_likely_variants,
+    parse_variant_response
+)
+from lifecycle import lifecycle, install_signal_handlers
+from concurrency import llm_limiter, UpstreamOverloaded
+from hedging import llm_hedger
+from events import event_broker, publish_event, format_sse
+import deadlines
+from deadlines import (
+    DEADLINE_HEADER,
+    Deadline,
+    DeadlineExceeded,
+    ClientDisconnected,
+    client_socket,
+    deadline_scope,
+    request_budget
+)
+from archive import get_archived_summary, search_archived, delete_archived, start_archiver
+from subscription_sync import start_reconciler
+from profiling import request_profiler, profiled
+from near_duplicates import text_signature, find_near_duplicate, remember_summary
+from reference_data import reference_data
+from json_encoding import FastJSONProvider, dumps as json_dumps, loads as json_loads, encode_json_array, stream_ndjson, wants_ndjson
+from pagination import user_rows
+from account_export import export_records, decode_cursor, InvalidCursor
+from prompts import build_prompt, build_variants_prompt, length_label, prompt_registry
+from http_cache import conditional_json, row_version, compress_response
+from api_keys import (
+    api_key_store,
+    api_key_usage,
+    looks_like_api_key,
+    create_api_key,
+    list_api_keys,
+    revoke_api_key
+)
 from config import (
     SUPABASE_URL,
     SUPABASE_KEY,
     JWT_SECRET,
     STRIPE_SECRET_KEY,
     STRIPE_WEBHOOK_SECRET,
-    GEMINI_API_KEY
+    GEMINI_API_KEY,
+    SUMMARIES_BULK_MAX_ITEMS,
+    VARIANT_PREFETCH_WAIT_SECONDS,
+    VARIANT_BATCH_MAX,
+    ADMIN_API_KEY,
+    API_KEY_PER_MINUTE,
+    INGEST_CONCURRENCY,
+    INGEST_MAX_DOCUMENTS,
+    INGEST_MAX_BYTES,
+    SUMMARIES_PAGE_SIZE,
+    REQUEST_DEADLINE_SECONDS,
+    SUMMARIZE_DEADLINE_SECONDS,
+    LLM_MIN_ATTEMPT_SECONDS,
+    HEDGE_ENABLED,
+    HEDGE_MODEL,
+    EVENTS_STREAM_SECONDS,
+    EVENTS_HEARTBEAT_SECONDS,
+    EVENTS_TICKET_SECONDS,
+    TRUSTED_PROXY_HOPS
 )
 import time
-from tenacity import retry, stop_after_attempt, wait_exponential
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
+
+# Take the client address from X-Forwarded-For only as far back as our own proxies appended it
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
 
 # Configure CORS with more specific settings
 CORS(app, resources={
     r"/*": {
         "origins": "*",  # Allow requests from any origin
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization", "X-Requested-With"],
+        "allow_headers": ["Content-Type", "Authorization", "X-Requested-With", "If-None-Match", "X-API-Key", "X-Profile", "X-Request-Timeout"],
         "supports_credentials": True,
-        "expose_headers": ["Access-Control-Allow-Origin"],
+        "expose_headers": ["Access-Control-Allow-Origin", "Retry-After", "ETag", "X-Profile-Id"],
         "max_age": 600
     }
 })
 
-# Initialize Supabase client
-supabase: Client = create_client(
-    supabase_url=os.environ.get('SUPABASE_URL'),
-    supabase_key=os.environ.get('SUPABASE_KEY')
-)
-
 # Register Stripe API routes
 app.register_blueprint(stripe_api, url_prefix='/api')
 
-# Configure Gemini API
-gemini_api_key = os.getenv("GEMINI_API_KEY")
-gemini_client = None
-if not gemini_api_key:
-    print("Warning: GEMINI_API_KEY not found in environment variables")
-else:
-    try:
-        gemini_client = genai.Client(api_key=gemini_api_key)
-        print("Successfully initialized Gemini API client")
-    except Exception as e:
-        print(f"Error configuring Gemini API: {e}")
-        gemini_client = None
-
-# JWT configuration
-JWT_ALGORITHM = "HS256"
+def issue_token(user_id):
+    now = datetime.utcnow()
+    return jwt.encode({
+        'sub': user_id,
+        'jti': uuid.uuid4().hex,
+        'iat': now,
+        'exp': now + timedelta(days=7)
+    }, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
 def token_required(f):
     @wraps(f)
@@ -72,18 +132,84 @@ def token_required(f):
             return jsonify({'message': 'Token is missing'}), 401
         
         try:
-            data = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+            data = verify_token(token, get_supabase())
             current_user = data['sub']
         except jwt.ExpiredSignatureError:
             return jsonify({'message': 'Token has expired'}), 401
+        except TokenRevokedError:
+            return jsonify({'message': 'Token has been revoked'}), 401
         except jwt.InvalidTokenError:
             return jsonify({'message': 'Invalid token'}), 401
+        except DeadlineExceeded:
+            # Not an auth failure: answered as 504/499 by the errorhandler
+            raise
         except Exception as e:
             return jsonify({'message': 'Token is invalid'}), 401
         
         return f(current_user, *args, **kwargs)
     return decorated
 
+EVENTS_TICKET_AUDIENCE = 'events'
+
+def issue_event_ticket(user_id):
+    """Short-lived token that only opens /user/events (it carries an audience regular tokens reject)."""
+    now = datetime.utcnow()
+    return jwt.encode({
+        'sub': user_id,
+        'aud': EVENTS_TICKET_AUDIENCE,
+        'iat': now,
+        'exp': now + timedelta(seconds=EVENTS_TICKET_SECONDS)
+    }, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+def event_stream_auth(f):
+    """`token_required`, or ?ticket= for EventSource clients, which can't send an Authorization header."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        ticket = request.args.get('ticket')
+        if not ticket:
+            return token_required(f)(*args, **kwargs)
+        try:
+            claims = jwt.decode(ticket, JWT_SECRET, algorithms=[JWT_ALGORITHM], audience=EVENTS_TICKET_AUDIENCE)
+        except jwt.InvalidTokenError:
+            return jsonify({'message': 'Invalid or expired ticket'}), 401
+        if revocation_list.is_revoked(claims):
+            return jsonify({'message': 'Token has been revoked'}), 401
+        return f(claims['sub'], *args, **kwargs)
+    return decorated
+
+def is_admin_request():
+    provided = request.headers.get('X-Admin-Key', '')
+    return bool(ADMIN_API_KEY) and hmac.compare_digest(provided, ADMIN_API_KEY)
+
+def admin_required(f):
+    """Operational endpoints, authenticated with the X-Admin-Key header."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not is_admin_request():
+            return jsonify({'message': 'Admin access required'}), 403
+        return f(*args, **kwargs)
+    return decorated
+
+def api_key_required(f):
+    """Machine clients, authenticated with an API key (X-API-Key or Authorization: Bearer lr_...)."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        key = request.headers.get('X-API-Key')
+        if not key and 'Authorization' in request.headers:
+            parts = request.headers['Authorization'].split(" ")
+            if len(parts) == 2 and looks_like_api_key(parts[1]):
+                key = parts[1]
+
+        if not key:
+            return jsonify({'message': 'API key is missing'}), 401
+
+        api_key = api_key_store.verify(get_supabase(), key)
+        if api_key is None:
+            return jsonify({'message': 'Invalid API key'}), 401
+
+        return f(api_key, *args, **kwargs)
+    return decorated
+
 @app.route('/auth/signup', methods=['POST'])
 def signup():
     try:
@@ -95,14 +221,14 @@ def signup():
             return jsonify({'error': 'Email and password are required'}), 400
         
         # Create user in Supabase
-        auth_response = supabase.auth.sign_up({
+        auth_response = get_supabase().auth.sign_up({
             "email": email,
             "password": password
         })
         
         if auth_response.user:
             # Create initial user settings
-            supabase.table('user_settings').insert({
+            get_supabase().table('user_settings').insert({
                 'user_id': auth_response.user.id,
                 'preferred_summary_length': '2-3 sentences (medium)',
                 'language': 'en',
@@ -113,7 +239,7 @@ def signup():
             }).execute()
             
             # Create free subscription
-            supabase.table('subscriptions').insert({
+            get_supabase().table('subscriptions').insert({
                 'user_id': auth_response.user.id,
                 'plan_type': 'free',
                 'status': 'active',
@@ -128,6 +254,8 @@ def signup():
         else:
             return jsonify({'error': 'Failed to create user'}), 400
             
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -142,18 +270,14 @@ def login():
             return jsonify({'error': 'Email and password are required'}), 400
         
         # Authenticate with Supabase
-        auth_response = supabase.auth.sign_in_with_password({
+        auth_response = get_supabase().auth.sign_in_with_password({
             "email": email,
             "password": password
         })
         
         if auth_response.user:
             # Generate JWT token
-            token = jwt.encode({
-                'sub': auth_response.user.id,
-                'iat': datetime.utcnow(),
-                'exp': datetime.utcnow() + timedelta(days=7)
-            }, JWT_SECRET, algorithm=JWT_ALGORITHM)
+            token = issue_token(auth_response.user.id)
             
             return jsonify({
                 'token': token,
@@ -162,6 +286,8 @@ def login():
         else:
             return jsonify({'error': 'Invalid credentials'}), 401
             
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -170,83 +296,68 @@ def login():
 def refresh_token(current_user):
     try:
         # Generate new JWT token
-        token = jwt.encode({
-            'sub': current_user,
-            'iat': datetime.utcnow(),
-            'exp': datetime.utcnow() + timedelta(days=7)
-        }, JWT_SECRET, algorithm=JWT_ALGORITHM)
+        token = issue_token(current_user)
         
         return jsonify({
             'token': token,
             'user_id': current_user
         }), 200
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/auth/logout', methods=['POST'])
+@token_required
+def logout(current_user):
+    try:
+        token = request.headers['Authorization'].split(" ")[1]
+        data = request.get_json(silent=True) or {}
+        
+        if data.get('all_sessions'):
+            # Invalidate every token issued to this user so far
+            revoke_user_tokens(get_supabase(), current_user)
+        else:
+            revocation_list.revoke_token(get_supabase(), verify_token(token))
+        
+        return jsonify({'message': 'Logged out successfully'}), 200
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 def get_user_limits(user_id):
     try:
+        reference_data.maybe_refresh(get_supabase())
+
         # Get user's subscription status
-        result = supabase.from_('subscriptions').select('*').eq('user_id', user_id).execute()
+        result = get_supabase().from_('subscriptions').select('*').eq('user_id', user_id).execute()
         
         # Default limits for free tier
         if not result.data:
-            return {
-                'max_text_length': 10000,  # 10k characters
-                'daily_summaries': 5,      # 5 summaries per day
-                'plan_type': 'free'
-            }
+            return reference_data.plan_limits('free')
         
         subscription = result.data[0]
         plan = subscription['plan_type']
         
-        # Get limits from the usage_limits table
-        limits_result = supabase.from_('usage_limits').select('*').eq('plan_type', plan).execute()
-        
-        if limits_result.data and len(limits_result.data) > 0:
-            # Use the limits from the database
-            limit_data = limits_result.data[0]
-            limits = {
-                'max_text_length': limit_data.get('max_text_length', 10000),
-                'daily_summaries': limit_data.get('daily_summaries_limit', 5),
-                'plan_type': plan
-            }
-        else:
-            # Fallback to default limits if not found in the database
-            default_limits = {
-                'free': {
-                    'max_text_length': 10000,  # 10k characters
-                    'daily_summaries': 5       # 5 summaries per day
-                },
-                'pro': {
-                    'max_text_length': 50000,  # 50k characters
-                    'daily_summaries': 30      # 30 summaries per day
-                },
-                'enterprise': {
-                    'max_text_length': 100000, # 100k characters
-                    'daily_summaries': 1000    # 1000 summaries per day
-                }
-            }
-            limits = default_limits.get(plan, default_limits['free'])
-            limits['plan_type'] = plan
-        
-        # Always include plan_type in the response
-        return limits
+        # Limits come from the local replica of the usage_limits table
+        return reference_data.plan_limits(plan)
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error getting user limits: {e}")
         # Return free tier limits as fallback
-        return {
-            'max_text_length': 10000,
-            'daily_summaries': 5,
-            'plan_type': 'free'
-        }
+        return reference_data.plan_limits('free')
 
 @app.route('/user/limits', methods=['GET'])
 @token_required
 def get_user_limits_endpoint(current_user):
     try:
         limits = get_user_limits(current_user)
-        return jsonify(limits), 200
+        return conditional_json(limits)
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return jsonify({"error": f"Failed to get user limits: {e}"}), 500
 
@@ -256,23 +367,123 @@ def get_user_usage(current_user):
     try:
         # Get today's usage
         today = datetime.utcnow().date().isoformat()
-        result = supabase.table('daily_usage').select('*').eq('user_id', current_user).eq('date', today).execute()
-        
-        if not result.data:
-            return jsonify({
-                'summaries_count': 0,
-                'characters_count': 0,
-                'date': today
-            }), 200
-            
-        return jsonify(result.data[0]), 200
+        # Includes increments still waiting in the write-behind buffer
+        usage = usage_buffer.get(get_supabase(), current_user, today)
+        return conditional_json(usage)
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error getting usage: {e}")
         return jsonify({"error": f"Failed to get usage: {e}"}), 500
 
+@app.route('/user/events/ticket', methods=['POST'])
+@token_required
+def create_event_ticket(current_user):
+    return jsonify({'ticket': issue_event_ticket(current_user), 'expires_in': EVENTS_TICKET_SECONDS}), 200
+
+@app.route('/user/events', methods=['GET'])
+@event_stream_auth
+def stream_user_events(current_user):
+    """
+    Server-sent events for the user: `usage` (same body as /user/usage),
+    `subscription` and `settings`, as they change. Streams end after
+    EVENTS_STREAM_SECONDS and EventSource reconnects on its own; when the
+    worker is at its stream limit clients get a 503 and keep polling.
+    """
+    subscription = event_broker.subscribe(current_user)
+    if subscription is None:
+        response = jsonify({'error': 'Too many open event streams', 'code': 'EVENTS_UNAVAILABLE'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+
+    def events():
+        try:
+            yield 'retry: 5000\n\n'
+            ends_at = time.monotonic() + EVENTS_STREAM_SECONDS
+            last_write = time.monotonic()
+            # Wake up every second so a draining worker isn't held up by open streams
+            while not lifecycle.draining and time.monotonic() < ends_at:
+                event = subscription.get(timeout=1.0)
+                if event is not None:
+                    yield format_sse(event)
+                    last_write = time.monotonic()
+                elif time.monotonic() - last_write >= EVENTS_HEARTBEAT_SECONDS:
+                    # Keeps proxies from timing the stream out; a failed write ends it
+                    yield ': keep-alive\n\n'
+                    last_write = time.monotonic()
+        finally:
+            event_broker.unsubscribe(subscription)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def publish_usage(user_id, today):
+    # Open event streams get the same body /user/usage would return
+    try:
+        publish_event(user_id, 'usage', usage_buffer.get(get_supabase(), user_id, today))
+    except Exception as e:
+        print(f"Error publishing usage for user {user_id}: {e}")
+
+@app.route('/user/usage/history', methods=['GET'])
+@token_required
+def get_user_usage_history(current_user):
+    try:
+        today = datetime.utcnow().date()
+        try:
+            end = date.fromisoformat(request.args['end']) if request.args.get('end') else today
+            start = date.fromisoformat(request.args['start']) if request.args.get('start') else end - timedelta(days=29)
+        except (ValueError, OverflowError):
+            return jsonify({'error': 'start and end must be dates in YYYY-MM-DD format'}), 400
+        granularity = request.args.get('granularity', 'day')
+
+        try:
+            history = usage_history(get_supabase(), current_user, start, end, granularity)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return conditional_json(history)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print(f"Error getting usage history: {e}")
+        return jsonify({"error": f"Failed to get usage history: {e}"}), 500
+
+@app.route('/user/export', methods=['GET'])
+@token_required
+@rate_limited('export')
+def export_user_data(current_user):
+    """
+    Everything stored for the user as NDJSON: settings, subscription, daily
+    usage, summaries and archived summaries, one {"type", "cursor", "data"}
+    record per line and a final {"type": "end"}. An interrupted download is
+    resumed by passing the last received cursor as ?cursor=.
+    """
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except InvalidCursor as e:
+            return jsonify({'error': str(e)}), 400
+
+    def lines():
+        try:
+            for record in export_records(get_supabase(), current_user, cursor):
+                yield json_dumps(record) + '\n'
+            yield json_dumps({'type': 'end'}) + '\n'
+        except Exception as e:
+            # Headers are already sent; tell the client to resume from its last cursor
+            print(f"Error exporting data for user {current_user}: {e}")
+            yield json_dumps({'type': 'error', 'error': 'Export interrupted, resume with the last cursor'}) + '\n'
+
+    response = Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename="lightread-export.ndjson"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 def get_user_id_from_token(token):
     try:
-        decoded = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        decoded = verify_token(token, get_supabase())
         return decoded['sub']
     except jwt.ExpiredSignatureError:
         return None
@@ -284,6 +495,7 @@ def get_user_id_from_token(token):
 
 def get_authenticated_supabase(token):
     """Create an authenticated Supabase client with the JWT token"""
+    from supabase import create_client
     client = create_client(
         os.getenv("SUPABASE_URL"),
         os.getenv("SUPABASE_KEY")
@@ -292,39 +504,182 @@ def get_authenticated_supabase(token):
     client.postgrest.auth(token)
     return client
 
-# Initialize Gemini API with retry logic
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-def initialize_gemini():
-    try:
-        if not gemini_api_key:
-            raise ValueError("GEMINI_API_KEY not found in environment variables")
-            
-        # Initialize client
-        client = genai.Client(api_key=gemini_api_key)
+def out_of_budget(retry_state):
+    # Stop retrying once another attempt couldn't finish inside the request deadline
+    remaining = deadlines.remaining()
+    return remaining is not None and remaining < LLM_MIN_ATTEMPT_SECONDS
+
+def llm_retry(f):
+    """
+    Retry Gemini calls with exponential backoff (shed calls are not retried).
+    Backoff is shortened and retries stop so the request deadline is kept.
+    The tenacity policy is built on the first call, keeping it out of startup.
+    """
+    policy = None
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        nonlocal policy
+        if policy is None:
+            from tenacity import Retrying, retry_if_not_exception_type, stop_after_attempt, wait_exponential
+            backoff = wait_exponential(multiplier=1, min=4, max=10)
+
+            def wait_within_budget(retry_state):
+                delay = backoff(retry_state)
+                remaining = deadlines.remaining()
+                if remaining is None:
+                    return delay
+                return max(0.0, min(delay, remaining - LLM_MIN_ATTEMPT_SECONDS))
+
+            policy = Retrying(stop=stop_after_attempt(3) | out_of_budget, wait=wait_within_budget,
+                              retry=retry_if_not_exception_type((UpstreamOverloaded, DeadlineExceeded)), reraise=True)
+        try:
+            return policy.copy()(f, *args, **kwargs)
+        except (UpstreamOverloaded, DeadlineExceeded):
+            raise
+        except Exception:
+            # A failure caused by the spent budget is reported as such
+            deadlines.check()
+            raise
+    return wrapper
+
+GEMINI_MODEL = 'gemini-2.5-flash-lite'
+
+def request_gemini(model, contents, config=None, block=True):
+    """
+    One Gemini call through the adaptive limiter. Under a request deadline,
+    queueing and the HTTP call share what is left of it.
+    """
+    deadlines.check()
+    remaining = deadlines.remaining()
+    # Running out of budget or losing the client says nothing about upstream
+    # health, so those exits don't count against the adaptive limit
+    with llm_limiter.slot(block=block, timeout=remaining, neutral=(DeadlineExceeded,)):
+        if remaining is not None:
+            deadlines.check()
+            remaining = deadlines.remaining()
+            # google-genai takes per-request HTTP options in milliseconds
+            config = {**(config or {}), 'http_options': {'timeout': max(1, int(remaining * 1000))}}
+        try:
+            return get_gemini().models.generate_content(
+                model=model,
+                contents=contents,
+                config=config
+            )
+        except Exception:
+            # A timeout set from our own budget is reported as the deadline
+            deadlines.check()
+            raise
+
+def call_gemini(contents, config=None, background=False):
+    """
+    Every summarization call to Gemini goes through the adaptive limiter.
+    Background work never queues: it is dropped when no slot is free.
+    With HEDGE_ENABLED, a slow foreground call gets one duplicate (to
+    HEDGE_MODEL if set) that only runs when a slot is free right away.
+    """
+    if background or not HEDGE_ENABLED:
+        return request_gemini(GEMINI_MODEL, contents, config, block=not background)
+    return llm_hedger.call(
+        lambda: request_gemini(GEMINI_MODEL, contents, config),
+        lambda: request_gemini(HEDGE_MODEL or GEMINI_MODEL, contents, config, block=False)
+    )
+
+# Generate summary with retry logic
+@llm_retry
+def generate_summary(prompt, background=False):
+    response = call_gemini(prompt, background=background)
+    if not response or not response.text:
+        raise Exception("Empty response from Gemini")
         
-        # Test the client with a simple prompt
-        response = client.models.generate_content(
-            model='gemini-2.5-flash-lite',
-            contents='Test connection'
-        )
-        if not response or not response.text:
-            raise Exception("Failed to get response from Gemini API")
-            
-        return client
+    return response.text.strip()
+
+VARIANTS_RESPONSE_SCHEMA = {
+    'type': 'ARRAY',
+    'items': {
+        'type': 'OBJECT',
+        'properties': {
+            'id': {'type': 'INTEGER'},
+            'summary': {'type': 'STRING'}
+        },
+        'required': ['id', 'summary']
+    }
+}
+
+@llm_retry
+def generate_variants_response(prompt, count, background=False):
+    response = call_gemini(prompt, config={
+        'response_mime_type': 'application/json',
+        'response_schema': VARIANTS_RESPONSE_SCHEMA
+    }, background=background)
+    if not response or not response.text:
+        raise Exception("Empty response from Gemini")
+
+    summaries = parse_variant_response(response.text, count)
+    if not summaries:
+        raise Exception("No usable variants in Gemini response")
+    return summaries
+
+def generate_summary_variants(text, length, variants, background=False):
+    """
+    One summary per (tone, difficulty) pair from a single structured-output
+    call. Any variant the model leaves out is generated on its own.
+    """
+    if len(variants) == 1:
+        tone, difficulty = variants[0]
+        return [generate_summary(build_prompt(text, length, tone, difficulty), background=background)]
+
+    summaries = generate_variants_response(build_variants_prompt(text, length, variants), len(variants), background=background)
+    results = []
+    for index, (tone, difficulty) in enumerate(variants):
+        summary = summaries.get(index)
+        if summary is None:
+            print(f"Variant {index} missing from multi-variant response, generating it separately")
+            summary = generate_summary(build_prompt(text, length, tone, difficulty), background=background)
+        results.append(summary)
+    return results
+
+def parse_requested_variants(requested, settings):
+    """Validate the `variants` request field. Returns (pairs, None) or (None, error message)."""
+    if not isinstance(requested, list) or not requested:
+        return None, 'variants must be a non-empty list'
+    if len(requested) > VARIANT_BATCH_MAX:
+        return None, f'At most {VARIANT_BATCH_MAX} variants can be requested at once'
+
+    pairs = []
+    for item in requested:
+        if not isinstance(item, dict):
+            return None, 'Each variant must be an object with tone and/or difficulty'
+        tone = item.get('tone') or settings['summary_tone']
+        difficulty = item.get('difficulty') or settings['summary_difficulty']
+        if not isinstance(tone, str) or not isinstance(difficulty, str):
+            return None, 'Variant tone and difficulty must be strings'
+        if (tone, difficulty) not in pairs:
+            pairs.append((tone, difficulty))
+    return pairs, None
+
+def warm_prompt_templates():
+    try:
+        count = prompt_registry.warm_from_enum_values(reference_data.enum_values())
+        print(f"Precompiled {count} prompt templates")
     except Exception as e:
-        print(f"Error initializing Gemini: {str(e)}")
-        raise
+        # Templates are compiled on first use instead
+        print(f"Could not precompile prompt templates: {e}")
 
-# Initialize Gemini client
-try:
-    gemini_client = initialize_gemini()
-    print("Successfully initialized Gemini client with test connection")
-except Exception as e:
-    print(f"Failed to initialize Gemini after retries: {str(e)}")
-    gemini_client = None
+# Recompile whenever the enum catalogs change, starting with the first load
+reference_data.on_change(warm_prompt_templates)
+
+def warm_startup_caches():
+    """
+    Load reference data, which precompiles the prompt templates, before the
+    first request needs them. Run once per worker (see gunicorn.conf.py);
+    if Supabase is unreachable, both load on first use instead.
+    """
+    reference_data.maybe_refresh(get_supabase())
 
 @app.route('/summarize', methods=['POST'])
 @token_required
+@rate_limited('summarize')
 def summarize_text(current_user):
     try:
         # Get the text to summarize from request
@@ -346,10 +701,8 @@ def summarize_text(current_user):
             
         # Get today's usage
         today = datetime.now().date().isoformat()
-        result = supabase.from_('daily_usage').select('*').eq('user_id', current_user).eq('date', today).execute()
-        
-        current_usage = result.data[0] if result.data else {'summaries_count': 0}
-        summaries_count = current_usage.get('summaries_count', 0)
+        current_usage = usage_buffer.get(get_supabase(), current_user, today)
+        summaries_count = current_usage['summaries_count']
         
         if summaries_count >= user_limits['daily_summaries']:
             return jsonify({
@@ -359,7 +712,7 @@ def summarize_text(current_user):
             }), 429
 
         # Get user settings for summary preferences
-        settings_result = supabase.from_('user_settings').select('*').eq('user_id', current_user).execute()
+        settings_result = get_supabase().from_('user_settings').select('*').eq('user_id', current_user).execute()
         settings = settings_result.data[0] if settings_result.data else {
             'preferred_summary_length': '2-3 sentences (medium)',
             'summary_tone': 'neutral',
@@ -370,10 +723,9 @@ def summarize_text(current_user):
         is_pro = user_limits['plan_type'] in ['pro', 'enterprise']
 
         # Check for override parameters (only for pro users)
+        override_tone = data.get('override_tone')
+        override_difficulty = data.get('override_difficulty')
         if is_pro:
-            override_tone = data.get('override_tone')
-            override_difficulty = data.get('override_difficulty')
-            
             if override_tone or override_difficulty:
                 # Increment usage count for regenerated summaries
                 summaries_count += 1
@@ -388,73 +740,123 @@ def summarize_text(current_user):
                     settings['summary_tone'] = override_tone
                 if override_difficulty:
                     settings['summary_difficulty'] = override_difficulty
-        elif data.get('override_tone') or data.get('override_difficulty'):
+        elif data.get('override_tone') or data.get('override_difficulty') or data.get('variants'):
             # Non-pro users trying to regenerate
             return jsonify({
                 'error': 'Summary regeneration is only available for pro users',
                 'code': 'PRO_FEATURE'
             }), 403
 
-        # Generate summary using Gemini
-        if not gemini_client:
-            return jsonify({
-                "error": "Summarization service is not available. Please check server configuration."
-            }), 503
-
         # Extract the length from the preferred_summary_length value
-        length = settings['preferred_summary_length'].split(' (')[0]  # Gets "2-3 sentences" from "2-3 sentences (medium)"
+        length = length_label(settings['preferred_summary_length'])  # Gets "2-3 sentences" from "2-3 sentences (medium)"
+        tone = settings['summary_tone'] if is_pro else None
+        difficulty = settings['summary_difficulty'] if is_pro else None
 
-        # Build prompt based on user's plan type
-        if is_pro:
-            prompt = f"""Please summarize the following text in {length}.
-Use a {settings['summary_tone']} tone and target a {settings['summary_difficulty']} comprehension level.
+        digest = text_digest(text)
+
+        if is_pro and 'variants' in data:
+            # Several tone/difficulty variants at once, from one LLM call
+            pairs, error = parse_requested_variants(data['variants'], settings)
+            if error:
+                return jsonify({'error': error}), 400
+            if summaries_count + len(pairs) > user_limits['daily_summaries']:
+                return jsonify({
+                    'error': 'Daily summary limit reached',
+                    'limit': user_limits['daily_summaries'],
+                    'current': summaries_count
+                }), 429
+
+            keys = [variant_key(current_user, digest, length, t, d) for t, d in pairs]
+            taken = {key: variant_prefetcher.take(key, timeout=VARIANT_PREFETCH_WAIT_SECONDS) for key in keys}
+            results = {key: summary for key, (summary, _) in taken.items()}
+            # Alternates returned by an earlier multi-variant request were charged then
+            charged = sum(1 for _, prepaid in taken.values() if not prepaid)
+            missing = [key for key in keys if results[key] is None]
+            if missing:
+                if not get_gemini():
+                    return jsonify({
+                        "error": "Summarization service is not available. Please check server configuration."
+                    }), 503
+                generated = generate_summary_variants(text, length, [key[-2:] for key in missing])
+                for key, summary in zip(missing, generated):
+                    results[key] = summary
 
-Text to summarize:
----
-{text}
----"""
+            # The first variant is the one shown; the alternates stay cached so
+            # regenerating to one of them is instant and not charged again
+            for key in keys[1:]:
+                variant_prefetcher.put(key, results[key], prepaid=True)
+
+            # Every variant served counts as one summary
+            if charged:
+                usage_buffer.increment(get_supabase(), current_user, today, summaries=charged, characters=char_count)
+                publish_usage(current_user, today)
+
+            summaries = [
+                {'tone': t, 'difficulty': d, 'summary': results[key]}
+                for (t, d), key in zip(pairs, keys)
+            ]
+            return jsonify({
+                'summary': summaries[0]['summary'],
+                'summaries': summaries,
+                'usage': {
+                    'daily_summaries': {
+                        'current': summaries_count + charged,
+                        'limit': user_limits['daily_summaries']
+                    },
+                    'text_length': {
+                        'current': char_count,
+                        'limit': user_limits['max_text_length']
+                    }
+                }
+            })
+
+        key = variant_key(current_user, digest, length, tone, difficulty)
+        regenerating = is_pro and bool(override_tone or override_difficulty)
+
+        signature = text_signature(text)
+        prepaid = False
+        if regenerating:
+            # A regenerate asks for new text: only a prefetched variant or a
+            # multi-variant alternate counts, never the summary shown for this passage
+            regeneration_history.record(current_user, tone, difficulty)
+            summary, prepaid = variant_prefetcher.take(key, timeout=VARIANT_PREFETCH_WAIT_SECONDS)
         else:
-            prompt = f"""Please summarize the following text in {length}.
-
-Text to summarize:
----
-{text}
----"""
-
-        # Generate summary with retry logic
-        @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-        def generate_summary(prompt):
-            response = gemini_client.models.generate_content(
-                model='gemini-2.5-flash-lite',
-                contents=prompt
+            # Reuse a summary of (nearly) the same passage with the same settings
+            summary = find_near_duplicate(signature, length, tone, difficulty)
+
+        if summary is None:
+            # Generate summary using Gemini
+            if not get_gemini():
+                return jsonify({
+                    "error": "Summarization service is not available. Please check server configuration."
+                }), 503
+
+            summary = generate_summary(build_prompt(text, length, tone, difficulty))
+            remember_summary(signature, length, tone, difficulty, summary)
+
+        if not regenerating and prefetch_enabled(settings, is_pro) and get_gemini():
+            prefetch_likely_variants(
+                current_user, digest, length, tone, difficulty,
+                lambda pairs: generate_summary_variants(text, length, pairs, background=True)
             )
-            if not response or not response.text:
-                raise Exception("Empty response from Gemini")
-                
-            return response.text.strip()
-            
-        # Generate summary
-        summary = generate_summary(prompt)
-        
-        # Update daily usage
-        new_usage = {
-            'user_id': current_user,
-            'date': today,
-            'summaries_count': summaries_count + 1,
-            'total_characters': (current_usage.get('total_characters', 0) or 0) + char_count
-        }
         
-        # Use upsert with conflict target
-        supabase.from_('daily_usage').upsert(
-            new_usage,
-            on_conflict='user_id,date'
-        ).execute()
+        # Update daily usage (written to daily_usage in the background)
+        charged = 0 if prepaid else summaries_count + 1 - current_usage['summaries_count']
+        if charged:
+            usage_buffer.increment(
+                get_supabase(),
+                current_user,
+                today,
+                summaries=charged,
+                characters=char_count
+            )
+            publish_usage(current_user, today)
         
         return jsonify({
             'summary': summary,
             'usage': {
                 'daily_summaries': {
-                    'current': summaries_count + 1,
+                    'current': current_usage['summaries_count'] + charged,
                     'limit': user_limits['daily_summaries']
                 },
                 'text_length': {
@@ -464,10 +866,66 @@ Text to summarize:
             }
         })
         
+    except UpstreamOverloaded as e:
+        response = jsonify({'error': 'Summarization service is busy. Please try again shortly.'})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
+    except DeadlineExceeded as e:
+        return deadline_response(e)
     except Exception as e:
         print(f"Error in summarize_text: {e}")
         return jsonify({'error': 'Failed to generate summary'}), 500
 
+def summary_content_hash(summary, source_url):
+    # Must match the backfill in migrations/004_summary_content_hash.sql
+    return hashlib.sha256(f"{source_url or ''}\x1f{summary}".encode('utf-8')).hexdigest()
+
+def build_summary_row(user_id, data):
+    """Validate a save request body. Returns (row, None) or (None, error message)."""
+    if not isinstance(data, dict):
+        return None, 'Each summary must be an object'
+
+    # Extract required fields
+    summary = data.get('summary')
+    source_url = data.get('source_url')
+    character_count = data.get('character_count')
+
+    if not all([summary, character_count]):
+        missing_fields = []
+        if not summary: missing_fields.append('summary')
+        if not character_count: missing_fields.append('character_count')
+        return None, f'Missing required fields: {", ".join(missing_fields)}'
+
+    return {
+        'user_id': user_id,
+        'summary': summary,
+        'source_url': source_url,
+        'character_count': character_count,
+        'content_hash': summary_content_hash(summary, source_url)
+    }, None
+
+def store_summaries(user_id, rows):
+    """
+    Insert summary rows, skipping ones this user has already saved.
+
+    Returns {content_hash: (id, created)}; repeats (double clicks, extension
+    retries) resolve to the existing row's id instead of a new row.
+    """
+    unique_rows = list({row['content_hash']: row for row in rows}.values())
+    result = get_supabase().from_('summaries').upsert(
+        unique_rows,
+        on_conflict='user_id,content_hash',
+        ignore_duplicates=True
+    ).execute()
+    stored = {row['content_hash']: (row['id'], True) for row in result.data or []}
+
+    existing_hashes = [row['content_hash'] for row in unique_rows if row['content_hash'] not in stored]
+    if existing_hashes:
+        result = get_supabase().from_('summaries').select('id,content_hash').eq('user_id', user_id).in_('content_hash', existing_hashes).execute()
+        for row in result.data or []:
+            stored[row['content_hash']] = (row['id'], False)
+    return stored
+
 @app.route('/summaries/save', methods=['POST'])
 @token_required
 def save_summary(current_user):
@@ -479,37 +937,36 @@ def save_summary(current_user):
 
         print("Received save request with data:", data)
 
-        # Extract required fields
-        summary = data.get('summary')
-        source_url = data.get('source_url')
-        character_count = data.get('character_count')
-
-        if not all([summary, character_count]):
-            missing_fields = []
-            if not summary: missing_fields.append('summary')
-            if not character_count: missing_fields.append('character_count')
-            print(f"Missing required fields: {missing_fields}")
-            return jsonify({'error': f'Missing required fields: {", ".join(missing_fields)}'}), 400
+        row, error = build_summary_row(current_user, data)
+        if error:
+            print(error)
+            return jsonify({'error': error}), 400
 
         # Save summary to database
         print(f"Attempting to save summary for user {current_user}")
-        result = supabase.from_('summaries').insert({
-            'user_id': current_user,
-            'summary': summary,
-            'source_url': source_url,
-            'character_count': character_count
-        }).execute()
+        stored = store_summaries(current_user, [row])
 
-        if not result.data:
+        if row['content_hash'] not in stored:
             print("Failed to save summary - no data returned from Supabase")
             raise Exception("Failed to save summary")
 
-        print(f"Successfully saved summary with ID: {result.data[0]['id']}")
+        summary_id, created = stored[row['content_hash']]
+        if not created:
+            print(f"Summary already saved with ID: {summary_id}")
+            return jsonify({
+                'message': 'Summary already saved',
+                'id': summary_id,
+                'duplicate': True
+            }), 200
+
+        print(f"Successfully saved summary with ID: {summary_id}")
         return jsonify({
             'message': 'Summary saved successfully',
-            'id': result.data[0]['id']
+            'id': summary_id
         }), 201
 
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error saving summary: {str(e)}")
         print(f"Error type: {type(e)}")
@@ -517,23 +974,193 @@ def save_summary(current_user):
         print(f"Traceback: {traceback.format_exc()}")
         return jsonify({'error': 'Failed to save summary'}), 500
 
+@app.route('/summaries/bulk', methods=['POST'])
+@token_required
+def save_summaries_bulk(current_user):
+    try:
+        data = request.get_json(silent=True) or {}
+        items = data.get('summaries')
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'A non-empty summaries list is required'}), 400
+        if len(items) > SUMMARIES_BULK_MAX_ITEMS:
+            return jsonify({'error': f'At most {SUMMARIES_BULK_MAX_ITEMS} summaries can be saved at once'}), 400
+
+        # Validate every item up front; only the valid ones are inserted
+        rows = []
+        indexes = []
+        errors = []
+        for index, item in enumerate(items):
+            row, error = build_summary_row(current_user, item)
+            if error:
+                errors.append({'index': index, 'error': error})
+            else:
+                rows.append(row)
+                indexes.append(index)
+
+        saved = []
+        if rows:
+            # One PostgREST call for the whole batch (plus one lookup for repeats)
+            stored = store_summaries(current_user, rows)
+            for index, row in zip(indexes, rows):
+                if row['content_hash'] not in stored:
+                    raise Exception("Failed to save summaries")
+                summary_id, created = stored[row['content_hash']]
+                saved.append({'index': index, 'id': summary_id, 'duplicate': not created})
+
+        print(f"Bulk saved {len(saved)} summaries for user {current_user} ({len(errors)} rejected)")
+        if not saved:
+            status = 400
+        elif errors:
+            status = 207
+        else:
+            status = 201
+        return jsonify({'saved': saved, 'errors': errors}), status
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print(f"Error bulk saving summaries: {e}")
+        return jsonify({'error': 'Failed to save summaries'}), 500
+
+@app.route('/summaries/bulk', methods=['DELETE'])
+@token_required
+def delete_summaries_bulk(current_user):
+    try:
+        data = request.get_json(silent=True) or {}
+        ids = data.get('ids')
+        if not isinstance(ids, list) or not ids:
+            return jsonify({'error': 'A non-empty ids list is required'}), 400
+        if len(ids) > SUMMARIES_BULK_MAX_ITEMS:
+            return jsonify({'error': f'At most {SUMMARIES_BULK_MAX_ITEMS} summaries can be deleted at once'}), 400
+
+        errors = []
+        # Index -> canonical id; anything that isn't a UUID would fail the whole query
+        valid_ids = {}
+        for index, summary_id in enumerate(ids):
+            try:
+                valid_ids[index] = str(uuid.UUID(summary_id))
+            except (TypeError, ValueError, AttributeError):
+                errors.append({'index': index, 'error': 'Invalid summary id'})
+
+        deleted = []
+        unique_ids = list(dict.fromkeys(valid_ids.values()))
+        if unique_ids:
+            # Scoped to the current user, so other users' ids are simply not found
+            result = get_supabase().from_('summaries').delete().eq('user_id', current_user).in_('id', unique_ids).execute()
+            deleted = [row['id'] for row in result.data or []]
+
+        # Anything not in the hot table may have been archived
+        deleted_keys = {str(summary_id) for summary_id in deleted}
+        remaining = [summary_id for summary_id in unique_ids if summary_id not in deleted_keys]
+        if remaining:
+            deleted += delete_archived(get_supabase(), current_user, remaining)
+            deleted_keys = {str(summary_id) for summary_id in deleted}
+        for index, summary_id in valid_ids.items():
+            if summary_id not in deleted_keys:
+                errors.append({'index': index, 'error': 'Summary not found'})
+        errors.sort(key=lambda error: error['index'])
+
+        if not deleted:
+            status = 404 if valid_ids else 400
+        elif errors:
+            status = 207
+        else:
+            status = 200
+        return jsonify({'deleted': deleted, 'errors': errors}), status
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print(f"Error bulk deleting summaries: {e}")
+        return jsonify({'error': 'Failed to delete summaries'}), 500
+
 @app.route('/summaries', methods=['GET'])
 @token_required
 def get_summaries(current_user):
     try:
-        # Get user's summaries from database
-        result = supabase.table('summaries').select('*').eq('user_id', current_user).order('created_at', desc=True).execute()
-        return jsonify(result.data), 200
+        # Get user's summaries from database, one page at a time
+        rows = user_rows(get_supabase(), 'summaries', current_user, SUMMARIES_PAGE_SIZE)
+        head = list(islice(rows, SUMMARIES_PAGE_SIZE + 1))
+        ndjson = wants_ndjson(request)
+
+        if len(head) <= SUMMARIES_PAGE_SIZE and not ndjson:
+            # Summaries are immutable once saved, so ids and timestamps identify the list
+            return conditional_json(head, version=row_version(head))
+
+        rows = chain(head, rows)
+        if ndjson:
+            # Streamed while later pages are fetched
+            def lines():
+                try:
+                    yield from stream_ndjson(rows)
+                except Exception as e:
+                    # Headers are already sent; end with an error line, as /user/export does
+                    print(f"Error streaming summaries for user {current_user}: {e}")
+                    yield json_dumps({'error': 'Summary list interrupted', 'code': 'INTERRUPTED'}) + '\n'
+
+            return Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+
+        # A JSON array can't report a failure once it has started, so every
+        # page is fetched (and encoded row by row) before responding
+        return Response(encode_json_array(rows), mimetype='application/json')
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error fetching summaries: {e}")
         return jsonify({"error": f"Failed to fetch summaries: {e}"}), 500
 
+@app.route('/summaries/search', methods=['GET'])
+@token_required
+def search_summaries(current_user):
+    try:
+        query = (request.args.get('q') or '').strip()
+        if not query:
+            return jsonify({'error': 'A search query (q) is required'}), 400
+        try:
+            limit = max(1, min(int(request.args.get('limit', 50)), 200))
+        except ValueError:
+            return jsonify({'error': 'limit must be a number'}), 400
+
+        # PostgREST pattern: escape wildcards and drop quotes, which delimit the value
+        pattern = '%' + query.replace('"', '').replace('%', r'\%').replace('_', r'\_') + '%'
+        result = get_supabase().table('summaries').select('*').eq('user_id', current_user) \
+            .or_(f'summary.ilike."{pattern}",source_url.ilike."{pattern}"') \
+            .order('created_at', desc=True).limit(limit).execute()
+        matches = result.data or []
+
+        # Archived summaries are rehydrated transparently
+        if len(matches) < limit:
+            matches += search_archived(get_supabase(), current_user, query, limit - len(matches))
+
+        return jsonify(matches), 200
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print(f"Error searching summaries: {e}")
+        return jsonify({"error": f"Failed to search summaries: {e}"}), 500
+
+@app.route('/summaries/<summary_id>', methods=['GET'])
+@token_required
+def get_summary(current_user, summary_id):
+    try:
+        result = get_supabase().table('summaries').select('*').eq('user_id', current_user).eq('id', summary_id).execute()
+        if result.data:
+            return conditional_json(result.data[0])
+
+        summary = get_archived_summary(get_supabase(), current_user, summary_id)
+        if summary is None:
+            return jsonify({'error': 'Summary not found'}), 404
+        return conditional_json(summary)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print(f"Error fetching summary: {e}")
+        return jsonify({"error": f"Failed to fetch summary: {e}"}), 500
+
 @app.route('/user/settings', methods=['GET'])
 @token_required
 def get_user_settings(current_user):
     try:
         # Try to get user's settings
-        result = supabase.from_('user_settings').select('*').eq('user_id', current_user).execute()
+        result = get_supabase().from_('user_settings').select('*').eq('user_id', current_user).execute()
         
         # If no settings exist, create default settings
         if not result.data:
@@ -542,9 +1169,11 @@ def get_user_settings(current_user):
                 'preferred_summary_length': 'medium',
                 'theme': 'system'
             }
-            result = supabase.from_('user_settings').insert(default_settings).execute()
+            result = get_supabase().from_('user_settings').insert(default_settings).execute()
         
-        return jsonify(result.data[0]), 200
+        return conditional_json(result.data[0])
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error fetching settings: {e}")
         return jsonify({"error": f"Failed to fetch settings: {e}"}), 500
@@ -555,17 +1184,17 @@ def update_user_settings(current_user):
     try:
         data = request.get_json()
         
-        # Get valid enum values
-        enum_values = supabase.rpc('get_enum_values').execute()
-        if not enum_values.data:
+        # Get valid enum values from the local replica
+        reference_data.maybe_refresh(get_supabase())
+        if not reference_data.enum_values():
             raise Exception("Failed to get enum values for validation")
             
         # Create validation map from enum values
         valid_settings = {
-            'preferred_summary_length': [v for item in enum_values.data if item['enum_name'] == 'summary_length' for v in item['enum_values']],
+            'preferred_summary_length': reference_data.enum_choices('summary_length'),
             'theme': ['light', 'dark', 'system'],
-            'summary_tone': [v for item in enum_values.data if item['enum_name'] == 'summary_tone' for v in item['enum_values']],
-            'summary_difficulty': [v for item in enum_values.data if item['enum_name'] == 'summary_difficulty' for v in item['enum_values']]
+            'summary_tone': reference_data.enum_choices('summary_tone'),
+            'summary_difficulty': reference_data.enum_choices('summary_difficulty')
         }
         
         for key, value in data.items():
@@ -573,16 +1202,16 @@ def update_user_settings(current_user):
                 return jsonify({"error": f"Invalid value for {key}"}), 400
 
         # Check if settings exist
-        existing_settings = supabase.from_('user_settings').select('*').eq('user_id', current_user).execute()
+        existing_settings = get_supabase().from_('user_settings').select('*').eq('user_id', current_user).execute()
         
         if existing_settings.data:
             # Update existing settings
-            result = supabase.from_('user_settings').update({
+            result = get_supabase().from_('user_settings').update({
                 **data
             }).eq('user_id', current_user).execute()
         else:
             # Create new settings
-            result = supabase.from_('user_settings').insert({
+            result = get_supabase().from_('user_settings').insert({
                 'user_id': current_user,
                 **data
             }).execute()
@@ -590,7 +1219,10 @@ def update_user_settings(current_user):
         if not result.data:
             raise Exception("Failed to update settings")
 
+        publish_event(current_user, 'settings', result.data[0])
         return jsonify(result.data[0]), 200
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error updating settings: {e}")
         return jsonify({"error": f"Failed to update settings: {e}"}), 500
@@ -599,21 +1231,375 @@ def update_user_settings(current_user):
 @token_required
 def get_enum_values(current_user):
     try:
-        # Get enum values from the database
-        result = supabase.rpc('get_enum_values').execute()
+        # Served from the local replica of the enum catalogs
+        reference_data.maybe_refresh(get_supabase())
+        enum_values = reference_data.enum_values()
         
-        if not result.data:
+        if not enum_values:
             raise Exception("Failed to get enum values")
             
-        return jsonify(result.data), 200
+        return conditional_json(enum_values, version=reference_data.version)
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error getting enum values: {e}")
         return jsonify({"error": f"Failed to get enum values: {e}"}), 500
 
+def parse_optional_limit(data, field):
+    """Optional positive integer field. Returns (value, None) or (None, error message)."""
+    value = data.get(field)
+    if value is None:
+        return None, None
+    if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+        return None, f'{field} must be a positive integer'
+    return value, None
+
+@app.route('/api-keys', methods=['POST'])
+@token_required
+def create_api_key_endpoint(current_user):
+    try:
+        if get_user_limits(current_user)['plan_type'] != 'enterprise':
+            return jsonify({
+                'error': 'API keys are only available for enterprise plans',
+                'code': 'ENTERPRISE_FEATURE'
+            }), 403
+
+        data = request.get_json(silent=True) or {}
+        name = data.get('name')
+        if not isinstance(name, str) or not name.strip():
+            return jsonify({'error': 'A key name is required'}), 400
+        daily_quota, error = parse_optional_limit(data, 'daily_quota')
+        if error:
+            return jsonify({'error': error}), 400
+        requests_per_minute, error = parse_optional_limit(data, 'requests_per_minute')
+        if error:
+            return jsonify({'error': error}), 400
+
+        row, key = create_api_key(get_supabase(), current_user, name.strip(), daily_quota, requests_per_minute)
+        # The key is only returned here; we keep its hash
+        return jsonify({**row, 'key': key}), 201
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print(f"Error creating API key: {e}")
+        return jsonify({'error': 'Failed to create API key'}), 500
+
+@app.route('/api-keys', methods=['GET'])
+@token_required
+def get_api_keys(current_user):
+    try:
+        return jsonify(list_api_keys(get_supabase(), current_user)), 200
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print(f"Error listing API keys: {e}")
+        return jsonify({'error': f'Failed to list API keys: {e}'}), 500
+
+@app.route('/api-keys/<key_id>', methods=['DELETE'])
+@token_required
+def delete_api_key(current_user, key_id):
+    try:
+        if not revoke_api_key(get_supabase(), current_user, key_id):
+            return jsonify({'error': 'API key not found'}), 404
+        return jsonify({'message': 'API key revoked'}), 200
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print(f"Error revoking API key: {e}")
+        return jsonify({'error': 'Failed to revoke API key'}), 500
+
+def read_ndjson_documents(stream, max_text_length):
+    """
+    Yield (id, text, tone, difficulty, error) for each non-blank NDJSON line.
+    A document without an `id` is identified by its line number.
+    """
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            document = json_loads(line)
+        except ValueError:
+            yield line_number, None, None, None, 'Invalid JSON'
+            continue
+        if not isinstance(document, dict):
+            yield line_number, None, None, None, 'Each line must be a JSON object'
+            continue
+
+        document_id = document.get('id', line_number)
+        text = document.get('text')
+        if not isinstance(text, str) or not text.strip():
+            yield document_id, None, None, None, 'No text provided'
+        elif len(text) > max_text_length:
+            yield document_id, None, None, None, f'Text exceeds maximum length of {max_text_length} characters'
+        else:
+            yield document_id, text, document.get('tone'), document.get('difficulty'), None
+
+@app.route('/v1/ingest', methods=['POST'])
+@api_key_required
+def ingest_documents(api_key):
+    """
+    Bulk summarization for machine clients.
+
+    The body is NDJSON, one {"id", "text", "tone"?, "difficulty"?} object
+    per line, at most INGEST_MAX_DOCUMENTS lines and INGEST_MAX_BYTES. It
+    is read in full before the response starts, so clients that finish
+    uploading before reading work as well as ones that read while sending.
+    Results stream back as NDJSON in input order while later documents are
+    still being summarized, followed by one totals line. Each document
+    counts against both the key's daily quota and the owner's plan limit.
+    """
+    owner = api_key['user_id']
+    user_limits = get_user_limits(owner)
+    if user_limits['plan_type'] != 'enterprise':
+        return jsonify({
+            'error': 'Bulk ingestion is only available for enterprise plans',
+            'code': 'ENTERPRISE_FEATURE'
+        }), 403
+    if not get_gemini():
+        return jsonify({
+            "error": "Summarization service is not available. Please check server configuration."
+        }), 503
+
+    if request.content_length is not None and request.content_length > INGEST_MAX_BYTES:
+        body = None
+    else:
+        body = request.stream.read(INGEST_MAX_BYTES + 1)
+    if body is None or len(body) > INGEST_MAX_BYTES:
+        return jsonify({
+            'error': f'Request body exceeds {INGEST_MAX_BYTES} bytes',
+            'code': 'BODY_TOO_LARGE'
+        }), 413
+    documents = list(islice(read_ndjson_documents(body.splitlines(), user_limits['max_text_length']), INGEST_MAX_DOCUMENTS + 1))
+    if len(documents) > INGEST_MAX_DOCUMENTS:
+        return jsonify({
+            'error': f'At most {INGEST_MAX_DOCUMENTS} documents can be ingested per request',
+            'code': 'TOO_MANY_DOCUMENTS'
+        }), 400
+
+    settings_result = get_supabase().from_('user_settings').select('*').eq('user_id', owner).execute()
+    settings = settings_result.data[0] if settings_result.data else {
+        'preferred_summary_length': '2-3 sentences (medium)',
+        'summary_tone': 'neutral',
+        'summary_difficulty': 'medium'
+    }
+    length = length_label(settings['preferred_summary_length'])
+
+    today = datetime.utcnow().date().isoformat()
+    key_quota = api_key.get('daily_quota')
+
+    def refund(count):
+        # Reserved summaries that weren't produced go back to both counters
+        try:
+            usage_buffer.release(get_supabase(), owner, today, count)
+            api_key_usage.release(get_supabase(), api_key['id'], today, count)
+        except Exception as e:
+            print(f"Error refunding {count} ingest summaries for key {api_key['id']}: {e}")
+
+    # Reserve the whole batch up front with atomic increments, so concurrent
+    # requests for the same key or owner (on any worker) can't each pass the
+    # same quota check; documents beyond the reservation are rejected
+    wanted = sum(1 for document in documents if not document[4])
+    try:
+        granted = usage_buffer.reserve(get_supabase(), owner, today, wanted, user_limits['daily_summaries'])
+        key_granted = api_key_usage.reserve(get_supabase(), api_key['id'], today, granted, key_quota or None)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print(f"Error reserving ingest quota for key {api_key['id']}: {e}")
+        return jsonify({'error': 'Could not reserve quota, please retry'}), 503
+    if key_granted < granted:
+        try:
+            usage_buffer.release(get_supabase(), owner, today, granted - key_granted)
+        except Exception as e:
+            print(f"Error releasing ingest quota for user {owner}: {e}")
+        granted = key_granted
+
+    per_minute = api_key.get('requests_per_minute') or API_KEY_PER_MINUTE
+    bucket = (f"ingest:key:{api_key['id']}", per_minute / 60.0, max(1.0, per_minute / 6.0))
+    sock = client_socket(request.environ)
+
+    def summarize_document(document_id, text, tone, difficulty):
+        # Each document gets its own budget; all of them stop if the client goes away
+        with deadline_scope(Deadline(REQUEST_DEADLINE_SECONDS, sock)):
+            try:
+                summary = generate_summary(build_prompt(text, length, tone, difficulty))
+                # The summary itself was counted by the reservation
+                usage_buffer.increment(get_supabase(), owner, today, summaries=0, characters=len(text))
+                api_key_usage.increment(get_supabase(), api_key['id'], today, summaries=0, characters=len(text))
+            except UpstreamOverloaded as e:
+                refund(1)
+                return {'id': document_id, 'error': 'Summarization service is busy', 'code': 'UPSTREAM_BUSY', 'retry_after': e.retry_after}
+            except DeadlineExceeded:
+                refund(1)
+                return {'id': document_id, 'error': 'Document deadline exceeded', 'code': 'DEADLINE_EXCEEDED'}
+            except Exception as e:
+                print(f"Error summarizing ingested document {document_id}: {e}")
+                refund(1)
+                return {'id': document_id, 'error': 'Failed to generate summary'}
+        return {'id': document_id, 'summary': summary, 'characters': len(text)}
+
+    def results():
+        executor = ThreadPoolExecutor(max_workers=INGEST_CONCURRENCY, thread_name_prefix='ingest')
+        # (future, True) or (error result, False) in input order; bounded so a
+        # large upload never holds more than a few documents' results
+        window = deque()
+        submitted = []
+        totals = {'summarized': 0, 'failed': 0}
+
+        def drain(block):
+            while window:
+                head, is_future = window[0]
+                if is_future and not block and not head.done() and len(window) <= INGEST_CONCURRENCY:
+                    return
+                window.popleft()
+                result = head.result() if is_future else head
+                if 'error' in result:
+                    totals['failed'] += 1
+                else:
+                    totals['summarized'] += 1
+                yield json_dumps(result) + '\n'
+
+        try:
+            for document_id, text, tone, difficulty, error in documents:
+                if error:
+                    window.append(({'id': document_id, 'error': error}, False))
+                elif len(submitted) >= granted:
+                    window.append(({'id': document_id, 'error': 'Daily summary limit reached', 'code': 'QUOTA_EXCEEDED'}, False))
+                else:
+                    # Per-key rate limit; waiting here delays the remaining documents
+                    wait = rate_limiter.acquire([bucket])
+                    while wait:
+                        time.sleep(wait)
+                        wait = rate_limiter.acquire([bucket])
+                    future = executor.submit(
+                        profiled(summarize_document), document_id, text,
+                        tone or settings['summary_tone'], difficulty or settings['summary_difficulty']
+                    )
+                    submitted.append(future)
+                    window.append((future, True))
+
+                yield from drain(block=False)
+
+            yield from drain(block=True)
+            yield json_dumps({'done': True, **totals}) + '\n'
+        finally:
+            # Also runs when the client disconnects mid-stream. Documents that
+            # never ran (cancelled or never submitted) hand their reservation
+            # back; ones that ran refunded themselves if they failed
+            executor.shutdown(wait=False, cancel_futures=True)
+            refund(granted - len(submitted) + sum(1 for future in submitted if future.cancelled()))
+
+    return Response(stream_with_context(results()), mimetype='application/x-ndjson')
+
 @app.route('/')
 def home():
     return "LightRead Summarization Server is running!"
 
+@app.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok'}), 200
+
+@app.route('/readyz')
+def readyz():
+    # Goes false as soon as shutdown starts so load balancers stop routing here
+    if lifecycle.draining:
+        return jsonify({'status': 'draining', 'inflight': lifecycle.inflight}), 503
+    return jsonify({'status': 'ready', 'inflight': lifecycle.inflight}), 200
+
+@app.route('/admin/concurrency', methods=['GET'])
+@admin_required
+def get_concurrency_state():
+    return jsonify(llm_limiter.state()), 200
+
+@app.route('/admin/hedging', methods=['GET'])
+@admin_required
+def get_hedging_stats():
+    return jsonify({'enabled': HEDGE_ENABLED, **llm_hedger.stats()}), 200
+
+@app.route('/admin/events', methods=['GET'])
+@admin_required
+def get_event_stats():
+    return jsonify(event_broker.stats()), 200
+
+@app.route('/admin/profiles', methods=['GET'])
+@admin_required
+def list_profiles():
+    return jsonify(request_profiler.list_profiles()), 200
+
+@app.route('/admin/profiles/<name>', methods=['GET'])
+@admin_required
+def download_profile(name):
+    path = request_profiler.profile_path(name)
+    if path is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=name)
+
+HEALTH_PATHS = ('/healthz', '/readyz')
+
+@app.before_request
+def track_inflight():
+    if request.path in HEALTH_PATHS or request.method == 'OPTIONS':
+        return None
+    if lifecycle.draining:
+        response = jsonify({'error': 'Server is restarting. Please try again shortly.'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    lifecycle.request_started()
+    g.tracked_inflight = True
+    return None
+
+@app.teardown_request
+def untrack_inflight(exc):
+    if g.pop('tracked_inflight', False):
+        lifecycle.request_finished()
+
+# Per-route budgets; streamed responses (None) run as long as the client keeps reading
+ROUTE_DEADLINES = {
+    'summarize_text': SUMMARIZE_DEADLINE_SECONDS,
+    'get_summaries': None,
+    'export_user_data': None,
+    'ingest_documents': None,
+    'stream_user_events': None
+}
+
+def deadline_response(e):
+    if isinstance(e, ClientDisconnected):
+        # Nobody is reading this; the status only shows up in the access log
+        print(f"Client disconnected during {request.method} {request.path}, stopped early")
+        return jsonify({'error': 'Client closed request'}), 499
+    return jsonify({'error': 'Request deadline exceeded', 'code': 'DEADLINE_EXCEEDED'}), 504
+
+@app.errorhandler(DeadlineExceeded)
+def handle_deadline_exceeded(e):
+    return deadline_response(e)
+
+@app.before_request
+def start_deadline():
+    budget = request_budget(request.headers.get(DEADLINE_HEADER), ROUTE_DEADLINES.get(request.endpoint, REQUEST_DEADLINE_SECONDS))
+    deadlines.set_current(Deadline(budget, client_socket(request.environ)) if budget else None)
+    return None
+
+@app.teardown_request
+def clear_deadline(exc):
+    # Worker threads are reused; don't let the next request see this deadline
+    deadlines.set_current(None)
+
+@app.before_request
+def start_profiling():
+    # Admins can ask for a profile of any request with X-Profile: 1
+    if request.path in HEALTH_PATHS or request.path.startswith('/admin/profiles') or request.path == '/user/events':
+        return None
+    requested = request.headers.get('X-Profile') == '1' and is_admin_request()
+    g.profile = request_profiler.begin(requested=requested)
+    return None
+
+@app.teardown_request
+def finish_profiling(exc):
+    # Runs after streamed responses finish too, so their whole body is covered
+    handle = g.pop('profile', None)
+    if handle is not None:
+        request_profiler.end(handle, request.method, request.path)
+
 @app.after_request
 def after_request(response):
     # Only log request info for webhook requests
@@ -623,7 +1609,10 @@ def after_request(response):
         print(f"Path: {request.path}")
         print(f"Headers: {dict(request.headers)}")
         print('==================== END REQUEST INFO ====================')
-    return response
+    profile = g.get('profile')
+    if profile is not None and profile.reason == 'requested':
+        response.headers['X-Profile-Id'] = profile.id
+    return compress_response(response)
 
 @app.before_request
 def log_request_info():
@@ -648,5 +1637,23 @@ def log_request_info():
         print('==================== END REQUEST INFO ====================')
     return None
 
+# Stop speculative work first, then write out buffered usage
+lifecycle.register_hook('variant prefetcher', lambda: variant_prefetcher.shutdown(wait=False))
+lifecycle.register_hook('hedged calls', lambda: llm_hedger.shutdown(wait=False))
+lifecycle.register_hook('usage buffer', usage_buffer.close)
+lifecycle.register_hook('API key usage buffer', api_key_usage.close)
+
+# Move old summaries to compressed cold storage in the background
+archiver = start_archiver(get_supabase)
+if archiver:
+    lifecycle.register_hook('summary archiver', archiver.stopped.set)
+
+# Periodically reconcile subscriptions with Stripe (incremental after the first run)
+reconciler = start_reconciler(get_supabase)
+if reconciler:
+    lifecycle.register_hook('subscription reconciler', reconciler.stopped.set)
+install_signal_handlers()
+
 if __name__ == '__main__':
+    warm_startup_caches()
     app.run(host='0.0.0.0', port=3000, debug=True)
@@ -1,23 +1,43 @@
 from flask import Blueprint, request, jsonify
-import stripe
 from datetime import datetime, timedelta
 import config
 from config import (
-    STRIPE_SECRET_KEY,
     STRIPE_WEBHOOK_SECRET,
     STRIPE_PRICE_ID
 )
-from supabase import create_client
-import os
+from clients import get_stripe, get_supabase
+from auth_cache import revoke_user_tokens
+from deadlines import DeadlineExceeded
+from events import publish_event
+from stripe_cache import (
+    stripe_id,
+    get_customer,
+    get_subscription,
+    remember_subscription,
+    claim_event
+)
 
 stripe_api = Blueprint('stripe_api', __name__)
-stripe.api_key = STRIPE_SECRET_KEY
 
-# Initialize Supabase client
-supabase = create_client(
-    supabase_url=os.environ.get('SUPABASE_URL'),
-    supabase_key=os.environ.get('SUPABASE_KEY')
-)
+# Subscription columns pushed to the user's open event streams
+SUBSCRIPTION_EVENT_FIELDS = ('plan_type', 'status', 'end_date', 'cancelled_at', 'updated_at')
+
+def notify_subscription_change(user_id, changes):
+    if 'plan_type' in changes:
+        # Plan changed (upgrade or cancellation): tokens issued under the old plan stop working
+        revoke_user_tokens(get_supabase(), user_id)
+    publish_event(user_id, 'subscription', {
+        key: value for key, value in changes.items() if key in SUBSCRIPTION_EVENT_FIELDS
+    })
+
+# The Stripe SDK is only imported once a billing request comes in
+stripe = None
+
+@stripe_api.before_request
+def load_stripe():
+    global stripe
+    if stripe is None:
+        stripe = get_stripe()
 
 @stripe_api.route('/create-checkout-session', methods=['POST'])
 def create_checkout_session():
@@ -51,6 +71,8 @@ def create_checkout_session():
         
         # Return the session ID for the frontend to use
         return jsonify({'id': session.id}), 200
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error creating checkout session: {str(e)}")
         import traceback
@@ -81,6 +103,8 @@ def create_portal_session():
         )
         
         return jsonify({'url': session.url})
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -118,6 +142,18 @@ def webhook():
         print(f"Webhook event constructed successfully: {event.type}")
         print(f"Event ID: {event.id}")
         print(f"Event data: {event.data.object}")
+
+        try:
+            claimed = claim_event(get_supabase(), event)
+        except DeadlineExceeded:
+            raise
+        except Exception as claim_err:
+            # Not acknowledged, so Stripe delivers the event again later
+            print(f"Error claiming event {event.id}: {claim_err}")
+            return jsonify({'status': 'failure', 'error': 'Could not record event'}), 500
+        if not claimed:
+            print(f"Event {event.id} was already processed, skipping")
+            return jsonify({'status': 'success'}), 200
         
         # Handle different event types
         try:
@@ -134,14 +170,16 @@ def webhook():
                 # Process the checkout session
                 handle_checkout_session_completed(session)
             elif event.type == 'customer.subscription.updated':
-                subscription = event.data.object
+                # The payload is the full subscription as of the event; if a newer
+                # snapshot is cached (events arrive out of order), that one is used
+                subscription = remember_subscription(event.data.object, as_of=event.created)
                 print(f"Processing customer.subscription.updated for subscription: {subscription.id}")
                 print(f"Subscription status: {subscription.status}")
                 print(f"Customer ID: {subscription.customer}")
                 # Update subscription status
                 handle_subscription_updated(subscription)
             elif event.type == 'customer.subscription.deleted':
-                subscription = event.data.object
+                subscription = remember_subscription(event.data.object, as_of=event.created)
                 print(f"Processing customer.subscription.deleted for subscription: {subscription.id}")
                 # Mark subscription as cancelled
                 handle_subscription_deleted(subscription)
@@ -168,7 +206,9 @@ def webhook():
                 # If we found a subscription ID, process it
                 if subscription_id:
                     try:
-                        subscription = stripe.Subscription.retrieve(subscription_id)
+                        # Retrieved rather than cached: the invoice doesn't say what state
+                        # the subscription is in now, and a cached snapshot may be stale
+                        subscription = get_subscription(subscription_id, fresh=True)
                         print(f"Retrieved subscription: {subscription.id} for invoice: {invoice.id}")
                         # Update the subscription in our database
                         handle_subscription_updated(subscription)
@@ -197,6 +237,8 @@ def webhook():
         # Invalid signature
         print(f"Invalid signature: {str(e)}")
         return jsonify({'status': 'failure', 'error': 'Invalid signature'}), 400
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         # Other error
         print(f"Webhook error: {str(e)}")
@@ -209,10 +251,23 @@ def webhook():
 def verify_session(session_id):
     try:
         print(f"Verifying session with ID: {session_id}")
+
+        # Fast path: the checkout webhook (or an earlier verify) already recorded this session
+        existing = get_supabase().table('subscriptions').select('stripe_subscription_id,status') \
+            .eq('stripe_checkout_session_id', session_id).execute()
+        if existing.data and existing.data[0]['status'] == 'active':
+            print(f"Session {session_id} already recorded, skipping Stripe lookup")
+            return jsonify({
+                'success': True,
+                'status': 'paid',
+                'customer_email': None,
+                'subscription_id': existing.data[0]['stripe_subscription_id']
+            })
+
         # Retrieve the session from Stripe
         session = stripe.checkout.Session.retrieve(
             session_id,
-            expand=['customer', 'line_items']
+            expand=['customer', 'line_items', 'subscription']
         )
         
         if not session:
@@ -240,7 +295,7 @@ def verify_session(session_id):
             if customer_email:
                 try:
                     print("Looking up user in auth.users...")
-                    auth_response = supabase.auth.admin.list_users()
+                    auth_response = get_supabase().auth.admin.list_users()
                     
                     # The response might be a list directly rather than an object with 'users' attribute
                     users_list = auth_response
@@ -269,14 +324,15 @@ def verify_session(session_id):
             # If we found a user ID, update their subscription
             if user_id and hasattr(session, 'subscription') and session.subscription:
                 try:
-                    # Get subscription details
-                    subscription = stripe.Subscription.retrieve(session.subscription)
+                    # Get subscription details (expanded above, so no extra call)
+                    subscription = get_subscription(session.subscription)
                     
                     # Update or create subscription in database
                     subscription_data = {
                         'user_id': user_id,
                         'stripe_customer_id': session.customer.id if hasattr(session, 'customer') else None,
-                        'stripe_subscription_id': session.subscription,
+                        'stripe_subscription_id': subscription.id,
+                        'stripe_checkout_session_id': session.id,
                         'plan_type': 'pro',
                         'status': 'active',
                         'updated_at': datetime.utcnow().isoformat(),
@@ -284,15 +340,16 @@ def verify_session(session_id):
                     }
                     
                     # Check if subscription exists
-                    existing_sub = supabase.table('subscriptions').select('*').eq('user_id', user_id).execute()
+                    existing_sub = get_supabase().table('subscriptions').select('*').eq('user_id', user_id).execute()
                     
                     if existing_sub.data and len(existing_sub.data) > 0:
                         print(f"Updating existing subscription for user {user_id}")
-                        supabase.table('subscriptions').update(subscription_data).eq('user_id', user_id).execute()
+                        get_supabase().table('subscriptions').update(subscription_data).eq('user_id', user_id).execute()
                     else:
                         print(f"Creating new subscription for user {user_id}")
                         subscription_data['created_at'] = datetime.utcnow().isoformat()
-                        supabase.table('subscriptions').insert(subscription_data).execute()
+                        get_supabase().table('subscriptions').insert(subscription_data).execute()
+                    notify_subscription_change(user_id, subscription_data)
                         
                     print("Successfully updated subscription in database")
                 except Exception as db_err:
@@ -305,7 +362,7 @@ def verify_session(session_id):
                 'success': True,
                 'status': 'paid',
                 'customer_email': customer_email,
-                'subscription_id': session.subscription if hasattr(session, 'subscription') else None
+                'subscription_id': stripe_id(session.subscription) if hasattr(session, 'subscription') else None
             })
         elif session.payment_status == 'unpaid':
             print("Payment is unpaid")
@@ -322,6 +379,8 @@ def verify_session(session_id):
                 'message': f'Payment status is: {session.payment_status}'
             }), 402
     
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error verifying session: {str(e)}")
         import traceback
@@ -338,6 +397,8 @@ def get_payment_methods_route():
             
         result = get_payment_methods(email)
         return jsonify(result)
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error getting payment methods: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -354,6 +415,8 @@ def update_payment_method_route():
             
         result = update_payment_method(email, payment_method_id)
         return jsonify(result)
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error updating payment method: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -392,6 +455,8 @@ def set_default_payment_method_route(payment_method_id):
                 )
         
         return jsonify({'success': True}), 200
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error setting default payment method: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -420,6 +485,8 @@ def delete_payment_method_route(payment_method_id):
         stripe.PaymentMethod.detach(payment_method_id)
         
         return jsonify({'success': True}), 200
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error deleting payment method: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -432,14 +499,14 @@ def handle_checkout_session_completed(session):
     print(f"Session ID: {session.id}")
     print(f"Customer email: {session.customer_email}")
     if hasattr(session, 'subscription'):
-        print(f"Subscription ID: {session.subscription}")
+        print(f"Subscription ID: {stripe_id(session.subscription)}")
     else:
         print("No subscription ID in session")
     print(f"Payment status: {session.payment_status}")
     
     try:
-        # Get the customer details
-        customer = stripe.Customer.retrieve(session.customer)
+        # Get the customer details (cached, or already expanded by verify_session)
+        customer = get_customer(session.customer)
         print(f"\nRetrieved customer: {customer.id}")
         print(f"Customer email: {customer.email}")
         print(f"Customer metadata: {customer.metadata}")
@@ -447,7 +514,7 @@ def handle_checkout_session_completed(session):
         # Get the subscription details if available
         subscription = None
         if hasattr(session, 'subscription') and session.subscription:
-            subscription = stripe.Subscription.retrieve(session.subscription)
+            subscription = get_subscription(session.subscription)
             print(f"\nRetrieved subscription: {subscription.id}")
             print(f"Subscription status: {subscription.status}")
             
@@ -487,7 +554,7 @@ def handle_checkout_session_completed(session):
         user_id = None
         try:
             print("Looking up user in auth.users...")
-            auth_response = supabase.auth.admin.list_users()
+            auth_response = get_supabase().auth.admin.list_users()
             
             # The response might be a list directly rather than an object with 'users' attribute
             users_list = auth_response
@@ -524,6 +591,7 @@ def handle_checkout_session_completed(session):
         subscription_data = {
             'user_id': user_id,
             'stripe_customer_id': customer.id,
+            'stripe_checkout_session_id': session.id,
             'plan_type': 'pro',
             'status': 'active',
             'updated_at': now
@@ -541,19 +609,20 @@ def handle_checkout_session_completed(session):
         
         # Check if subscription exists
         try:
-            existing_sub = supabase.table('subscriptions').select('*').eq('user_id', user_id).execute()
+            existing_sub = get_supabase().table('subscriptions').select('*').eq('user_id', user_id).execute()
             print(f"Existing subscription check: {existing_sub}")
         
             if existing_sub.data and len(existing_sub.data) > 0:
                 print("Updating existing subscription...")
-                update_response = supabase.table('subscriptions').update(subscription_data).eq('user_id', user_id).execute()
+                update_response = get_supabase().table('subscriptions').update(subscription_data).eq('user_id', user_id).execute()
                 print(f"Update response: {update_response}")
             else:
                 print("Creating new subscription...")
                 subscription_data['created_at'] = now
                 subscription_data['start_date'] = now  # Add start_date for new subscriptions
-                create_response = supabase.table('subscriptions').insert(subscription_data).execute()
+                create_response = get_supabase().table('subscriptions').insert(subscription_data).execute()
                 print(f"Create response: {create_response}")
+            notify_subscription_change(user_id, subscription_data)
                 
             print("Successfully updated subscription in database")
         except Exception as db_err:
@@ -563,6 +632,8 @@ def handle_checkout_session_completed(session):
             
         print("==================== END CHECKOUT SESSION HANDLING ====================\n")
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error in handle_checkout_session_completed: {str(e)}")
         import traceback
@@ -573,8 +644,8 @@ def handle_subscription_updated(subscription):
     # Update subscription status in database
     try:
         print(f"Processing subscription update for subscription ID: {subscription.id}")
-        # We need to get the full customer details from Stripe
-        customer = stripe.Customer.retrieve(subscription.customer)
+        # We need the full customer details from Stripe (cached across handlers)
+        customer = get_customer(subscription.customer)
         print(f"Retrieved customer: {customer.id}")
         
         if hasattr(customer, 'email') and customer.email:
@@ -582,18 +653,20 @@ def handle_subscription_updated(subscription):
         else:
             # If email is not available, try to get it from the Supabase database
             print(f"Email not found in customer object, looking it up in the database by customer ID")
-            subscription_response = supabase.table('subscriptions').select('user_id').eq('stripe_customer_id', customer.id).execute()
+            subscription_response = get_supabase().table('subscriptions').select('user_id').eq('stripe_customer_id', customer.id).execute()
             
             if subscription_response.data and len(subscription_response.data) > 0:
                 user_id = subscription_response.data[0]['user_id']
                 print(f"Found user ID: {user_id} by customer ID")
                 
                 # Update subscription in Supabase
-                supabase.table('subscriptions').update({
+                changes = {
                     'status': subscription.status,
                     'end_date': datetime.fromtimestamp(subscription.current_period_end).isoformat(),
                     'updated_at': datetime.utcnow().isoformat()
-                }).eq('user_id', user_id).eq('stripe_subscription_id', subscription.id).execute()
+                }
+                get_supabase().table('subscriptions').update(changes).eq('user_id', user_id).eq('stripe_subscription_id', subscription.id).execute()
+                notify_subscription_change(user_id, changes)
                 
                 print(f"Updated subscription {subscription.id} for user {user_id}")
                 return
@@ -603,12 +676,12 @@ def handle_subscription_updated(subscription):
             return
         
         # Find the user by email in the users table
-        user_response = supabase.from_('users').select('id').eq('email', user_email).execute()
+        user_response = get_supabase().from_('users').select('id').eq('email', user_email).execute()
         print(f"User lookup response for {user_email}: {user_response}")
         
         if not user_response.data or len(user_response.data) == 0:
             # Try using the subscription customer ID to find the user
-            subscription_response = supabase.table('subscriptions').select('user_id').eq('stripe_customer_id', customer.id).execute()
+            subscription_response = get_supabase().table('subscriptions').select('user_id').eq('stripe_customer_id', customer.id).execute()
             
             if subscription_response.data and len(subscription_response.data) > 0:
                 user_id = subscription_response.data[0]['user_id']
@@ -616,7 +689,7 @@ def handle_subscription_updated(subscription):
             else:
                 # Try the auth API
                 try:
-                    auth_response = supabase.auth.admin.list_users()
+                    auth_response = get_supabase().auth.admin.list_users()
                     if hasattr(auth_response, 'users'):
                         matching_users = [u for u in auth_response.users if u.email == user_email]
                         if matching_users:
@@ -636,14 +709,18 @@ def handle_subscription_updated(subscription):
             print(f"Found user with ID: {user_id}")
         
         # Update subscription in Supabase
-        update_response = supabase.table('subscriptions').update({
+        changes = {
             'status': subscription.status,
             'end_date': datetime.fromtimestamp(subscription.current_period_end).isoformat(),
             'updated_at': datetime.utcnow().isoformat()
-        }).eq('user_id', user_id).eq('stripe_subscription_id', subscription.id).execute()
+        }
+        update_response = get_supabase().table('subscriptions').update(changes).eq('user_id', user_id).eq('stripe_subscription_id', subscription.id).execute()
+        notify_subscription_change(user_id, changes)
         
         print(f"Updated subscription {subscription.id} for user {user_id}")
         print(f"Update response: {update_response}")
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error handling subscription update: {str(e)}")
         import traceback
@@ -653,8 +730,8 @@ def handle_subscription_deleted(subscription):
     # Update subscription status to cancelled
     try:
         print(f"Processing subscription deletion for subscription ID: {subscription.id}")
-        # We need to get the full customer details from Stripe
-        customer = stripe.Customer.retrieve(subscription.customer)
+        # We need the full customer details from Stripe (cached across handlers)
+        customer = get_customer(subscription.customer)
         print(f"Retrieved customer: {customer.id}")
         
         if hasattr(customer, 'email') and customer.email:
@@ -662,19 +739,21 @@ def handle_subscription_deleted(subscription):
         else:
             # If email is not available, try to get it from the Supabase database
             print(f"Email not found in customer object, looking it up in the database by customer ID")
-            subscription_response = supabase.table('subscriptions').select('user_id').eq('stripe_customer_id', customer.id).execute()
+            subscription_response = get_supabase().table('subscriptions').select('user_id').eq('stripe_customer_id', customer.id).execute()
             
             if subscription_response.data and len(subscription_response.data) > 0:
                 user_id = subscription_response.data[0]['user_id']
                 print(f"Found user ID: {user_id} by customer ID")
                 
                 # Update subscription in Supabase
-                supabase.table('subscriptions').update({
+                changes = {
                     'status': 'cancelled',
                     'plan_type': 'free',
                     'cancelled_at': datetime.utcnow().isoformat(),
                     'updated_at': datetime.utcnow().isoformat()
-                }).eq('user_id', user_id).eq('stripe_subscription_id', subscription.id).execute()
+                }
+                get_supabase().table('subscriptions').update(changes).eq('user_id', user_id).eq('stripe_subscription_id', subscription.id).execute()
+                notify_subscription_change(user_id, changes)
                 
                 return
             
@@ -683,12 +762,12 @@ def handle_subscription_deleted(subscription):
             return
         
         # Find the user by email in the users table
-        user_response = supabase.from_('users').select('id').eq('email', user_email).execute()
+        user_response = get_supabase().from_('users').select('id').eq('email', user_email).execute()
         print(f"User lookup response for {user_email}: {user_response}")
         
         if not user_response.data or len(user_response.data) == 0:
             # Try using the subscription customer ID to find the user
-            subscription_response = supabase.table('subscriptions').select('user_id').eq('stripe_customer_id', customer.id).execute()
+            subscription_response = get_supabase().table('subscriptions').select('user_id').eq('stripe_customer_id', customer.id).execute()
             
             if subscription_response.data and len(subscription_response.data) > 0:
                 user_id = subscription_response.data[0]['user_id']
@@ -696,7 +775,7 @@ def handle_subscription_deleted(subscription):
             else:
                 # Try the auth API
                 try:
-                    auth_response = supabase.auth.admin.list_users()
+                    auth_response = get_supabase().auth.admin.list_users()
                     if hasattr(auth_response, 'users'):
                         matching_users = [u for u in auth_response.users if u.email == user_email]
                         if matching_users:
@@ -716,14 +795,18 @@ def handle_subscription_deleted(subscription):
             print(f"Found user with ID: {user_id}")
         
         # Update subscription in Supabase
-        supabase.table('subscriptions').update({
+        changes = {
             'status': 'cancelled',
             'plan_type': 'free',
             'cancelled_at': datetime.utcnow().isoformat(),
             'updated_at': datetime.utcnow().isoformat()
-        }).eq('user_id', user_id).eq('stripe_subscription_id', subscription.id).execute()
+        }
+        get_supabase().table('subscriptions').update(changes).eq('user_id', user_id).eq('stripe_subscription_id', subscription.id).execute()
+        notify_subscription_change(user_id, changes)
         
         print(f"Subscription {subscription.id} cancelled for user {user_id}")
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error handling subscription deletion: {str(e)}")
         import traceback
@@ -753,7 +836,7 @@ def cancel_subscription(email):
         
         # Find the user in the database
         try:
-            auth_response = supabase.auth.admin.list_users()
+            auth_response = get_supabase().auth.admin.list_users()
             users_list = auth_response if not hasattr(auth_response, 'users') else auth_response.users
             
             user_id = None
@@ -767,12 +850,14 @@ def cancel_subscription(email):
                 raise Exception('User not found in database')
             
             # Update subscription in database
-            supabase.table('subscriptions').update({
+            changes = {
                 'status': 'cancelled',
                 'plan_type': 'free',
                 'cancelled_at': datetime.utcnow().isoformat(),
                 'updated_at': datetime.utcnow().isoformat()
-            }).eq('user_id', user_id).eq('stripe_subscription_id', subscription.id).execute()
+            }
+            get_supabase().table('subscriptions').update(changes).eq('user_id', user_id).eq('stripe_subscription_id', subscription.id).execute()
+            notify_subscription_change(user_id, changes)
             
         except Exception as db_err:
             print(f"Database error updating subscription: {db_err}")
@@ -783,6 +868,8 @@ def cancel_subscription(email):
             'subscription': cancelled_subscription,
             'message': 'Subscription cancelled successfully'
         }
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error cancelling subscription: {str(e)}")
         raise e
@@ -817,6 +904,8 @@ def update_payment_method(email, payment_method_id):
             'success': True,
             'message': 'Payment method updated successfully'
         }
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error updating payment method: {str(e)}")
         raise e
@@ -843,6 +932,8 @@ def get_payment_methods(email):
             'success': True,
             'payment_methods': payment_methods.data
         }
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error getting payment methods: {str(e)}")
         raise e 
\ No newline at end of file
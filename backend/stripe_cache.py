@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import OrderedDict
+
+from clients import get_stripe
+from config import STRIPE_CACHE_TTL_SECONDS, STRIPE_CACHE_SIZE
+
+
+def stripe_id(ref):
+    """The id of a Stripe reference, which is either an id string or an expanded object."""
+    if ref is None or isinstance(ref, str):
+        return ref
+    return ref.id
+
+
+class StripeObjectCache:
+    """
+    LRU of recently seen Stripe objects by id, each kept for `ttl` seconds.
+
+    Webhook events for one renewal (invoice.paid, customer.subscription.updated,
+    ...) arrive in a burst and all need the same customer and subscription;
+    caching them for a couple of minutes turns repeat lookups into dict hits.
+
+    Each object is stored with the time its state is from (`as_of`: the
+    event's `created` for payloads, now for retrieved objects). Stripe
+    doesn't deliver events in order, so a snapshot older than the cached
+    one is ignored and the newer one is returned instead.
+    """
+
+    def __init__(self, max_size=STRIPE_CACHE_SIZE, ttl=STRIPE_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def get(self, object_id):
+        with self._lock:
+            entry = self._entries.get(object_id)
+            if entry is not None and time.monotonic() - entry[1] <= self.ttl:
+                self._entries.move_to_end(object_id)
+                self._stats['hits'] += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[object_id]
+            self._stats['misses'] += 1
+            return None
+
+    def put(self, obj, as_of=None):
+        """Cache `obj` unless a newer snapshot is cached. Returns the newest snapshot."""
+        if obj is None or isinstance(obj, str):
+            return obj
+        if as_of is None:
+            as_of = time.time()
+        with self._lock:
+            entry = self._entries.get(obj.id)
+            if entry is not None and entry[2] > as_of and time.monotonic() - entry[1] <= self.ttl:
+                return entry[0]
+            self._entries[obj.id] = (obj, time.monotonic(), as_of)
+            self._entries.move_to_end(obj.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return obj
+
+    def discard(self, object_id):
+        with self._lock:
+            self._entries.pop(object_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), **self._stats}
+
+
+# Event ids claimed by a worker (migrations/011_stripe_events.sql); the
+# primary key makes the claim atomic across workers and instances
+STRIPE_EVENTS_TABLE = 'stripe_events'
+
+stripe_cache = StripeObjectCache()
+# Events this worker has already claimed, to skip the database on redeliveries
+processed_events = StripeObjectCache(ttl=3600)
+
+
+def get_customer(ref):
+    """Customer for an id or expanded object, retrieving it only when not cached."""
+    if ref is None:
+        return None
+    if not isinstance(ref, str):
+        return stripe_cache.put(ref)
+    customer = stripe_cache.get(ref)
+    if customer is None:
+        customer = stripe_cache.put(get_stripe().Customer.retrieve(ref))
+    return customer
+
+
+def get_subscription(ref, fresh=False):
+    """
+    Subscription for an id or expanded object. Retrieved subscriptions come
+    with their customer expanded, which is cached too. `fresh` always
+    retrieves, for handlers that write the subscription's state.
+    """
+    if ref is None:
+        return None
+    if not isinstance(ref, str):
+        return remember_subscription(ref)
+    subscription = None if fresh else stripe_cache.get(ref)
+    if subscription is None:
+        subscription = remember_subscription(get_stripe().Subscription.retrieve(ref, expand=['customer']))
+    return subscription
+
+
+def remember_subscription(subscription, as_of=None):
+    """
+    Cache a subscription (e.g. from an event payload, with the event's
+    `created` as `as_of`) and its customer if expanded. Returns the newest
+    known snapshot, which is a cached one if the payload is out of date.
+    """
+    if not isinstance(subscription.customer, str):
+        stripe_cache.put(subscription.customer, as_of)
+    return stripe_cache.put(subscription, as_of)
+
+
+def claim_event(client, event):
+    """
+    True if this call is the first to handle `event`. Stripe redelivers
+    events and may send one to several workers, so the claim is an insert
+    into STRIPE_EVENTS_TABLE that only one of them can win.
+    """
+    if processed_events.get(event.id) is not None:
+        return False
+    result = client.table(STRIPE_EVENTS_TABLE).upsert(
+        {'event_id': event.id, 'event_type': event.type},
+        on_conflict='event_id',
+        ignore_duplicates=True
+    ).execute()
+    processed_events.put(event)
+    # Only a newly inserted row is returned
+    return bool(result.data)
@@ -0,0 +1,187 @@
+import threading
+import time
+from datetime import datetime
+
+from clients import get_stripe
+from config import STRIPE_SYNC_INTERVAL_SECONDS, STRIPE_SYNC_BATCH_SIZE
+
+SUBSCRIPTIONS_TABLE = 'subscriptions'
+SYNC_STATE_TABLE = 'sync_state'
+SYNC_NAME = 'stripe_subscriptions'
+
+SUBSCRIPTION_EVENTS = [
+    'customer.subscription.created',
+    'customer.subscription.updated',
+    'customer.subscription.deleted'
+]
+# Stripe only lists events from the last 30 days; older marks need a full scan
+EVENT_RETENTION_SECONDS = 29 * 86400
+# Re-read a little before the mark in case events were still being written
+HIGH_WATER_OVERLAP_SECONDS = 300
+# Columns written by the reconciler; every row in one upsert must have the same keys
+SYNC_COLUMNS = ('user_id', 'stripe_subscription_id', 'status', 'plan_type', 'end_date', 'cancelled_at', 'updated_at')
+
+
+def period_end(subscription):
+    # Newer API versions report the period on the subscription items instead
+    end = subscription.get('current_period_end')
+    if end is None:
+        items = subscription.get('items') or {}
+        data = items.get('data') or []
+        end = data[0].get('current_period_end') if data else None
+    return end
+
+
+def expected_state(subscription):
+    """The subscriptions columns a Stripe subscription implies, as the webhook handlers write them."""
+    if subscription.status == 'canceled':
+        return {'status': 'cancelled', 'plan_type': 'free'}
+    state = {'status': subscription.status}
+    end = period_end(subscription)
+    if end:
+        state['end_date'] = datetime.fromtimestamp(end).isoformat()
+    return state
+
+
+def _same_time(stored, expected):
+    if not stored or not expected:
+        return stored == expected
+    try:
+        stored_ts = datetime.fromisoformat(stored.replace('Z', '+00:00')).replace(tzinfo=None).timestamp()
+        return abs(stored_ts - datetime.fromisoformat(expected).timestamp()) < 1
+    except ValueError:
+        return False
+
+
+def diff_subscription(row, subscription):
+    """Changed columns for a stored row, or None if it already matches Stripe."""
+    changes = {}
+    for column, value in expected_state(subscription).items():
+        if column == 'end_date':
+            if not _same_time(row.get('end_date'), value):
+                changes[column] = value
+        elif row.get(column) != value:
+            changes[column] = value
+    if not changes:
+        return None
+    if changes.get('status') == 'cancelled' and not row.get('cancelled_at'):
+        changes['cancelled_at'] = datetime.utcnow().isoformat()
+    return changes
+
+
+def get_high_water(client):
+    result = client.table(SYNC_STATE_TABLE).select('high_water').eq('name', SYNC_NAME).execute()
+    return result.data[0]['high_water'] if result.data else None
+
+
+def set_high_water(client, value):
+    client.table(SYNC_STATE_TABLE).upsert({
+        'name': SYNC_NAME,
+        'high_water': value,
+        'updated_at': datetime.utcnow().isoformat()
+    }, on_conflict='name').execute()
+
+
+def changed_subscriptions(since):
+    """
+    Latest snapshot of every subscription changed since `since` (from the
+    event log), or of every subscription when `since` is None.
+    """
+    if since is None:
+        return {
+            subscription.id: subscription
+            for subscription in get_stripe().Subscription.list(status='all', limit=100).auto_paging_iter()
+        }
+
+    subscriptions = {}
+    events = get_stripe().Event.list(types=SUBSCRIPTION_EVENTS, created={'gte': since}, limit=100)
+    # Events are listed newest first, so the first one seen per subscription wins
+    for event in events.auto_paging_iter():
+        subscription = event.data.object
+        subscriptions.setdefault(subscription.id, subscription)
+    return subscriptions
+
+
+def reconcile_subscriptions(client, full=False, batch_size=STRIPE_SYNC_BATCH_SIZE):
+    """
+    Bring the subscriptions table in line with Stripe.
+
+    Incremental runs replay subscription events since the stored high-water
+    mark; the first run (or `full=True`, or a mark older than Stripe's event
+    retention) pages through every subscription. Stored rows are read and
+    changed rows written in batches. Subscriptions with no row yet are left
+    to the checkout webhook, which knows which user they belong to.
+    Returns counts of what was checked and updated.
+    """
+    started = int(time.time())
+    high_water = None if full else get_high_water(client)
+    if high_water is not None and started - high_water > EVENT_RETENTION_SECONDS:
+        high_water = None
+
+    since = None if high_water is None else high_water - HIGH_WATER_OVERLAP_SECONDS
+    subscriptions = changed_subscriptions(since)
+    ids = list(subscriptions)
+
+    updated = 0
+    matched = 0
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        result = client.table(SUBSCRIPTIONS_TABLE).select('*').in_('stripe_subscription_id', batch).execute()
+
+        now = datetime.utcnow().isoformat()
+        rows = []
+        for row in result.data or []:
+            matched += 1
+            changes = diff_subscription(row, subscriptions[row['stripe_subscription_id']])
+            if changes:
+                rows.append({column: row.get(column) for column in SYNC_COLUMNS} | changes | {'updated_at': now})
+
+        if rows:
+            client.table(SUBSCRIPTIONS_TABLE).upsert(rows, on_conflict='stripe_subscription_id').execute()
+            updated += len(rows)
+
+    set_high_water(client, started)
+    summary = {
+        'mode': 'full' if since is None else 'incremental',
+        'checked': len(ids),
+        'matched': matched,
+        'updated': updated
+    }
+    print(f"Reconciled Stripe subscriptions: {summary}")
+    return summary
+
+
+def start_reconciler(get_client, interval=STRIPE_SYNC_INTERVAL_SECONDS):
+    """
+    Run the reconciler every `interval` seconds in a daemon thread (0 disables it).
+    `get_client()` returns the Supabase client, so nothing is built unless it runs.
+    """
+    if interval <= 0:
+        return None
+
+    stopped = threading.Event()
+
+    def run():
+        while not stopped.wait(interval):
+            try:
+                reconcile_subscriptions(get_client())
+            except Exception as e:
+                print(f"Error reconciling Stripe subscriptions: {e}")
+
+    thread = threading.Thread(target=run, name='subscription-reconciler', daemon=True)
+    thread.stopped = stopped
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    # One-off run, e.g. from a scheduled job: python subscription_sync.py [--full]
+    from dotenv import load_dotenv
+    from supabase import create_client
+    import os
+    import sys
+
+    load_dotenv()
+    get_stripe().api_key = os.environ.get('STRIPE_SECRET_KEY')
+    supabase = create_client(os.environ.get('SUPABASE_URL'), os.environ.get('SUPABASE_KEY'))
+    reconcile_subscriptions(supabase, full='--full' in sys.argv)
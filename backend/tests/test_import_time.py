@@ -0,0 +1,38 @@
+import os
+import re
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# SDKs that must only be imported on first use (see clients.py)
+DEFERRED_MODULES = ('supabase', 'stripe', 'google.genai', 'tenacity')
+
+# Cumulative import time of `server`; about 0.2s on a laptop, with headroom for slow CI runners
+IMPORT_BUDGET_SECONDS = float(os.environ.get('IMPORT_BUDGET_SECONDS', '1.0'))
+
+
+def import_server():
+    """Import `server` in a fresh interpreter. Returns (deferred modules loaded, cumulative seconds)."""
+    code = (
+        "import sys, server; "
+        f"print(','.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    )
+    match = re.search(r'^import time:\s+\d+ \|\s+(\d+) \| server$', result.stderr, re.MULTILINE)
+    assert match, "no import time reported for server"
+    loaded = [name for name in result.stdout.strip().split(',') if name]
+    return loaded, int(match.group(1)) / 1e6
+
+
+def test_server_import_defers_sdks():
+    loaded, _ = import_server()
+    assert loaded == []
+
+
+def test_server_import_within_budget():
+    _, seconds = import_server()
+    assert seconds < IMPORT_BUDGET_SECONDS, f"importing server took {seconds:.3f}s (budget {IMPORT_BUDGET_SECONDS}s)"
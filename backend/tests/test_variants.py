@@ -0,0 +1,98 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('JWT_SECRET', 'test-secret-' + 'x' * 32)
+os.environ.setdefault('RATE_LIMIT_ENABLED', 'False')
+
+import server  # noqa: E402
+
+
+class FakeQuery:
+    """Chainable stand-in for a Supabase query that matches no rows."""
+
+    data = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        return self
+
+
+class FakeUsage:
+    def __init__(self):
+        self.count = 0
+
+    def get(self, client, user_id, date):
+        return {'summaries_count': self.count, 'total_characters': 0}
+
+    def increment(self, client, user_id, date, summaries=1, characters=0):
+        self.count += summaries
+
+
+@pytest.fixture
+def app(monkeypatch):
+    calls = []
+
+    def generate_summary_variants(text, length, variants, background=False):
+        calls.append(list(variants))
+        return [f"{tone}/{difficulty} summary" for tone, difficulty in variants]
+
+    def generate_summary(prompt, background=False):
+        calls.append(prompt)
+        return "single summary"
+
+    usage = FakeUsage()
+    monkeypatch.setattr(server, 'get_supabase', lambda: FakeQuery())
+    monkeypatch.setattr(server, 'get_gemini', lambda: object())
+    monkeypatch.setattr(server, 'get_user_limits', lambda user_id: {
+        'plan_type': 'pro', 'daily_summaries': 100, 'max_text_length': 10000
+    })
+    monkeypatch.setattr(server, 'usage_buffer', usage)
+    monkeypatch.setattr(server, 'publish_usage', lambda user_id, date: None)
+    monkeypatch.setattr(server, 'generate_summary_variants', generate_summary_variants)
+    monkeypatch.setattr(server, 'generate_summary', generate_summary)
+
+    user_id = str(uuid.uuid4())
+    client = server.app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = f"Bearer {server.issue_token(user_id)}"
+    return client, calls, usage
+
+
+def test_regenerate_after_variants_uses_cached_alternate(app):
+    client, calls, usage = app
+    text = f"Passage {uuid.uuid4()} about variant caching."
+
+    response = client.post('/summarize', json={'text': text, 'variants': [
+        {'tone': 'neutral', 'difficulty': 'medium'},
+        {'tone': 'casual', 'difficulty': 'easy'}
+    ]})
+    assert response.status_code == 200
+    assert len(calls) == 1
+    assert usage.count == 2
+
+    response = client.post('/summarize', json={'text': text, 'override_tone': 'casual', 'override_difficulty': 'easy'})
+    assert response.status_code == 200
+    assert response.get_json()['summary'] == 'casual/easy summary'
+    # Served from the alternate: no new Gemini call and no second charge
+    assert len(calls) == 1
+    assert usage.count == 2
+
+
+def test_regenerate_to_shown_variant_generates_new_text(app):
+    client, calls, usage = app
+    text = f"Passage {uuid.uuid4()} about variant caching."
+
+    client.post('/summarize', json={'text': text, 'variants': [
+        {'tone': 'formal', 'difficulty': 'hard'},
+        {'tone': 'casual', 'difficulty': 'easy'}
+    ]})
+    response = client.post('/summarize', json={'text': text, 'override_tone': 'formal', 'override_difficulty': 'hard'})
+    assert response.status_code == 200
+    # The first variant was the one shown, so it is generated again
+    assert response.get_json()['summary'] == 'single summary'
+    assert len(calls) == 2
@@ -0,0 +1,359 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+
+from config import (
+    USAGE_FLUSH_INTERVAL_SECONDS,
+    USAGE_CACHE_TTL_SECONDS,
+    USAGE_JOURNAL_DIR
+)
+from usage_rollups import apply_usage_deltas
+
+USAGE_TABLE = 'daily_usage'
+# Postgres function adding a batch of deltas atomically (migrations/008_atomic_usage_increments.sql)
+USAGE_INCREMENT_RPC = 'increment_daily_usage'
+
+
+class UsageJournal:
+    """
+    Optional append-only log of usage increments that have not been flushed.
+
+    Every increment is fsync'd before the request returns. Each worker
+    writes its own file; on startup, journals left behind by dead workers
+    are claimed (atomic rename) and replayed so a crash loses nothing.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.pid = os.getpid()
+        self.path = os.path.join(directory, f"usage-{self.pid}.jsonl")
+        self._file = None
+        self._seq = 0
+
+    def append(self, user_id, date, summaries, characters):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps({'u': user_id, 'd': date, 's': summaries, 'c': characters}) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def rotate(self):
+        """Seal the current file so a flush can delete exactly what it wrote out."""
+        if self._file is None:
+            return None
+        self._file.close()
+        self._file = None
+        self._seq += 1
+        sealed = f"{self.path}.{self._seq}"
+        try:
+            os.rename(self.path, sealed)
+        except FileNotFoundError:
+            return None
+        return sealed
+
+    def recover(self):
+        """Claim journals from dead workers. Returns (increments, claimed paths)."""
+        increments = []
+        claimed = []
+        for path in glob.glob(os.path.join(self.directory, '*.jsonl*')):
+            if not self._is_orphaned(path):
+                continue
+            target = os.path.join(self.directory, f"recovered-{self.pid}-{uuid.uuid4().hex}.jsonl")
+            try:
+                os.rename(path, target)
+            except OSError:
+                # Another worker claimed it first
+                continue
+            claimed.append(target)
+            with open(target, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        increments.append(json.loads(line))
+                    except ValueError:
+                        # Torn final line from a crash mid-write
+                        continue
+        return increments, claimed
+
+    def _is_orphaned(self, path):
+        name = os.path.basename(path)
+        try:
+            pid = int(name.split('-')[1].split('.')[0])
+        except (IndexError, ValueError):
+            return False
+        if pid == self.pid:
+            # Left over from a previous container run that reused our pid
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            pass
+        return False
+
+    @staticmethod
+    def discard(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Error removing usage journal {path}: {e}")
+
+
+def _accumulate(totals, key, summaries, characters):
+    current = totals.setdefault(key, [0, 0])
+    current[0] += summaries
+    current[1] += characters
+
+
+class UsageBuffer:
+    """
+    Write-behind buffer for a per-day usage table (daily_usage by default).
+
+    Increments are aggregated per (owner, date) and added in one atomic
+    RPC call every `flush_interval` seconds (and at exit), so flushes from
+    several workers never overwrite each other. Limit checks read
+    the stored row plus this worker's pending increments, so a user can't
+    exceed their limit by outrunning the flush.
+    """
+
+    def __init__(self, table=USAGE_TABLE, owner_column='user_id', increment_rpc=USAGE_INCREMENT_RPC, on_flush=None,
+                 flush_interval=USAGE_FLUSH_INTERVAL_SECONDS,
+                 cache_ttl=USAGE_CACHE_TTL_SECONDS, journal_dir=USAGE_JOURNAL_DIR):
+        self.table = table
+        self.owner_column = owner_column
+        self.increment_rpc = increment_rpc
+        self.on_flush = on_flush
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self._rows = {}       # (user_id, date) -> last stored row
+        self._loaded_at = {}  # (user_id, date) -> monotonic time the row was read
+        self._pending = {}    # (user_id, date) -> [summaries, characters]
+        self._inflight = {}   # increments currently being written by flush()
+        self._flush_seq = 0   # number of flushes started
+        self._batched_in = {}  # (user_id, date) -> seq of the last flush that wrote it
+        self._hook_backlog = {}  # flushed increments the on_flush hook failed to apply
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._client = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._journal = None
+        if journal_dir:
+            # Other tables journal into a subdirectory so buffers never claim each other's files
+            if table != USAGE_TABLE:
+                journal_dir = os.path.join(journal_dir, table)
+            self._journal = UsageJournal(journal_dir)
+        self._sealed_journals = []
+
+        if self._journal:
+            increments, claimed = self._journal.recover()
+            for entry in increments:
+                _accumulate(self._pending, (entry['u'], entry['d']), entry['s'], entry['c'])
+            self._sealed_journals.extend(claimed)
+            if increments:
+                print(f"Recovered {len(increments)} unflushed usage increments")
+
+    def get(self, client, user_id, date):
+        """Current usage for (user_id, date): stored row plus pending increments."""
+        key = (user_id, date)
+        with self._lock:
+            row = self._rows.get(key)
+            fresh = row is not None and time.monotonic() - self._loaded_at[key] < self.cache_ttl
+            seq = self._flush_seq
+            overlapped = key in self._inflight
+
+        if not fresh:
+            read_at = time.monotonic()
+            result = client.from_(self.table).select('*').eq(self.owner_column, user_id).eq('date', date).execute()
+            row = result.data[0] if result.data else {
+                self.owner_column: user_id,
+                'date': date,
+                'summaries_count': 0,
+                'total_characters': 0
+            }
+            with self._lock:
+                overlapped = overlapped or self._batched_in.get(key, -1) > seq
+            if overlapped:
+                # A flush of this key ran during the read, which may or may not
+                # include its increments; wait for it and use the row it stored
+                with self._flush_lock:
+                    pass
+            with self._lock:
+                if overlapped and self._loaded_at.get(key, 0) >= read_at:
+                    row = self._rows[key]
+                else:
+                    self._rows[key] = row
+                    self._loaded_at[key] = time.monotonic()
+
+        with self._lock:
+            summaries, characters = self._pending.get(key, (0, 0))
+            flushing = self._inflight.get(key, (0, 0))
+        summaries += flushing[0]
+        characters += flushing[1]
+        return {
+            **row,
+            'summaries_count': (row.get('summaries_count') or 0) + summaries,
+            'total_characters': (row.get('total_characters') or 0) + characters
+        }
+
+    def increment(self, client, user_id, date, summaries=1, characters=0):
+        # Journal and pending change together, so a flush always seals exactly
+        # the journal lines whose increments it takes
+        with self._lock:
+            if self._journal:
+                self._journal.append(user_id, date, summaries, characters)
+            _accumulate(self._pending, (user_id, date), summaries, characters)
+        self._client = client
+        self._ensure_flusher()
+
+    def reserve(self, client, owner, date, count, limit=None):
+        """
+        Take up to `count` summaries for (owner, date), capped at `limit` if
+        given. The count is added straight to the table with the increment
+        RPC, which returns the new total, so reservations made at the same
+        time on other workers can't all pass the same check. Returns how many
+        were granted; hand back any that go unused with `release`.
+        """
+        if count <= 0:
+            return 0
+        key = (owner, date)
+        rows = self._write(client, {key: (count, 0)})
+        granted = count
+        if limit is not None:
+            before = (rows[0].get('summaries_count') or 0) - count if rows else 0
+            with self._lock:
+                local = self._pending.get(key, (0, 0))[0] + self._inflight.get(key, (0, 0))[0]
+            granted = max(0, min(count, limit - before - local))
+            if granted < count:
+                self._write(client, {key: (granted - count, 0)})
+        self._stored_directly(client, key, granted)
+        return granted
+
+    def release(self, client, owner, date, count):
+        """Give back `count` reserved summaries that were not used."""
+        if count <= 0:
+            return
+        key = (owner, date)
+        self._write(client, {key: (-count, 0)})
+        self._stored_directly(client, key, -count)
+
+    def _stored_directly(self, client, key, summaries):
+        # The cached row may predate the write, or (mid-flush) be read back
+        # together with in-flight increments; re-read it on the next get()
+        with self._lock:
+            self._rows.pop(key, None)
+            self._loaded_at.pop(key, None)
+        if self.on_flush and summaries:
+            self._run_hook(client, {key: (summaries, 0)})
+
+    def flush(self, client=None):
+        """Write all pending increments in one RPC call. Safe to call from any thread."""
+        client = client or self._client
+        if client is None:
+            return
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending and not self._hook_backlog:
+                    return
+                batch = self._inflight = self._pending
+                self._pending = {}
+                self._flush_seq += 1
+                for key in batch:
+                    self._batched_in[key] = self._flush_seq
+                if self._journal:
+                    sealed = self._journal.rotate()
+                    if sealed:
+                        self._sealed_journals.append(sealed)
+                sealed_journals = self._sealed_journals
+                self._sealed_journals = []
+
+            try:
+                rows = self._write(client, batch) if batch else []
+            except Exception as e:
+                print(f"Error flushing usage buffer ({len(batch)} rows): {e}")
+                # Put the increments back so the next flush retries them
+                with self._lock:
+                    self._inflight = {}
+                    for key, (summaries, characters) in batch.items():
+                        _accumulate(self._pending, key, summaries, characters)
+                    self._sealed_journals = sealed_journals + self._sealed_journals
+                return
+
+            # The stored totals now include the batch: swap them in and drop
+            # the in-flight increments together so get() never counts both
+            now = time.monotonic()
+            with self._lock:
+                for row in rows:
+                    key = (row[self.owner_column], row['date'])
+                    self._rows[key] = row
+                    self._loaded_at[key] = now
+                self._inflight = {}
+                self._evict_stale()
+            if self._journal:
+                self._journal.discard(sealed_journals)
+
+            if self.on_flush:
+                self._run_hook(client, batch)
+
+    def _write(self, client, batch):
+        # insert ... on conflict do update set count = count + delta, in one
+        # statement; returns the stored totals after the increment
+        increments = [
+            {'owner': owner, 'date': date, 'summaries': summaries, 'characters': characters}
+            for (owner, date), (summaries, characters) in batch.items()
+        ]
+        result = client.rpc(self.increment_rpc, {'increments': increments}).execute()
+        return result.data or []
+
+    def _run_hook(self, client, batch):
+        # Deltas the hook failed on are retried with the next flush; if the
+        # worker dies first, derived data is rebuilt from the usage table
+        # (e.g. python usage_rollups.py)
+        with self._lock:
+            deltas = self._hook_backlog
+            self._hook_backlog = {}
+        for key, (summaries, characters) in batch.items():
+            _accumulate(deltas, key, summaries, characters)
+        try:
+            self.on_flush(client, deltas)
+        except Exception as e:
+            print(f"Error in {self.table} flush hook, retrying {len(deltas)} rows on the next flush: {e}")
+            with self._lock:
+                for key, (summaries, characters) in deltas.items():
+                    _accumulate(self._hook_backlog, key, summaries, characters)
+
+    def _evict_stale(self):
+        cutoff = time.monotonic() - max(self.cache_ttl, self.flush_interval) * 10
+        for key in [k for k, t in self._loaded_at.items() if t < cutoff and k not in self._pending]:
+            del self._rows[key]
+            del self._loaded_at[key]
+            self._batched_in.pop(key, None)
+        for key in [k for k in self._batched_in if k not in self._loaded_at]:
+            del self._batched_in[key]
+
+    def _ensure_flusher(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='usage-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stopped.set()
+        self.flush()
+
+
+usage_buffer = UsageBuffer(on_flush=apply_usage_deltas)
+atexit.register(usage_buffer.close)
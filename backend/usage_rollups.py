@@ -0,0 +1,170 @@
+from calendar import monthrange
+from datetime import date, timedelta
+
+ROLLUPS_TABLE = 'usage_rollups'
+USAGE_TABLE = 'daily_usage'
+
+PERIODS = ('week', 'month')
+GRANULARITIES = ('day',) + PERIODS
+
+# Buckets per response, at any granularity (daily buckets are read straight
+# from daily_usage, so that range must stay bounded too)
+MAX_BUCKETS = 366
+
+
+def period_start(day, period):
+    if period == 'week':
+        # ISO weeks start on Monday, matching date_trunc('week', ...) in Postgres
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def period_end(start, period):
+    """Last day (inclusive) of the period beginning on `start`."""
+    if period == 'week':
+        return start + timedelta(days=6)
+    return start.replace(day=monthrange(start.year, start.month)[1])
+
+
+def bucket_count(start, end, granularity):
+    """Number of day, week or month buckets covering `start`..`end`."""
+    if granularity == 'day':
+        return (end - start).days + 1
+    if granularity == 'week':
+        return (period_start(end, 'week') - period_start(start, 'week')).days // 7 + 1
+    return (end.year - start.year) * 12 + end.month - start.month + 1
+
+
+def bucket_starts(start, end, granularity):
+    """Start date of every bucket covering `start`..`end` (weeks and months may begin before `start`)."""
+    if granularity == 'day':
+        return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    starts = [period_start(start, granularity)]
+    while period_end(starts[-1], granularity) < end:
+        starts.append(period_end(starts[-1], granularity) + timedelta(days=1))
+    return starts
+
+
+def apply_usage_deltas(client, deltas):
+    """
+    Fold daily_usage increments into the weekly and monthly rollups.
+
+    `deltas` maps (user_id, 'YYYY-MM-DD') -> (summaries, characters), as
+    flushed by the usage buffer. The deltas are added in one atomic RPC
+    call (migrations/009_atomic_usage_rollups.sql), so concurrent flushes
+    from other workers are never overwritten.
+    """
+    increments = {}
+    for (user_id, day), (summaries, characters) in deltas.items():
+        day = date.fromisoformat(day)
+        for period in PERIODS:
+            key = (user_id, period, period_start(day, period).isoformat())
+            current = increments.setdefault(key, [0, 0])
+            current[0] += summaries
+            current[1] += characters
+
+    if not increments:
+        return
+    client.rpc('increment_usage_rollups', {'increments': [
+        {'user_id': user_id, 'period': period, 'period_start': start, 'summaries': summaries, 'characters': characters}
+        for (user_id, period, start), (summaries, characters) in increments.items()
+    ]}).execute()
+
+
+def rebuild_rollups(client, since):
+    """Recompute every rollup period starting on or after `since` from daily_usage."""
+    client.rpc('rebuild_usage_rollups', {'since': since.isoformat()}).execute()
+
+
+def _daily_rows(client, user_id, start, end):
+    result = client.from_(USAGE_TABLE).select('date,summaries_count,total_characters') \
+        .eq('user_id', user_id).gte('date', start.isoformat()).lte('date', end.isoformat()).execute()
+    return result.data or []
+
+
+def _bucket(start, summaries=0, characters=0):
+    return {
+        'start': start.isoformat(),
+        'summaries_count': summaries,
+        'total_characters': characters
+    }
+
+
+def usage_history(client, user_id, start, end, granularity='day'):
+    """
+    Usage between `start` and `end` (inclusive) in day, week or month buckets.
+
+    Week and month buckets that lie fully inside the range come from
+    usage_rollups; only the partial periods at either edge read daily rows,
+    so the cost doesn't grow with the length of the range.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of: {', '.join(GRANULARITIES)}")
+    if end < start:
+        raise ValueError("end must not be before start")
+    if bucket_count(start, end, granularity) > MAX_BUCKETS:
+        hint = "; use week or month" if granularity == 'day' else ""
+        raise ValueError(f"History is limited to {MAX_BUCKETS} {granularity} buckets{hint}")
+    try:
+        periods = bucket_starts(start, end, granularity)
+        # Periods lying fully inside the range are answered from the rollups
+        full = set() if granularity == 'day' else {
+            p for p in periods if p >= start and period_end(p, granularity) <= end
+        }
+    except OverflowError:
+        raise ValueError("start and end must leave room for a whole period before year 10000")
+
+    if granularity == 'day':
+        by_day = {row['date']: row for row in _daily_rows(client, user_id, start, end)}
+        buckets = []
+        for day in periods:
+            row = by_day.get(day.isoformat(), {})
+            buckets.append(_bucket(day, row.get('summaries_count') or 0, row.get('total_characters') or 0))
+    else:
+        rollups = {}
+        if full:
+            result = client.from_(ROLLUPS_TABLE).select('period_start,summaries_count,total_characters') \
+                .eq('user_id', user_id).eq('period', granularity) \
+                .gte('period_start', min(full).isoformat()).lte('period_start', max(full).isoformat()).execute()
+            rollups = {row['period_start']: row for row in result.data or []}
+
+        buckets = []
+        for p in periods:
+            if p in full:
+                row = rollups.get(p.isoformat(), {})
+                buckets.append(_bucket(p, row.get('summaries_count') or 0, row.get('total_characters') or 0))
+            else:
+                # Partial period at the edge of the range: at most two of these
+                rows = _daily_rows(client, user_id, max(p, start), min(period_end(p, granularity), end))
+                buckets.append(_bucket(
+                    p,
+                    sum(row.get('summaries_count') or 0 for row in rows),
+                    sum(row.get('total_characters') or 0 for row in rows)
+                ))
+
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'granularity': granularity,
+        'buckets': buckets,
+        'totals': {
+            'summaries_count': sum(b['summaries_count'] for b in buckets),
+            'total_characters': sum(b['total_characters'] for b in buckets)
+        }
+    }
+
+
+if __name__ == '__main__':
+    # Repair drifted rollups, e.g. from a scheduled job: python usage_rollups.py [--since YYYY-MM-DD]
+    from dotenv import load_dotenv
+    from supabase import create_client
+    import os
+    import sys
+
+    load_dotenv()
+    supabase = create_client(os.environ.get('SUPABASE_URL'), os.environ.get('SUPABASE_KEY'))
+    since = date.today() - timedelta(days=62)
+    if '--since' in sys.argv:
+        since = date.fromisoformat(sys.argv[sys.argv.index('--since') + 1])
+    rebuild_rollups(supabase, since)
+    print(f"Rebuilt usage rollups since {since.isoformat()}")
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    VARIANT_CACHE_SIZE,
+    VARIANT_CACHE_TTL_SECONDS,
+    VARIANT_PREFETCH_ENABLED,
+    VARIANT_PREFETCH_COUNT,
+    VARIANT_PREFETCH_WORKERS
+)
+from prompts import PROMPT_VERSION
+
+# Users whose regeneration history is kept in memory
+HISTORY_MAX_USERS = 10000
+
+
+def text_digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def variant_key(user_id, digest, length, tone, difficulty):
+    # The prompt version sits in front so (tone, difficulty) stay the last two items;
+    # editing a template makes every older cached summary unreachable
+    return (PROMPT_VERSION, user_id, digest, length, tone, difficulty)
+
+
+class VariantCache:
+    """LRU of cached variants per (user, text, length, tone, difficulty), with a TTL."""
+
+    def __init__(self, max_size=VARIANT_CACHE_SIZE, ttl=VARIANT_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            summary, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return summary
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            return None
+        return entry[0]
+
+    def put(self, key, summary):
+        with self._lock:
+            self._entries[key] = (summary, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class RegenerationHistory:
+    """Which tone/difficulty combinations each user regenerates to, most common first."""
+
+    def __init__(self, max_users=HISTORY_MAX_USERS):
+        self.max_users = max_users
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, user_id, tone, difficulty):
+        with self._lock:
+            counts = self._counts.get(user_id)
+            if counts is None:
+                counts = self._counts[user_id] = Counter()
+            counts[(tone, difficulty)] += 1
+            self._counts.move_to_end(user_id)
+            while len(self._counts) > self.max_users:
+                self._counts.popitem(last=False)
+
+    def likely_variants(self, user_id, tone, difficulty, count):
+        with self._lock:
+            counts = self._counts.get(user_id)
+            if not counts:
+                return []
+            ranked = [variant for variant, _ in counts.most_common() if variant != (tone, difficulty)]
+        return ranked[:count]
+
+
+class VariantPrefetcher:
+    """
+    Generates likely regeneration variants in the background.
+
+    Nothing is charged here; quota is only used when a regenerate request
+    is served from the cache. The cache holds prefetched variants and the
+    alternates of multi-variant requests (`put`), which were charged when
+    they were returned and are marked prepaid so switching to one isn't
+    charged again. Each entry is served once, and the summary a user was
+    shown for their current settings is never cached, so a regenerate
+    never gets that text back. A regenerate that arrives while its variant
+    is still being generated waits for that call instead of starting
+    another. Several variants can be produced by one job (one
+    multi-variant LLM call).
+    """
+
+    def __init__(self, cache, history, workers=VARIANT_PREFETCH_WORKERS):
+        self.cache = cache
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='variant-prefetch')
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def schedule(self, keys, generate):
+        """
+        Run `generate(keys)` for the keys that are neither cached nor already
+        running. `generate` returns one summary per key it is given, in order.
+        """
+        keys = [key for key in keys if self.cache.get(key) is None]
+        with self._lock:
+            keys = [key for key in keys if key not in self._inflight]
+            if not keys:
+                return None
+            future = self._executor.submit(self._run, keys, generate)
+            for key in keys:
+                self._inflight[key] = future
+        return future
+
+    def _run(self, keys, generate):
+        try:
+            summaries = dict(zip(keys, generate(keys)))
+            for key, summary in summaries.items():
+                self.cache.put(key, (summary, False))
+            return summaries
+        except Exception as e:
+            print(f"Error prefetching summary variants: {e}")
+            return {}
+        finally:
+            with self._lock:
+                for key in keys:
+                    self._inflight.pop(key, None)
+
+    def put(self, key, summary, prepaid=False):
+        """Cache a summary generated outside the prefetcher, e.g. a multi-variant alternate."""
+        self.cache.put(key, (summary, prepaid))
+
+    def take(self, key, timeout):
+        """
+        (summary, prepaid) for `key`, waiting up to `timeout` for an in-flight
+        prefetch; (None, False) if there is none. The summary is removed so it
+        is served only once.
+        """
+        entry = self.cache.pop(key)
+        if entry is not None:
+            return entry
+        with self._lock:
+            future = self._inflight.get(key)
+        if future is None:
+            return None, False
+        try:
+            summary = future.result(timeout=timeout).get(key)
+        except Exception:
+            return None, False
+        self.cache.pop(key)
+        return summary, False
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+variant_cache = VariantCache()
+regeneration_history = RegenerationHistory()
+variant_prefetcher = VariantPrefetcher(variant_cache, regeneration_history)
+
+
+def prefetch_enabled(settings, is_pro):
+    """Speculative generation is opt-in per user and only for pro plans."""
+    return VARIANT_PREFETCH_ENABLED and is_pro and bool(settings.get('prefetch_variants'))
+
+
+def prefetch_likely_variants(user_id, digest, length, tone, difficulty, generate_variants):
+    """
+    Queue the user's most frequent alternate tone/difficulty pairs for this text.
+
+    `generate_variants([(tone, difficulty), ...])` must return one summary
+    per pair, in order.
+    """
+    pairs = regeneration_history.likely_variants(user_id, tone, difficulty, VARIANT_PREFETCH_COUNT)
+    if not pairs:
+        return
+    keys = [variant_key(user_id, digest, length, t, d) for t, d in pairs]
+    variant_prefetcher.schedule(
+        keys,
+        # Variant keys end with (tone, difficulty)
+        lambda pending: generate_variants([key[-2:] for key in pending])
+    )
+
+
+def parse_variant_response(raw, count):
+    """
+    Parse a multi-variant JSON response into {index: summary}.
+
+    Entries with an unknown id or an empty summary are dropped; callers
+    regenerate whatever is missing.
+    """
+    items = json.loads(raw)
+    if isinstance(items, dict):
+        items = items.get('summaries', [])
+    if not isinstance(items, list):
+        raise ValueError("Variant response is not a JSON array")
+
+    summaries = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        index = item.get('id')
+        summary = item.get('summary')
+        if isinstance(index, int) and not isinstance(index, bool) and 0 <= index < count and isinstance(summary, str) and summary.strip():
+            summaries.setdefault(index, summary.strip())
+    return summaries
@@ -574,7 +574,7 @@ export const deleteAccount = async () => {
     if (!user) throw new Error('User not authenticated');
 
     // Delete user's data from all tables
-    const tables = ['summaries', 'user_settings', 'subscriptions', 'daily_usage'];
+    const tables = ['summaries', 'summaries_archive', 'user_settings', 'subscriptions', 'daily_usage'];
     
     for (const table of tables) {
       const { error } = await supabase
@@ -585,6 +585,10 @@ export const deleteAccount = async () => {
       if (error) throw error;
     }
 
+    // Tables only the backend writes to (api_keys, usage_rollups, token_revocations)
+    const { error: dataError } = await supabase.rpc('delete_account_data');
+    if (dataError) throw dataError;
+
     // Delete the user's auth account
     const { error: authError } = await supabase.auth.admin.deleteUser(user.id);
     if (authError) throw authError;